@@ -3,21 +3,70 @@ import psycopg2
 import argparse
 import sys
 import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
 
-from redshift_etl_template.src.sql_queries import star_tables, staging_tables
-from redshift_etl_template.src.utils import get_top_elements_from_table, get_log_errors
+from redshift_etl_template.src.sql_queries import star_tables, staging_tables, history_tables
+from redshift_etl_template.src.utils import get_log_errors
+from redshift_etl_template.src.data_quality import run_quality_checks
+from redshift_etl_template.src.cache import QueryCache
+from redshift_etl_template.src.profiling import profile_tables, is_redshift
+from redshift_etl_template.src.previews import preview_tables
+from redshift_etl_template.src.aggregates import get_staleness
+from redshift_etl_template.src.backends import TranslatingCursor, translate_to_postgres
 from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def check_database_content(cur):
-    """Check top 5 elements for each table in the database"""
-    for table in staging_tables + star_tables:
-        df = get_top_elements_from_table(cur, table)
+def check_database_content(pool, cache=None, max_workers=4, statement_timeout=60.0):
+    """Check top 5 elements and row count for each table in the database,
+    querying the tables concurrently and logging each of them as soon as it completes
+
+    Returns:
+        bool, True if every table could be queried
+    """
+    passed = True
+    for result in preview_tables(pool, staging_tables + star_tables + history_tables, max_workers,
+                                 statement_timeout=statement_timeout, cache=cache):
+        if result["error"] is not None:
+            logger.error(" --Table : {} failed after {:.2f}s: {}".format(
+                result["table"], result["duration"], result["error"]))
+            passed = False
+            continue
         with pd.option_context('display.max_rows', None, 'display.max_columns', None):
-            logger.info(" --Table : {}\n{}\n".format(table,df))
+            logger.info(" --Table : {} ({} rows, {:.2f}s)\n{}\n".format(
+                result["table"], result["n_rows"], result["duration"], result["df"]))
+    return passed
+
+
+def profile_database_content(cur):
+    """Log catalog statistics and approximate column profiles for each table in the database"""
+    tables = staging_tables + star_tables
+    df_info, profiles = profile_tables(cur, tables)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+        logger.info(" --Tables\n{}\n".format(df_info))
+        for table in tables:
+            logger.info(" --Table : {}\n{}\n".format(table, profiles[table]))
+
+
+def check_database_quality(cur):
+    """Run the data quality checks of every table
+
+    Returns:
+        bool
+    """
+    df_report = run_quality_checks(cur)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+        logger.info(" --Data quality report\n{}\n".format(df_report))
+    return bool(df_report["passed"].all())
+
+
+def check_aggregates_staleness(cur):
+    """Log the last refresh of every aggregate table and the seconds elapsed since then"""
+    df_staleness = get_staleness(cur)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+        logger.info(" --Aggregates staleness\n{}\n".format(df_staleness))
 
 
 def parse_input(args):
@@ -26,6 +75,28 @@ def parse_input(args):
     parser.add_argument("--path_config_current",
                         help="path of the configuration file of launched infrastructure",
                         default=CONFIG_PATH_DWH_CURRENT)
+    parser.add_argument("--data_quality",
+                        help="run the data quality checks instead of querying the head of the tables, \
+                        exit with a non-zero code if any check fails",
+                        action="store_true")
+    parser.add_argument("--profile",
+                        help="log approximate cardinalities, quantiles and catalog statistics \
+                        of the tables instead of their head",
+                        action="store_true")
+    parser.add_argument("--staleness",
+                        help="log when each aggregate table was last refreshed instead of the head of the tables",
+                        action="store_true")
+    parser.add_argument("--cache_dir",
+                        help="directory where the query results are cached until the etl writes on their tables",
+                        default=None)
+    parser.add_argument("--max_workers",
+                        help="maximum number of tables queried at once, each on its own pooled connection",
+                        type=int,
+                        default=4)
+    parser.add_argument("--statement_timeout",
+                        help="seconds after which a query on a table is cancelled",
+                        type=float,
+                        default=60.0)
     return parser.parse_args(args)
 
 
@@ -37,15 +108,37 @@ def main(args=None):
     config = configparser.ConfigParser()
     config.read(args.path_config_current)
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    dsn = "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
+    conn = psycopg2.connect(dsn)
     cur = conn.cursor()
 
-    logger.info("Log of current machine:\n")
-    df_error = get_log_errors(cur)
-    logger.info("Content of current database")
-    check_database_content(cur)
+    redshift = is_redshift(cur)
+    if redshift:
+        logger.info("Log of current machine:\n")
+        df_error = get_log_errors(cur)
+    if args.data_quality:
+        logger.info("Quality of current database")
+        passed = check_database_quality(cur)
+    elif args.profile:
+        logger.info("Profile of current database")
+        profile_database_content(cur)
+        passed = True
+    elif args.staleness:
+        logger.info("Staleness of the aggregate tables")
+        check_aggregates_staleness(cur if redshift else TranslatingCursor(cur, translate_to_postgres))
+        passed = True
+    else:
+        logger.info("Content of current database")
+        cache = QueryCache(args.cache_dir) if args.cache_dir else None
+        pool = ThreadedConnectionPool(1, args.max_workers, dsn)
+        try:
+            passed = check_database_content(pool, cache, args.max_workers, args.statement_timeout)
+        finally:
+            pool.closeall()
 
     conn.close()
+    if not passed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+import os
+import configparser
+import psycopg2
+import argparse
+import sys
+
+from redshift_etl_template.src import plans
+from redshift_etl_template.src.backends import get_backend, BACKENDS
+from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def parse_input(args):
+    parser = argparse.ArgumentParser(description="Script to explain the statements of the etl \
+                                                 and compare their plans against the committed baselines")
+    parser.add_argument("--path_config_current",
+                        help="path of the configuration file of launched infrastructure",
+                        default=CONFIG_PATH_DWH_CURRENT)
+    parser.add_argument("--backend",
+                        help="warehouse whose plans are checked, each one has its own baselines",
+                        choices=BACKENDS,
+                        default="redshift")
+    parser.add_argument("--recorded",
+                        help="replay the plans recorded on the backend instead of connecting to it",
+                        action="store_true")
+    parser.add_argument("--record",
+                        help="explain the statements on the database and save their plans as the new recording",
+                        action="store_true")
+    parser.add_argument("--fixtures",
+                        help="explain the statements on the fixtures of the tests, loaded and analyzed \
+                        in a schema of their own, instead of the tables of the warehouse",
+                        action="store_true")
+    parser.add_argument("--fixture_rounds",
+                        help="with --fixtures, number of times the fixtures are doubled",
+                        type=int,
+                        default=10)
+    parser.add_argument("--update_baselines",
+                        help="accept the current plans as the new baselines",
+                        action="store_true")
+    parser.add_argument("--cost_tolerance",
+                        help="admitted relative growth of the estimated cost of a statement",
+                        type=float,
+                        default=0.5)
+    parser.add_argument("--plans_dir",
+                        help="directory of the recorded plans and of the baselines",
+                        default=plans.DIR_PLANS)
+    parsed_args = parser.parse_args(args)
+    if parsed_args.recorded and (parsed_args.record or parsed_args.fixtures):
+        parser.error("--record and --fixtures need a database, they cannot be combined with --recorded")
+    return parsed_args
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_input(args)
+
+    recorded_path = os.path.join(args.plans_dir, "recorded_{}.json".format(args.backend))
+    baseline_path = os.path.join(args.plans_dir, "baseline_{}.json".format(args.backend))
+    conn = None
+    if args.recorded:
+        cur = plans.RecordedPlanCursor(plans.load_plans(recorded_path))
+    else:
+        config = configparser.ConfigParser()
+        config.read(args.path_config_current)
+        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+        cur = get_backend(args.backend, conn, config).cursor()
+        if args.fixtures:
+            logger.info("Loading the fixtures in the schema {}..".format(plans.PLAN_FIXTURES_SCHEMA))
+            cur.execute("DROP SCHEMA IF EXISTS {} CASCADE;".format(plans.PLAN_FIXTURES_SCHEMA))
+            cur.execute("CREATE SCHEMA {};".format(plans.PLAN_FIXTURES_SCHEMA))
+            cur.execute("SET search_path TO {};".format(plans.PLAN_FIXTURES_SCHEMA))
+            plans.load_fixtures(cur, conn, args.fixture_rounds)
+
+    if args.record:
+        logger.info("Recording the plans of {} statements in {}..".format(len(plans.plan_statements), recorded_path))
+        plans.save_plans(recorded_path, plans.record_plans(cur))
+    if args.update_baselines:
+        current = {name: plans.normalize_plan(plans.explain(cur, query))
+                   for name, query in plans.plan_statements.items()}
+        violations = {name: plans.check_rules(name, plan) for name, plan in current.items()}
+        violations = {name: rules for name, rules in violations.items() if rules}
+        passed = not violations
+        if passed:
+            logger.info("Saving the current plans as baselines in {}..".format(baseline_path))
+            plans.save_plans(baseline_path, current)
+        else:
+            logger.error("Baselines not saved, the plans break their rules: {}".format(violations))
+    else:
+        results = plans.check_plans(cur, plans.load_plans(baseline_path), cost_tolerance=args.cost_tolerance)
+        regressed = [name for name, (regressions, _) in results.items() if regressions]
+        logger.info("{} statements checked, {} regressed {}".format(len(results), len(regressed), regressed))
+        passed = not regressed
+
+    if conn is not None:
+        if args.fixtures:
+            conn.rollback()
+            cur.execute("DROP SCHEMA {} CASCADE;".format(plans.PLAN_FIXTURES_SCHEMA))
+            conn.commit()
+        conn.close()
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,25 +3,31 @@ import psycopg2
 import argparse
 import sys
 
-from redshift_etl_template.src.sql_queries import create_table_queries, drop_table_queries
+from redshift_etl_template.src.sql_queries import create_table_queries, drop_table_queries, \
+    staging_create_table_queries, staging_drop_table_queries, staging_tables, star_tables, history_tables, \
+    songplay_table_create
+from redshift_etl_template.src.aggregate_queries import aggregate_create_queries, aggregate_drop_queries, \
+    aggregate_tables
+from redshift_etl_template.src.cache import table_versions_queries
+from redshift_etl_template.src.transactions import TransactionRunner, COMMIT_POLICIES
+from redshift_etl_template.src.backends import get_backend, BACKENDS
+from redshift_etl_template.src import time_series
 from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def drop_tables(cur, conn):
+def drop_tables(cur, conn, queries=drop_table_queries, runner=None):
     logger.info("Dropping existing tables...")
-    for query in drop_table_queries:
-        cur.execute(query)
-        conn.commit()
+    runner = runner or TransactionRunner(cur, conn)
+    runner.execute_group(queries)
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, queries=create_table_queries, runner=None):
     logger.info("Creating empty tables...")
-    for query in create_table_queries:
-        cur.execute(query)
-        conn.commit()
+    runner = runner or TransactionRunner(cur, conn)
+    runner.execute_group(queries)
 
 
 def parse_input(args):
@@ -30,7 +36,25 @@ def parse_input(args):
     parser.add_argument("--path_config_current",
                         help="path of the configuration file of launched infrastructure",
                         default=CONFIG_PATH_DWH_CURRENT)
-    return parser.parse_args(args)
+    parser.add_argument("--staging_only",
+                        help="recreate only the staging tables, leaving the star tables online",
+                        action="store_true")
+    parser.add_argument("--commit_policy",
+                        help="commit after every statement, after every group of statements or once per run",
+                        choices=COMMIT_POLICIES,
+                        default="statement")
+    parser.add_argument("--backend",
+                        help="warehouse of the configured connection, postgres translates the redshift ddl",
+                        choices=BACKENDS,
+                        default="redshift")
+    parser.add_argument("--sliced_songplays",
+                        help="create songplays as a view over one table per month, \
+                        filled by the etl and dropped month by month with --retention_months",
+                        action="store_true")
+    parsed_args = parser.parse_args(args)
+    if parsed_args.staging_only and parsed_args.sliced_songplays:
+        parser.error("--sliced_songplays recreates songplays, it cannot be combined with --staging_only")
+    return parsed_args
 
 
 def main(args=None):
@@ -42,10 +66,21 @@ def main(args=None):
     config.read(args.path_config_current)
 
     conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
-
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
+    cur = get_backend(args.backend, conn, config).cursor()
+
+    runner = TransactionRunner(cur, conn, args.commit_policy)
+    if args.staging_only:
+        drop_tables(cur, conn, staging_drop_table_queries, runner)
+        create_tables(cur, conn, staging_create_table_queries + table_versions_queries(staging_tables), runner)
+    else:
+        drop_tables(cur, conn, time_series.drop_statements(cur) + drop_table_queries + aggregate_drop_queries, runner)
+        queries = create_table_queries
+        if args.sliced_songplays:
+            queries = [query for query in create_table_queries if query != songplay_table_create] + \
+                      [time_series.build_view_create(None, [])]
+        create_tables(cur, conn, queries + aggregate_create_queries
+                      + table_versions_queries(staging_tables + star_tables + history_tables + aggregate_tables), runner)
+    runner.finish()
 
     conn.close()
 
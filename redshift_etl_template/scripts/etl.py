@@ -2,26 +2,253 @@ import configparser
 import psycopg2
 import argparse
 import sys
+import boto3
+import functools
+import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
 
-from redshift_etl_template.src.sql_queries import copy_table_queries, insert_table_queries
+from redshift_etl_template.src.sql_queries import insert_table_queries, \
+    staging_events_copy_manifest, staging_songs_copy_manifest, staging_tables, star_tables, songplay_table_insert, \
+    songplays_delta_queries, songplays_delta_table_create, songplays_delta_table_drop, songplays_delta_loaded_delete, \
+    table_queries, users_history_queries, users_scd_queries, history_tables, create_table_queries, \
+    staging_drop_table_queries
+from redshift_etl_template.src import sources, blue_green, time_series
+from redshift_etl_template.src.aggregates import refresh_aggregates, execute_refresh
+from redshift_etl_template.src.cache import table_versions_queries
+from redshift_etl_template.src.ledger import RunLedger
+from redshift_etl_template.src.late_events import reconcile_late_events, execute_reconcile
+from redshift_etl_template.src.wlm import WlmCatalog, WlmScheduler, get_queue_capacity
+from redshift_etl_template.src.transactions import TransactionRunner, COMMIT_POLICIES
+from redshift_etl_template.src.backends import get_backend, BACKENDS
+from redshift_etl_template.src.follow import Follower, MicroBatcher, S3Source, LocalSource
+from redshift_etl_template.src.external import external_query, EXTERNAL_SCHEMA
+from redshift_etl_template.src.datasets import load_datasets, build_dataset_config, ConcurrencyBudget, DatasetRunner
 from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def load_staging_tables(cur, conn):
-    logger.info("Copying json files from s3 to redshift..")
-    for query in copy_table_queries:
-        cur.execute(query)
-        conn.commit()
+def load_staging_sample(cur, conn, s3, config, fraction, manifest_prefix, sample_events=False, runner=None):
+    """Copy a deterministic fraction of the source files from s3 to redshift.
+    Song files are sampled by key hash. Event files are small and are loaded fully
+    unless sample_events is set, so that every staged song keeps all of its plays
+    and the songplays built from the sample stay consistent with the dimensions.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        s3(boto3.resources.base.ServiceResource): s3 resource
+        config(configparser.ConfigParser): configuration of the current machine
+        fraction(float): fraction of source files to load, in (0, 1]
+        manifest_prefix(str): s3 prefix where the sample manifests are written
+        sample_events(bool): if True, sample also the event files
+        runner(TransactionRunner): runner grouping the statements into transactions
+    """
+    logger.info("Copying a {:.2%} sample of json files from s3 to redshift..".format(fraction))
+    sources_to_copy = [
+        (config.get("S3", "log_data"), staging_events_copy_manifest, fraction if sample_events else 1),
+        (config.get("S3", "song_data"), staging_songs_copy_manifest, fraction),
+    ]
+    copy_queries = []
+    for uri, copy_query, source_fraction in sources_to_copy:
+        bucket, _ = sources.parse_s3_uri(uri)
+        keys = sources.sample_keys(sources.list_source_keys(s3, uri), source_fraction)
+        manifest_uri = "{}/{}.manifest".format(manifest_prefix.rstrip("/"), uri.rstrip("/").split("/")[-1])
+        sources.write_manifest(s3, manifest_uri, sources.build_manifest(bucket, keys))
+        copy_queries.append(copy_query.format(manifest_uri))
+    runner = runner or TransactionRunner(cur, conn)
+    runner.execute_group([table_queries[table]["delete"] for table in staging_tables] + copy_queries
+                         + table_versions_queries(staging_tables))
+
+
+def dedupe_staging_tables(cur, conn, runner=None):
+    """Keep one row per natural key in the staging tables:
+    events by (sessionId, itemInSession, ts), songs by song_id.
+    A table is rewritten only if it has duplicated keys, in a single transaction whatever the commit policy,
+    so that its rows are never deleted without being inserted again.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        runner(TransactionRunner): runner grouping the statements into transactions
+    """
+    runner = runner or TransactionRunner(cur, conn)
+    for table in staging_tables:
+        cur.execute(table_queries[table]["duplicates"])
+        n_keys = cur.fetchone()[0]
+        if n_keys:
+            logger.info("Removing the duplicates of {} keys from {}..".format(n_keys, table))
+            runner.execute_atomic(table_queries[table]["dedupe"] + table_versions_queries([table]))
+
+
+def update_users_history(cur, conn, runner=None, queries=users_scd_queries):
+    """Record the changes of the staged users as new versions of users_history,
+    closing their current versions and removing them from users, that inserts them again.
+    Only the users whose attributes changed are written.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        runner(TransactionRunner): runner grouping the statements into transactions
+        queries(list): statements updating the history
+    """
+    logger.info("Recording the changes of the users..")
+    runner = runner or TransactionRunner(cur, conn)
+    runner.execute_group(queries + table_versions_queries(["users"] + history_tables))
 
 
-def insert_tables(cur, conn):
+def insert_tables(cur, conn, runner=None, queries=insert_table_queries):
     logger.info("Processing staged data to fill analytics tables..")
-    for query in insert_table_queries:
-        cur.execute(query)
+    runner = runner or TransactionRunner(cur, conn)
+    runner.execute_group(queries + table_versions_queries(star_tables))
+
+
+def run_checkpointed(cur, conn, run_id, max_retries, backoff, skip_aggregates=False,
+                     reconcile_late_events=False, pending_window_days=7):
+    """Copy and insert data, refresh the aggregates and reconcile the late events,
+    recording every stage in the run ledger.
+    Stages completed by a previous attempt of the same run are skipped,
+    so the songplays of a resumed run are not summed twice into the aggregates.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        run_id(str): identifier of the run, shared by all its attempts
+        max_retries(int): attempts of a failing stage before stopping the run
+        backoff(float): seconds to wait before the first retry, doubled at every retry
+        skip_aggregates(bool): if True, do not refresh the aggregate tables
+        reconcile_late_events(bool): if True, insert the songplays of the pending events
+        pending_window_days(int): days an event is kept waiting for its song
+    """
+    stages = [("copy_{}".format(table), [table_queries[table]["delete"], table_queries[table]["copy"]]
+               + table_versions_queries([table]))
+              for table in staging_tables] + \
+             [("dedupe_{}".format(table), table_queries[table]["dedupe"] + table_versions_queries([table]))
+              for table in staging_tables] + \
+             [("history_users", users_scd_queries + table_versions_queries(["users"] + history_tables))] + \
+             [("insert_{}".format(table), table_queries[table].get("delta", []) + [table_queries[table]["insert"]]
+               + table_versions_queries([table]))
+              for table in star_tables]
+    if skip_aggregates:
+        stages.append(("drop_songplays_delta", [songplays_delta_table_drop]))
+    else:
+        stages.append(("refresh_aggregates", execute_refresh))
+    if reconcile_late_events:
+        stages.append(("reconcile_late_events",
+                       lambda cur: execute_reconcile(cur, pending_window_days, not skip_aggregates)))
+    ledger = RunLedger(cur, conn, run_id, max_retries, backoff)
+    ledger.run_stages(stages)
+
+
+def run_parallel(scheduler, connect, queries):
+    """Run independent statements in parallel within the wlm slots,
+    giving more slots to the memory heavy songplays join
+    Args:
+        scheduler(WlmScheduler): scheduler sized on the wlm queue
+        connect(function): function returning a new psycopg2 connection
+        queries(list): independent statements
+    """
+    durations = scheduler.run(connect, [(query, query == songplays_delta_table_create) for query in queries])
+    logger.info("{} statements run in parallel, {:.2f}s of statement time".format(len(queries), sum(durations)))
+
+
+def run_follow(backend, cur, conn, config, args):
+    """Load the event files appearing in the source in micro batches, until interrupted
+    Args:
+        backend(WarehouseBackend): backend of the connection
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        config(configparser.ConfigParser): configuration of the current machine
+        args(argparse.Namespace): parsed arguments of the script
+    """
+    batcher = MicroBatcher(args.batch_max_bytes, args.batch_max_seconds, args.max_pending_files)
+    s3 = None
+    if backend.name == "redshift":
+        s3 = boto3.resource(
+            "s3",
+            region_name="us-west-2",
+            aws_access_key_id=config.get("AWS", "KEY"),
+            aws_secret_access_key=config.get("AWS", "SECRET")
+        )
+        source = S3Source(s3, args.follow_source or config.get("S3", "log_data"))
+    else:
+        source = LocalSource(args.follow_source or backend.get_source("staging_events"))
+    logger.info("Following new event files..")
+    history = Follower(backend, cur, conn, source, batcher, s3, args.manifest_prefix).run(args.poll_interval)
+    logger.info("{} batches loaded, {} new events".format(len(history), sum(batch["n_events"] for batch in history)))
+
+
+def run_dataset(backend_name, config, commit_policy, skip_aggregates, conn, dataset, run_step, metrics):
+    """Load a dataset into the tables of its schema, with the steps of the default run.
+    Every step runs within the concurrency budget shared with the other datasets.
+    Args:
+        backend_name(str): one of BACKENDS
+        config(configparser.ConfigParser): configuration of the current machine
+        commit_policy(str): one of COMMIT_POLICIES
+        skip_aggregates(bool): if True, do not refresh the aggregate tables
+        conn(psycopg2.connection): pooled connection of the dataset
+        dataset(dict): dataset definition
+        run_step(function): function running a step within the budget
+        metrics(dict): metrics of the dataset
+    """
+    backend = get_backend(backend_name, conn, build_dataset_config(config, dataset, backend_name))
+    cur = backend.cursor()
+    try:
+        cur.execute("CREATE SCHEMA IF NOT EXISTS {};".format(dataset["schema"]))
+        cur.execute("SET search_path TO {};".format(dataset["schema"]))
         conn.commit()
+        runner = TransactionRunner(cur, conn, commit_policy)
+        run_step(lambda: runner.execute_group(staging_drop_table_queries + create_table_queries
+                                             + table_versions_queries(staging_tables)))
+        run_step(lambda: backend.load_staging_tables(runner))
+        run_step(lambda: dedupe_staging_tables(cur, conn, runner))
+        run_step(lambda: update_users_history(cur, conn, runner))
+        if time_series.is_sliced(cur):
+            run_step(lambda: insert_tables(cur, conn, runner, [query for query in insert_table_queries
+                                                               if query != songplay_table_insert]))
+            run_step(lambda: time_series.load_months(cur, conn, runner))
+        else:
+            run_step(lambda: insert_tables(cur, conn, runner))
+        runner.finish()
+        if not skip_aggregates:
+            run_step(lambda: refresh_aggregates(cur, conn))
+        else:
+            TransactionRunner(cur, conn).execute_group([songplays_delta_table_drop])
+        cur.execute("SELECT COUNT(*) FROM songplays;")
+        metrics["songplays"] = cur.fetchone()[0]
+    finally:
+        # the connection goes back to the pool as it was taken
+        conn.rollback()
+        cur.execute("RESET search_path;")
+        conn.commit()
+
+
+def run_datasets(args, config, dsn, backend):
+    """Run the datasets of the definitions file concurrently, on a shared pool of connections
+    Args:
+        args(argparse.Namespace): parsed arguments of the script
+        config(configparser.ConfigParser): configuration of the current machine
+        dsn(str): connection string of the database
+        backend(WarehouseBackend): backend of the main connection
+
+    Returns:
+        pd.DataFrame, metrics of every dataset
+    """
+    datasets = load_datasets(args.datasets)
+    budget_size = args.concurrency_budget
+    if budget_size is None:
+        # with auto wlm the queue has no fixed slots, every dataset may run a step at once
+        budget_size = get_queue_capacity(WlmCatalog(backend.cursor()).get_queue_slots(), args.max_datasets) \
+            if backend.name == "redshift" else args.max_datasets
+    logger.info("Running {} datasets, {} at once, with a budget of {} concurrent steps..".format(
+        len(datasets), args.max_datasets, budget_size))
+    pool = ThreadedConnectionPool(1, args.max_datasets, dsn)
+    try:
+        dataset_runner = DatasetRunner(pool, ConcurrencyBudget(budget_size), args.max_datasets)
+        pipeline = functools.partial(run_dataset, backend.name, config, args.commit_policy, args.skip_aggregates)
+        df_metrics = dataset_runner.run(pipeline, datasets)
+    finally:
+        pool.closeall()
+    with pd.option_context('display.max_columns', None, 'display.width', None):
+        logger.info(" --Datasets\n{}\n".format(df_metrics))
+    return df_metrics
 
 
 def parse_input(args):
@@ -30,7 +257,161 @@ def parse_input(args):
     parser.add_argument("--path_config_current",
                         help="path of the configuration file of launched infrastructure",
                         default=CONFIG_PATH_DWH_CURRENT)
-    return parser.parse_args(args)
+    parser.add_argument("--sample",
+                        help="fraction of source files to load, chosen by a hash of their key",
+                        type=float,
+                        default=None)
+    parser.add_argument("--sample_events",
+                        help="apply the sample fraction also to the event files",
+                        action="store_true")
+    parser.add_argument("--manifest_prefix",
+                        help="s3 prefix where the manifests of the sampled files are written",
+                        default=None)
+    parser.add_argument("--blue_green",
+                        help="build the star tables in shadow tables and swap them in once validated",
+                        action="store_true")
+    parser.add_argument("--min_ratio",
+                        help="in blue/green mode, minimum ratio between new and live row counts to allow the swap",
+                        type=float,
+                        default=0.0)
+    parser.add_argument("--parallel",
+                        help="run copies and inserts concurrently, within the slots of the wlm queue",
+                        action="store_true")
+    parser.add_argument("--max_workers",
+                        help="in parallel mode, maximum number of statements running at once",
+                        type=int,
+                        default=None)
+    parser.add_argument("--run_id",
+                        help="record the stages in the run ledger, skipping those completed \
+                        by a previous attempt with the same run id",
+                        default=None)
+    parser.add_argument("--max_retries",
+                        help="with --run_id, attempts of a failing stage before stopping the run",
+                        type=int,
+                        default=3)
+    parser.add_argument("--retry_backoff",
+                        help="with --run_id, seconds to wait before the first retry, doubled at every retry",
+                        type=float,
+                        default=30.0)
+    parser.add_argument("--reconcile_late_events",
+                        help="keep the events without song metadata pending, and insert their songplays \
+                        when the song is loaded by a later run",
+                        action="store_true")
+    parser.add_argument("--pending_window_days",
+                        help="days an event is kept waiting for its song",
+                        type=int,
+                        default=7)
+    parser.add_argument("--skip_aggregates",
+                        help="do not refresh the aggregate tables after filling the star tables",
+                        action="store_true")
+    parser.add_argument("--commit_policy",
+                        help="commit after every statement (default), after every group of statements \
+                        or once per run",
+                        choices=COMMIT_POLICIES,
+                        default=None)
+    parser.add_argument("--backend",
+                        help="warehouse of the configured connection, postgres loads the local json sources",
+                        choices=BACKENDS,
+                        default="redshift")
+    parser.add_argument("--follow",
+                        help="keep running, loading the new event files in micro batches \
+                        and appending their plays to songplays and time",
+                        action="store_true")
+    parser.add_argument("--follow_source",
+                        help="in follow mode, s3 prefix or local directory watched for event files, \
+                        log_data of the configuration by default",
+                        default=None)
+    parser.add_argument("--poll_interval",
+                        help="in follow mode, seconds between two listings of the source",
+                        type=float,
+                        default=30.0)
+    parser.add_argument("--batch_max_bytes",
+                        help="in follow mode, size of the files that releases a batch",
+                        type=int,
+                        default=64 * 1024 * 1024)
+    parser.add_argument("--batch_max_seconds",
+                        help="in follow mode, seconds a file waits before its batch is released",
+                        type=float,
+                        default=300.0)
+    parser.add_argument("--max_pending_files",
+                        help="in follow mode, maximum number of files queued, \
+                        the others wait in the source until there is room",
+                        type=int,
+                        default=1000)
+    parser.add_argument("--external",
+                        help="fill the analytics tables reading the raw sources in place \
+                        from the external tables registered by query_external.py, without COPY",
+                        action="store_true")
+    parser.add_argument("--external_schema",
+                        help="external schema of the raw sources",
+                        default=EXTERNAL_SCHEMA)
+    parser.add_argument("--months",
+                        help="with --external, comma separated YYYY-MM months of the events to read, \
+                        the partitions of the other months are not scanned",
+                        default=None)
+    parser.add_argument("--retention_months",
+                        help="with songplays sliced by month (create_tables.py --sliced_songplays), \
+                        drop the months older than this number of months before the latest one",
+                        type=int,
+                        default=None)
+    parser.add_argument("--datasets",
+                        help="file defining several datasets, one section each with its target schema \
+                        and its log_data, song_data and log_jsonpath sources, run concurrently",
+                        default=None)
+    parser.add_argument("--max_datasets",
+                        help="with --datasets, maximum number of datasets loaded at once, \
+                        each on a connection of the shared pool",
+                        type=int,
+                        default=4)
+    parser.add_argument("--concurrency_budget",
+                        help="with --datasets, maximum number of steps running at once across all the datasets, \
+                        the slots of the wlm queue on redshift by default",
+                        type=int,
+                        default=None)
+    parsed_args = parser.parse_args(args)
+    if parsed_args.sample is not None and parsed_args.manifest_prefix is None:
+        parser.error("--sample requires --manifest_prefix")
+    if parsed_args.parallel and (parsed_args.sample is not None or parsed_args.blue_green):
+        parser.error("--parallel cannot be combined with --sample or --blue_green")
+    if parsed_args.parallel and parsed_args.commit_policy is not None:
+        parser.error("--parallel commits every statement on its own connection, "
+                     "it cannot be combined with --commit_policy")
+    parsed_args.commit_policy = parsed_args.commit_policy or "statement"
+    if parsed_args.run_id is not None and (parsed_args.sample is not None or parsed_args.blue_green
+                                           or parsed_args.parallel):
+        parser.error("--run_id cannot be combined with --sample, --blue_green or --parallel")
+    if parsed_args.reconcile_late_events and parsed_args.blue_green:
+        parser.error("--reconcile_late_events cannot be combined with --blue_green, which rebuilds songplays")
+    if parsed_args.backend != "redshift" and (parsed_args.sample is not None or parsed_args.parallel
+                                              or parsed_args.run_id is not None):
+        parser.error("--sample, --parallel and --run_id need the redshift backend")
+    if parsed_args.follow and (parsed_args.sample is not None or parsed_args.blue_green or parsed_args.parallel
+                               or parsed_args.run_id is not None or parsed_args.reconcile_late_events):
+        parser.error("--follow cannot be combined with --sample, --blue_green, --parallel, --run_id "
+                     "or --reconcile_late_events")
+    if parsed_args.follow and parsed_args.backend == "redshift" and parsed_args.manifest_prefix is None:
+        parser.error("--follow requires --manifest_prefix to write the manifests of the batches")
+    if parsed_args.external and (parsed_args.sample is not None or parsed_args.blue_green or parsed_args.parallel
+                                 or parsed_args.run_id is not None or parsed_args.reconcile_late_events
+                                 or parsed_args.follow or parsed_args.backend != "redshift"):
+        parser.error("--external needs the redshift backend and cannot be combined with --sample, --blue_green, "
+                     "--parallel, --run_id, --reconcile_late_events or --follow")
+    if parsed_args.months is not None and not parsed_args.external:
+        parser.error("--months requires --external")
+    if parsed_args.retention_months is not None and parsed_args.retention_months < 1:
+        parser.error("--retention_months must keep at least one month")
+    if parsed_args.datasets is not None and (parsed_args.sample is not None or parsed_args.blue_green
+                                             or parsed_args.parallel or parsed_args.run_id is not None
+                                             or parsed_args.follow or parsed_args.external
+                                             or parsed_args.reconcile_late_events
+                                             or parsed_args.retention_months is not None):
+        parser.error("--datasets runs the default load of every dataset, it cannot be combined with --sample, "
+                     "--blue_green, --parallel, --run_id, --follow, --external, --reconcile_late_events "
+                     "or --retention_months")
+    if parsed_args.max_datasets < 1 or (parsed_args.concurrency_budget is not None
+                                        and parsed_args.concurrency_budget < 1):
+        parser.error("--max_datasets and --concurrency_budget must be positive")
+    return parsed_args
 
 
 def main(args=None):
@@ -41,11 +422,107 @@ def main(args=None):
     config = configparser.ConfigParser()
     config.read(args.path_config_current)
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
+    dsn = "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
+    conn = psycopg2.connect(dsn)
+    backend = get_backend(args.backend, conn, config)
+    cur = backend.cursor()
 
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    if args.datasets is not None:
+        df_metrics = run_datasets(args, config, dsn, backend)
+        conn.close()
+        if (df_metrics["status"] != "succeeded").any():
+            sys.exit(1)
+        return
+    sliced = time_series.is_sliced(cur)
+    if sliced and (args.follow or args.run_id is not None or args.parallel or args.external or args.blue_green
+                   or args.reconcile_late_events):
+        raise Exception("songplays is sliced by month, only the default load can write it: "
+                        "recreate it with create_tables.py to use the other modes")
+    if args.retention_months is not None and not sliced:
+        raise Exception("--retention_months needs songplays sliced by month, see create_tables.py --sliced_songplays")
+    if args.follow:
+        run_follow(backend, cur, conn, config, args)
+        conn.close()
+        return
+    if args.run_id is not None:
+        run_checkpointed(cur, conn, args.run_id, args.max_retries, args.retry_backoff, args.skip_aggregates,
+                         args.reconcile_late_events, args.pending_window_days)
+        logger.info("ETL completed, disconnecting from the database..")
+        conn.close()
+        return
+    if args.parallel:
+        connect = lambda: psycopg2.connect(
+            "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+        scheduler = WlmScheduler(WlmCatalog(cur), max_workers=args.max_workers)
+        logger.info("Copying json files from s3 to redshift in parallel..")
+        TransactionRunner(cur, conn).execute_group([table_queries[table]["delete"] for table in staging_tables])
+        run_parallel(scheduler, connect, [backend.get_copy_query(table, backend.get_source(table))
+                                          for table in staging_tables])
+        # the statements commit on their own connections, the versions are recorded once all of them are done
+        TransactionRunner(cur, conn).execute_group(table_versions_queries(staging_tables))
+        dedupe_staging_tables(cur, conn)
+        update_users_history(cur, conn)
+        logger.info("Joining the staged data into songplays_delta..")
+        TransactionRunner(cur, conn).execute_group([songplays_delta_table_drop])
+        run_parallel(scheduler, connect, [songplays_delta_table_create])
+        TransactionRunner(cur, conn).execute_group([songplays_delta_loaded_delete])
+        logger.info("Processing staged data to fill analytics tables in parallel..")
+        run_parallel(scheduler, connect, [query for query in insert_table_queries
+                                          if query not in songplays_delta_queries])
+        TransactionRunner(cur, conn).execute_group(table_versions_queries(star_tables))
+    elif args.external:
+        months = None if args.months is None else \
+            [tuple(int(part) for part in month.split("-")) for month in args.months.split(",")]
+        runner = TransactionRunner(cur, conn, args.commit_policy)
+        update_users_history(cur, conn, runner, [external_query(query, args.external_schema, months)
+                                                 for query in users_scd_queries])
+        insert_tables(cur, conn, runner, [external_query(query, args.external_schema, months)
+                                          for query in insert_table_queries])
+        runner.finish()
+    else:
+        runner = TransactionRunner(cur, conn, args.commit_policy)
+        if args.sample is None:
+            logger.info("Loading the sources of the configuration into the staging tables of {}..".format(
+                args.backend))
+            backend.load_staging_tables(runner)
+        else:
+            s3 = boto3.resource(
+                "s3",
+                region_name="us-west-2",
+                aws_access_key_id=config.get("AWS", "KEY"),
+                aws_secret_access_key=config.get("AWS", "SECRET")
+            )
+            load_staging_sample(cur, conn, s3, config, args.sample, args.manifest_prefix, args.sample_events,
+                                runner)
+        dedupe_staging_tables(cur, conn, runner)
+        if args.blue_green:
+            # the shadow users are filled from the history, the live ones are left as they are
+            update_users_history(cur, conn, runner, users_history_queries)
+            runner.finish()
+            blue_green.build_shadow_tables(cur, conn)
+            blue_green.validate_shadow_tables(cur, args.min_ratio)
+            blue_green.swap_shadow_tables(cur, conn)
+        elif sliced:
+            update_users_history(cur, conn, runner)
+            insert_tables(cur, conn, runner, [query for query in insert_table_queries
+                                              if query != songplay_table_insert])
+            months = time_series.load_months(cur, conn, runner)
+            runner.finish()
+            if args.retention_months is not None:
+                time_series.drop_old_months(cur, conn, args.retention_months)
+            if months:
+                logger.info("Vacuuming the songplays of {}-{:02d}..".format(*months[-1]))
+                time_series.vacuum_month(cur, conn, *months[-1])
+        else:
+            update_users_history(cur, conn, runner)
+            insert_tables(cur, conn, runner)
+            runner.finish()
+    if not args.skip_aggregates:
+        refresh_aggregates(cur, conn, full=args.blue_green or args.external)
+    else:
+        TransactionRunner(cur, conn).execute_group([songplays_delta_table_drop])
+    if args.reconcile_late_events:
+        reconcile_late_events(cur, conn, args.pending_window_days, not args.skip_aggregates)
 
     logger.info("ETL completed, disconnecting from the database..")
     conn.close()
@@ -0,0 +1,65 @@
+import os
+import configparser
+import psycopg2
+import argparse
+import sys
+import boto3
+
+from redshift_etl_template.src import export
+from redshift_etl_template.src.sql_queries import star_tables
+from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, DIR_DATA, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def parse_input(args):
+    parser = argparse.ArgumentParser(description="Script to export the star tables to parquet files \
+                                                 partitioned by year and month")
+    parser.add_argument("--path_config_current",
+                        help="path of the configuration file of launched infrastructure",
+                        default=CONFIG_PATH_DWH_CURRENT)
+    parser.add_argument("--output",
+                        help="s3 prefix to unload the tables to, or a local directory \
+                        to export them from a local database",
+                        default=os.path.join(DIR_DATA, "export"))
+    parser.add_argument("--tables",
+                        help="tables to be exported",
+                        nargs="+",
+                        choices=star_tables,
+                        default=star_tables)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_input(args)
+
+    config = configparser.ConfigParser()
+    config.read(args.path_config_current)
+
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    cur = conn.cursor()
+
+    if args.output.startswith("s3://"):
+        s3 = boto3.resource(
+            "s3",
+            region_name="us-west-2",
+            aws_access_key_id=config.get("AWS", "KEY"),
+            aws_secret_access_key=config.get("AWS", "SECRET")
+        )
+        for table in args.tables:
+            logger.info("Unloading {}..".format(table))
+            export.unload_table(cur, s3, table, "{}/{}".format(args.output.rstrip("/"), table),
+                                config.get("IAM_ROLE", "arn"))
+    else:
+        for table in args.tables:
+            logger.info("Exporting {} from the local database..".format(table))
+            export.export_table_local(conn, table, os.path.join(args.output, table))
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import configparser
+import psycopg2
+import argparse
+import sys
+import boto3
+import pandas as pd
+
+from redshift_etl_template.src.external import register_external_tables, connect_local, EXTERNAL_SCHEMA
+from redshift_etl_template.src.utils import get_typed_dataframe
+from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, DIR_DATA, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def parse_input(args):
+    parser = argparse.ArgumentParser(description="Script to register the raw sources as external tables \
+                                                 and to query them in place, without loading them")
+    parser.add_argument("--path_config_current",
+                        help="path of the configuration file of launched infrastructure",
+                        default=CONFIG_PATH_DWH_CURRENT)
+    parser.add_argument("--register",
+                        help="create the external schema and tables on redshift, \
+                        adding a partition for every YYYY/MM folder of the events",
+                        action="store_true")
+    parser.add_argument("--catalog_database",
+                        help="database of the data catalog holding the external tables",
+                        default="sparkify")
+    parser.add_argument("--external_schema",
+                        help="schema of the external tables",
+                        default=EXTERNAL_SCHEMA)
+    parser.add_argument("--query",
+                        help="query on the external tables, e.g. \
+                        SELECT COUNT(*) FROM spectrum.log_events WHERE year = 2018 AND month = 11",
+                        default=None)
+    parser.add_argument("--local",
+                        help="run the query with duckdb on local copies of the sources instead of redshift",
+                        action="store_true")
+    parser.add_argument("--log_dir",
+                        help="with --local, directory of the log files, organized in YYYY/MM folders",
+                        default=None)
+    parser.add_argument("--song_dir",
+                        help="with --local, directory of the song files",
+                        default=None)
+    parsed_args = parser.parse_args(args)
+    if parsed_args.local and parsed_args.register:
+        parser.error("--register needs redshift, local sources are exposed at every query")
+    if parsed_args.local and parsed_args.query is None:
+        parser.error("--local requires --query")
+    return parsed_args
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_input(args)
+
+    config = configparser.ConfigParser()
+    config.read(args.path_config_current)
+
+    if args.local:
+        directories = {
+            "staging_events": args.log_dir or config.get("LOCAL", "log_data",
+                                                         fallback=os.path.join(DIR_DATA, "log_data")),
+            "staging_songs": args.song_dir or config.get("LOCAL", "song_data",
+                                                         fallback=os.path.join(DIR_DATA, "song_data"))
+        }
+        df = connect_local(directories, args.external_schema).execute(args.query).df()
+    else:
+        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+        if args.register:
+            s3 = boto3.resource(
+                "s3",
+                region_name="us-west-2",
+                aws_access_key_id=config.get("AWS", "KEY"),
+                aws_secret_access_key=config.get("AWS", "SECRET")
+            )
+            register_external_tables(conn, s3, config, args.external_schema, args.catalog_database)
+        df = None
+        if args.query is not None:
+            cur = conn.cursor()
+            cur.execute(args.query)
+            df = get_typed_dataframe(cur.fetchall(), cur.description)
+        conn.close()
+    if df is not None:
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            logger.info(" --Result\n{}\n".format(df))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import configparser
+import psycopg2
+import argparse
+import sys
+
+from redshift_etl_template.src.blue_green import rollback_swap
+from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def parse_input(args):
+    parser = argparse.ArgumentParser(description="Script to restore the star tables replaced \
+                                                 by the last blue/green etl run")
+    parser.add_argument("--path_config_current",
+                        help="path of the configuration file of launched infrastructure",
+                        default=CONFIG_PATH_DWH_CURRENT)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_input(args)
+
+    config = configparser.ConfigParser()
+    config.read(args.path_config_current)
+
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    cur = conn.cursor()
+
+    rollback_swap(cur, conn)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import configparser
+import psycopg2
+import argparse
+import sys
+import pandas as pd
+
+from redshift_etl_template.src import distribution
+from redshift_etl_template.src.profiling import is_redshift
+from redshift_etl_template.src.transactions import TransactionRunner
+from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def advise_distribution(cur, table, n_sample, n_slices, redshift=True):
+    """Measure the skew of a staging table and rank the alternative distributions
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        table(str): name of the staging table
+        n_sample(int): number of rows sampled to simulate the alternatives
+        n_slices(int): number of slices of the cluster
+        redshift(bool): if False, the current skew is simulated from the sample
+
+    Returns:
+        pd.DataFrame
+    """
+    _, other_table, _ = distribution.distribution_candidates[table]["join"]
+    if redshift:
+        # a deep copy changes the distribution on the cluster and not in the DDL of the project
+        distkey = distribution.get_live_distkey(cur, table)
+        other_distkey = distribution.get_live_distkey(cur, other_table)
+    else:
+        distkey = distribution.get_distkey(distribution.distribution_candidates[table]["create_query"])
+        other_distkey = distribution.get_distkey(distribution.distribution_candidates[other_table]["create_query"])
+
+    df_sample = distribution.sample_table(cur, table, n_sample)
+    if redshift:
+        slice_rows = distribution.get_slice_rows(cur, table)
+    elif distkey == distribution.EVEN:
+        slice_rows = distribution.simulate_even_rows(len(df_sample), n_slices)
+    else:
+        slice_rows = distribution.simulate_slice_rows(df_sample[distkey].tolist(), n_slices)
+    logger.info("{} distributed on {}: skew ratio {:.2f}, rows per slice {}".format(
+        table, distkey, distribution.skew_ratio(slice_rows), slice_rows))
+    if distkey != distribution.EVEN:
+        hot_keys = distribution.get_table_hot_keys(cur, table, distkey) if redshift else \
+            distribution.get_hot_keys(df_sample[distkey].tolist())
+        logger.info("Hottest keys of {}: {}".format(distkey, hot_keys))
+
+    df_candidates = distribution.recommend_distribution(df_sample, table, n_slices, other_distkey)
+    with pd.option_context('display.max_columns', None, 'display.width', None):
+        logger.info(" --Candidate distributions of {}\n{}\n".format(table, df_candidates))
+    return df_candidates
+
+
+def apply_distribution(cur, conn, table, new_distribution):
+    """Deep copy a staging table with an approved distribution.
+    The table keeps it until create_tables.py recreates it from the DDL of the project
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        table(str): name of the staging table
+        new_distribution(str): candidate key, or 'even'
+    """
+    create_query = distribution.distribution_candidates[table]["create_query"]
+    logger.info("Deep copying {} with distribution {}..".format(table, new_distribution))
+    runner = TransactionRunner(cur, conn, "group")
+    runner.execute_group(distribution.deep_copy_statements(table, create_query, new_distribution))
+    declared = distribution.get_distkey(create_query)
+    if declared != new_distribution:
+        logger.warning("{} is declared with distribution {} in src/sql_queries.py, the next create_tables.py "
+                       "reverts the deep copy: update the DDL to keep {}".format(table, declared, new_distribution))
+
+
+def parse_input(args):
+    parser = argparse.ArgumentParser(description="Script to measure the distribution skew of the staging tables \
+                                                 and recommend alternative distribution keys")
+    parser.add_argument("--path_config_current",
+                        help="path of the configuration file of launched infrastructure",
+                        default=CONFIG_PATH_DWH_CURRENT)
+    parser.add_argument("--table",
+                        help="staging table to be analysed, all of them by default",
+                        choices=list(distribution.distribution_candidates),
+                        default=None)
+    parser.add_argument("--n_sample",
+                        help="number of rows sampled to simulate the candidate distributions",
+                        type=int,
+                        default=100000)
+    parser.add_argument("--n_slices",
+                        help="number of slices to simulate, read from the cluster by default",
+                        type=int,
+                        default=None)
+    parser.add_argument("--apply",
+                        help="approve a distribution (a column or 'even') for --table and apply it with a deep copy",
+                        default=None)
+    parsed_args = parser.parse_args(args)
+    if parsed_args.apply is not None and parsed_args.table is None:
+        parser.error("--apply requires --table")
+    if parsed_args.apply is not None and \
+            parsed_args.apply.lower() in distribution.get_compound_distributions(parsed_args.table):
+        parser.error("--apply cannot distribute on the compound key {}: a DISTKEY is a single column, "
+                     "and the COPY of {} cannot fill a column hashing the pair".format(
+                         parsed_args.apply, parsed_args.table))
+    if parsed_args.apply is not None and \
+            parsed_args.apply.lower() not in distribution.get_candidate_distributions(parsed_args.table):
+        parser.error("--apply must be one of the candidate distributions of {}: {}".format(
+            parsed_args.table, ", ".join(distribution.get_candidate_distributions(parsed_args.table))))
+    return parsed_args
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_input(args)
+
+    config = configparser.ConfigParser()
+    config.read(args.path_config_current)
+
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    cur = conn.cursor()
+
+    redshift = is_redshift(cur)
+    n_slices = args.n_slices or (distribution.get_n_slices(cur) if redshift else 4)
+    tables = [args.table] if args.table else list(distribution.distribution_candidates)
+    for table in tables:
+        advise_distribution(cur, table, args.n_sample, n_slices, redshift)
+
+    if args.apply is not None:
+        apply_distribution(cur, conn, args.table, args.apply.lower())
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
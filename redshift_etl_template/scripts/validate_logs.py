@@ -0,0 +1,68 @@
+import os
+import time
+import argparse
+import sys
+
+from redshift_etl_template.src import validation
+from redshift_etl_template.src.sql_queries import staging_events_table_create, staging_songs_table_create
+from redshift_etl_template.constants import DIR_DATA, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def validate_source(directory, create_query, keys, processes):
+    """Validate all the json files of a local source against a staging table
+
+    Returns:
+        int, number of bad rows
+    """
+    paths = validation.list_json_files(directory)
+    start = time.perf_counter()
+    reports = validation.validate_files(paths, validation.parse_table_schema(create_query), keys, processes)
+    duration = time.perf_counter() - start
+    n_bytes = sum(os.path.getsize(path) for path in paths)
+    n_rows = sum(report["n_rows"] for report in reports)
+    n_bad_rows = sum(report["n_bad_rows"] for report in reports)
+    logger.info("{}: {} files, {} rows, {} bad rows, {:.1f} MB/s".format(
+        directory, len(paths), n_rows, n_bad_rows, n_bytes / 1024 ** 2 / max(duration, 1e-9)))
+    for report in reports:
+        for error in report["errors"]:
+            logger.info("{} line {}: {} {} ({})".format(
+                report["file"], error["line"], error["column"], error["reason"], error["value"]))
+    return n_bad_rows
+
+
+def parse_input(args):
+    parser = argparse.ArgumentParser(description="Script to validate local copies of the json sources \
+                                                 against the staging tables before loading them")
+    parser.add_argument("--log_dir",
+                        help="local directory with the log files",
+                        default=os.path.join(DIR_DATA, "log_data"))
+    parser.add_argument("--song_dir",
+                        help="local directory with the song files",
+                        default=os.path.join(DIR_DATA, "song_data"))
+    parser.add_argument("--log_jsonpath",
+                        help="local copy of the jsonpaths file used to copy the log files",
+                        default=os.path.join(DIR_DATA, "log_json_path.json"))
+    parser.add_argument("--processes",
+                        help="number of worker processes, one per core by default",
+                        type=int,
+                        default=None)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args = parse_input(args)
+
+    n_bad_rows = validate_source(args.log_dir, staging_events_table_create,
+                                 validation.load_jsonpaths(args.log_jsonpath), args.processes)
+    n_bad_rows += validate_source(args.song_dir, staging_songs_table_create, None, args.processes)
+    if n_bad_rows:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
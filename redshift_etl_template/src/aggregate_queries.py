@@ -0,0 +1,95 @@
+# REFRESH LOG
+aggregate_refresh_log_create = ("""
+CREATE TABLE IF NOT EXISTS aggregate_refresh_log (
+    aggregate 		VARCHAR 	NOT NULL,
+    refreshed_at 	TIMESTAMP 	NOT NULL,
+    delta_rows 		BIGINT 		NOT NULL,
+    duration_s 		FLOAT 		NOT NULL,
+    full_refresh 	BOOLEAN 	NOT NULL
+)
+diststyle all
+SORTKEY (refreshed_at)
+;""")
+aggregate_refresh_log_insert = """
+INSERT INTO aggregate_refresh_log (aggregate, refreshed_at, delta_rows, duration_s, full_refresh)
+VALUES (%s, GETDATE(), %s, %s, %s)
+"""
+aggregate_staleness_select = """
+SELECT aggregate, MAX(refreshed_at) AS refreshed_at, DATEDIFF(second, MAX(refreshed_at), GETDATE()) AS staleness_s
+FROM aggregate_refresh_log
+GROUP BY aggregate
+ORDER BY aggregate
+"""
+
+# AGGREGATES
+# Each aggregate declares its table, its group keys and the select computing it from a songplays source.
+# Only additive measures are allowed, so that a delta can be merged by summing it to the current values.
+aggregates = {
+    "plays_by_hour": {
+        "create": ("""
+CREATE TABLE IF NOT EXISTS plays_by_hour (
+    day 		DATE 		NOT NULL,
+    hour 		INT 		NOT NULL,
+    level 		VARCHAR 	NOT NULL,
+    plays 		BIGINT 		NOT NULL
+)
+diststyle all
+SORTKEY (day, hour)
+;"""),
+        "keys": ["day", "hour", "level"],
+        "measures": ["plays"],
+        "select": """
+SELECT
+    TRUNC(sp.start_time) AS day,
+    EXTRACT(hour FROM sp.start_time) AS hour,
+    sp.level AS level,
+    COUNT(*) AS plays
+FROM {} AS sp
+GROUP BY 1, 2, 3
+"""
+    },
+    "plays_by_level": {
+        "create": ("""
+CREATE TABLE IF NOT EXISTS plays_by_level (
+    level 		VARCHAR 	NOT NULL,
+    plays 		BIGINT 		NOT NULL
+)
+diststyle all
+;"""),
+        "keys": ["level"],
+        "measures": ["plays"],
+        "select": """
+SELECT
+    sp.level AS level,
+    COUNT(*) AS plays
+FROM {} AS sp
+GROUP BY 1
+"""
+    },
+    "plays_by_song": {
+        "create": ("""
+CREATE TABLE IF NOT EXISTS plays_by_song (
+    song_id 		VARCHAR 	NOT NULL,
+    artist_id 		VARCHAR 	NOT NULL,
+    plays 		BIGINT 		NOT NULL
+)
+diststyle all
+SORTKEY (song_id)
+;"""),
+        "keys": ["song_id", "artist_id"],
+        "measures": ["plays"],
+        "select": """
+SELECT
+    sp.song_id AS song_id,
+    sp.artist_id AS artist_id,
+    COUNT(*) AS plays
+FROM {} AS sp
+GROUP BY 1, 2
+"""
+    }
+}
+aggregate_tables = list(aggregates)
+
+# QUERY LISTS
+aggregate_drop_queries = ["DROP TABLE IF EXISTS {}".format(name) for name in aggregates]
+aggregate_create_queries = [aggregate["create"] for aggregate in aggregates.values()]
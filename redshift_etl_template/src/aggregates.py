@@ -0,0 +1,152 @@
+import time
+import pandas as pd
+
+from redshift_etl_template.src.aggregate_queries import aggregates, aggregate_create_queries, aggregate_tables, \
+    aggregate_refresh_log_create, aggregate_refresh_log_insert, aggregate_staleness_select
+from redshift_etl_template.src.cache import table_versions_queries
+from redshift_etl_template.src.transactions import run_in_transaction
+from redshift_etl_template.src.sql_queries import songplays_delta_table_drop
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def merge_statements(name, aggregate, source):
+    """Build the statements summing the aggregate of a songplays source into an aggregate table
+    Args:
+        name(str): name of the aggregate table
+        aggregate(dict): declaration of the aggregate
+        source(str): table with the new songplays
+
+    Returns:
+        list
+    """
+    delta = "{}_delta".format(name)
+    columns = aggregate["keys"] + aggregate["measures"]
+    match = " AND ".join("{0}.{1} = d.{1}".format(name, key) for key in aggregate["keys"])
+    return [
+        "DROP TABLE IF EXISTS {};".format(delta),
+        "CREATE TEMP TABLE {} AS {};".format(delta, aggregate["select"].format(source).strip()),
+        "UPDATE {0} SET {1} FROM {2} AS d WHERE {3};".format(
+            name,
+            ", ".join("{0} = {1}.{0} + d.{0}".format(measure, name) for measure in aggregate["measures"]),
+            delta,
+            match
+        ),
+        "INSERT INTO {0} ({1}) SELECT {2} FROM {3} AS d WHERE NOT EXISTS (SELECT 1 FROM {0} WHERE {4});".format(
+            name,
+            ", ".join(columns),
+            ", ".join("d.{}".format(column) for column in columns),
+            delta,
+            match
+        ),
+        "DROP TABLE {};".format(delta)
+    ]
+
+
+def rebuild_statements(name, aggregate):
+    """Build the statements recomputing an aggregate table from the whole songplays table
+    Args:
+        name(str): name of the aggregate table
+        aggregate(dict): declaration of the aggregate
+
+    Returns:
+        list
+    """
+    columns = aggregate["keys"] + aggregate["measures"]
+    return [
+        "DELETE FROM {};".format(name),
+        "INSERT INTO {} ({}) {};".format(name, ", ".join(columns), aggregate["select"].format("songplays").strip())
+    ]
+
+
+def _execute_refresh(cur, refreshes, delta_rows, full, cleanup=()):
+    """Refresh the aggregate tables and log them, leaving the transaction open
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        refreshes(list): (name, statements) tuples of the aggregate tables
+        delta_rows(int): songplays summed into the aggregates
+        full(bool): if True, the aggregates are recomputed from scratch
+        cleanup(list): statements run at the end of the same transaction
+
+    Returns:
+        int, songplays summed into the aggregates
+    """
+    for query in [aggregate_refresh_log_create] + aggregate_create_queries:
+        cur.execute(query)
+    for name, statements in refreshes:
+        start = time.perf_counter()
+        for statement in statements:
+            cur.execute(statement)
+        duration = time.perf_counter() - start
+        cur.execute(aggregate_refresh_log_insert, (name, delta_rows, duration, full))
+        logger.info("{} refreshed from {} songplays in {:.2f}s".format(name, delta_rows, duration))
+    for statement in table_versions_queries(aggregate_tables) + list(cleanup):
+        cur.execute(statement)
+    return delta_rows
+
+
+def execute_merge(cur, source, cleanup=()):
+    """Sum the aggregates of a table of new songplays into every aggregate table, without committing,
+    so that the merge is part of the transaction that produced the songplays
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        source(str): table with the new songplays
+        cleanup(list): statements run at the end of the merge, e.g. dropping the source
+
+    Returns:
+        int, merged songplays
+    """
+    cur.execute("SELECT COUNT(*) FROM {};".format(source))
+    delta_rows = cur.fetchone()[0]
+    refreshes = [(name, merge_statements(name, aggregate, source)) for name, aggregate in aggregates.items()]
+    return _execute_refresh(cur, refreshes, delta_rows, False, cleanup)
+
+
+def execute_refresh(cur, full=False):
+    """Refresh every aggregate table with the songplays inserted by the current run, read from songplays_delta,
+    or recompute them from the whole songplays table, dropping songplays_delta. Nothing is committed.
+    songplays_delta holds only the songplays not loaded before, so a rerun over the same data sums nothing twice
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        full(bool): if True, recompute the aggregates from scratch
+
+    Returns:
+        int, songplays summed into the aggregates
+    """
+    logger.info("Refreshing aggregate tables..")
+    if not full:
+        return execute_merge(cur, "songplays_delta", [songplays_delta_table_drop])
+    cur.execute("SELECT COUNT(*) FROM songplays;")
+    delta_rows = cur.fetchone()[0]
+    refreshes = [(name, rebuild_statements(name, aggregate)) for name, aggregate in aggregates.items()]
+    return _execute_refresh(cur, refreshes, delta_rows, True, [songplays_delta_table_drop])
+
+
+def refresh_aggregates(cur, conn, full=False):
+    """Refresh the aggregate tables (see execute_refresh).
+    All the aggregates are refreshed and logged in one transaction, that drops songplays_delta:
+    a run stopped before the commit merges the same rows again when resumed, a completed one does not.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        full(bool): if True, recompute the aggregates from scratch
+
+    Returns:
+        int, songplays summed into the aggregates
+    """
+    return run_in_transaction(conn, lambda: execute_refresh(cur, full))
+
+
+def get_staleness(cur):
+    """Get the last refresh of every aggregate table and the seconds elapsed since then
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+
+    Returns:
+        pd.DataFrame
+    """
+    cur.execute(aggregate_staleness_select)
+    columns = [desc[0] for desc in cur.description]
+    return pd.DataFrame(cur.fetchall(), columns=columns)
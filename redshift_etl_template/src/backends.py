@@ -0,0 +1,245 @@
+import io
+import os
+import re
+import abc
+import pandas as pd
+from pyarrow import csv as pa_csv
+
+from redshift_etl_template.src import validation
+from redshift_etl_template.src.sql_queries import staging_events_table_create, staging_songs_table_create, \
+    table_queries
+from redshift_etl_template.src.cache import table_versions_queries
+from redshift_etl_template.src.transactions import TransactionRunner
+from redshift_etl_template.constants import DIR_DATA, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+BACKENDS = ["redshift", "postgres"]
+
+staging_create_queries = {
+    "staging_events": staging_events_table_create,
+    "staging_songs": staging_songs_table_create
+}
+
+# redshift dialect -> postgres dialect
+postgres_translations = [
+    (r"\bdiststyle\s+\w+\s*", ""),
+    (r"\bDISTKEY\s*\([^)]*\)\s*", ""),
+    (r"\bSORTKEY\s*\([^)]*\)\s*", ""),
+    (r"\bBIGINT\s+IDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)", "BIGSERIAL"),
+    (r"(?s)\bSTRTOL\((.+?),\s*16\)", r"('x' || LPAD(\1, 16, '0'))::BIT(64)::BIGINT"),
+    (r"\bAPPROXIMATE\s+", ""),
+    (r"\s*\bWITH\s+NO\s+SCHEMA\s+BINDING\b", ""),
+    (r"\bGETDATE\(\)", "NOW()"),
+    (r"\bTRUNC\(([\w.]+)\)", r"(\1)::DATE"),
+    (r"\bDATEADD\(\s*(\w+)\s*,\s*(-?\d+)\s*,\s*([^)]+\))\s*\)", r"(\3 + INTERVAL '\2 \1')"),
+    (r"\bDATEDIFF\(\s*second\s*,\s*([^,]+),\s*([^)]+\))\s*\)", r"EXTRACT(EPOCH FROM (\2 - \1))"),
+]
+
+
+def translate_to_postgres(query):
+    """Translate the redshift specific parts of a statement to postgres
+    Args:
+        query(str): redshift statement
+
+    Returns:
+        str
+    """
+    for pattern, replacement in postgres_translations:
+        query = re.sub(pattern, replacement, query, flags=re.IGNORECASE)
+    return query
+
+
+class TranslatingCursor:
+    """Cursor translating every statement before executing it,
+    so that the queries of the project run unchanged on another dialect"""
+
+    def __init__(self, cur, translate):
+        self._cur = cur
+        self._translate = translate
+
+    def execute(self, query, params=None):
+        if isinstance(query, bytes):
+            # statements already composed by psycopg2.extras helpers
+            return self._cur.execute(self._translate(query.decode("utf-8")).encode("utf-8"), params)
+        return self._cur.execute(self._translate(query), params)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class WarehouseBackend(abc.ABC):
+    """Operations needed by the pipeline on a data warehouse"""
+    name = None
+
+    def __init__(self, conn, config):
+        self.conn = conn
+        self.config = config
+
+    def translate(self, query):
+        return query
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def execute(self, query, params=None):
+        cur = self.cursor()
+        cur.execute(query, params)
+        self.conn.commit()
+
+    def fetch_dataframe(self, query, params=None):
+        cur = self.cursor()
+        cur.execute(query, params)
+        columns = [desc[0] for desc in cur.description]
+        return pd.DataFrame(cur.fetchall(), columns=columns)
+
+    def create_table(self, create_query):
+        self.execute(create_query)
+
+    def drop_table(self, table):
+        self.execute("DROP TABLE IF EXISTS {}".format(table))
+
+    @abc.abstractmethod
+    def bulk_load(self, table, source, runner=None):
+        """Replace the content of a staging table with a source, recording its new version
+        Args:
+            table(str): name of the staging table
+            source(str): location of the json files
+            runner(TransactionRunner): runner grouping the statements into transactions
+        """
+
+    def load_staging_tables(self, runner=None):
+        """Load every staging table from the configured sources
+        Args:
+            runner(TransactionRunner): runner grouping the statements into transactions
+        """
+        for table in staging_create_queries:
+            self.bulk_load(table, self.get_source(table), runner)
+
+    @abc.abstractmethod
+    def get_source(self, table):
+        """Get the configured source of a staging table
+        Args:
+            table(str): name of the staging table
+
+        Returns:
+            str
+        """
+
+
+class RedshiftBackend(WarehouseBackend):
+    """Redshift cluster, loading the staging tables from s3 with COPY"""
+    name = "redshift"
+
+    def get_source(self, table):
+        return self.config.get("S3", "log_data" if table == "staging_events" else "song_data")
+
+    def bulk_load(self, table, source, runner=None):
+        """Replace the content of a staging table with the json files of an s3 prefix, with the COPY of the etl
+        Args:
+            table(str): name of the staging table
+            source(str): s3 prefix of the json files
+            runner(TransactionRunner): runner grouping the statements into transactions
+        """
+        runner = runner or TransactionRunner(self.cursor(), self.conn)
+        runner.execute_group([table_queries[table]["delete"], self.get_copy_query(table, source)]
+                             + table_versions_queries([table]))
+
+    def get_copy_query(self, table, source):
+        """Build the COPY of a staging table from an s3 prefix, with the iam role of the configuration
+        Args:
+            table(str): name of the staging table
+            source(str): s3 prefix of the json files
+
+        Returns:
+            str
+        """
+        json_format = self.config.get("S3", "log_jsonpath") if table == "staging_events" else "auto"
+        return table_queries[table]["copy_template"].format(source, self.config.get("IAM_ROLE", "arn"), json_format)
+
+
+class PostgresBackend(WarehouseBackend):
+    """Local postgres database standing in for redshift.
+    Statements are translated to the postgres dialect and
+    the staging tables are loaded from local copies of the json sources."""
+    name = "postgres"
+
+    def translate(self, query):
+        return translate_to_postgres(query)
+
+    def cursor(self):
+        return TranslatingCursor(self.conn.cursor(), self.translate)
+
+    def get_source(self, table):
+        option = "log_data" if table == "staging_events" else "song_data"
+        return self.config.get("LOCAL", option, fallback=os.path.join(DIR_DATA, option))
+
+    def bulk_load(self, table, source, runner=None):
+        """Validate the local json files of a source with the same mapping of COPY,
+        and stream them with postgres COPY into a staging table, emptied in the same transaction
+        Args:
+            table(str): name of the staging table
+            source(str): local directory of the json files
+            runner(TransactionRunner): runner grouping the statements into transactions
+        """
+        runner = runner or TransactionRunner(self.cursor(), self.conn)
+        try:
+            self.cursor().execute(table_queries[table]["delete"])
+            self.bulk_load_files(table, validation.list_json_files(source))
+        except Exception:
+            self.conn.rollback()
+            raise
+        # the rows are committed with the versions, according to the policy of the runner
+        runner.execute_group(table_versions_queries([table]))
+
+    def bulk_load_files(self, table, paths, source_table=None):
+        """Stream local json files into a table, without committing
+        Args:
+            table(str): name of the destination table
+            paths(list): paths of the json files
+            source_table(str): staging table whose columns and json mapping the files follow, table if None
+
+        Returns:
+            int, number of loaded rows
+        """
+        source_table = source_table or table
+        schema = validation.parse_table_schema(staging_create_queries[source_table])
+        keys = None
+        if source_table == "staging_events":
+            keys = validation.load_jsonpaths(self.config.get(
+                "LOCAL", "log_jsonpath", fallback=os.path.join(DIR_DATA, "log_json_path.json")))
+        columns = [column for column, _, _ in schema]
+        cur = self.conn.cursor()
+        n_rows = 0
+        for path in paths:
+            report = validation.validate_file(path, schema, keys)
+            if report["n_bad_rows"]:
+                raise Exception("{} has {} rows that cannot be loaded into {}: {}".format(
+                    path, report["n_bad_rows"], table, report["errors"]))
+            buffer = io.BytesIO()
+            pa_csv.write_csv(report["table"], buffer, pa_csv.WriteOptions(include_header=False))
+            buffer.seek(0)
+            cur.copy_expert("COPY {} ({}) FROM STDIN WITH CSV".format(table, ", ".join(columns)), buffer)
+            n_rows += report["n_rows"]
+        logger.info("{} rows loaded into {} from {} files".format(n_rows, table, len(paths)))
+        return n_rows
+
+
+def get_backend(name, conn, config):
+    """Build the backend of a connection
+    Args:
+        name(str): one of BACKENDS
+        conn(psycopg2.connection): psycopg2 connection
+        config(configparser.ConfigParser): configuration of the current machine
+
+    Returns:
+        WarehouseBackend
+    """
+    backends = {backend.name: backend for backend in [RedshiftBackend, PostgresBackend]}
+    if name not in backends:
+        raise ValueError("unknown backend {}, use one of {}".format(name, BACKENDS))
+    return backends[name](conn, config)
@@ -0,0 +1,154 @@
+import re
+
+from redshift_etl_template.src.sql_queries import star_tables, table_queries, songplays_delta_loaded_delete
+from redshift_etl_template.src.cache import table_versions_queries
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+SHADOW_SUFFIX = "_shadow"
+PREVIOUS_SUFFIX = "_previous"
+
+
+class ShadowValidationError(Exception):
+    """A shadow table is not fit to replace the live one"""
+
+
+def shadow_query(query, table, suffix=SHADOW_SUFFIX):
+    """Redirect the target of a create or insert statement to another version of the table,
+    together with the reads of the target made by the statement itself
+    Args:
+        query(str): create or insert statement of a star table
+        table(str): name of the star table
+        suffix(str): suffix of the target version
+
+    Returns:
+        str
+    """
+    pattern = r"((?:CREATE TABLE IF NOT EXISTS|INSERT INTO|FROM)\s+){}\b".format(table)
+    return re.sub(pattern, r"\g<1>{}{}".format(table, suffix), query)
+
+
+def get_existing_tables(cur):
+    """Get the names of the tables in the current schema
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+
+    Returns:
+        set
+    """
+    cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema();")
+    return {row[0] for row in cur.fetchall()}
+
+
+def count_rows(cur, table):
+    """Count the rows of a table
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        table(str): name of the table
+
+    Returns:
+        int
+    """
+    cur.execute("SELECT COUNT(*) FROM {};".format(table))
+    return cur.fetchone()[0]
+
+
+def build_shadow_tables(cur, conn):
+    """Create and fill a shadow version of every star table from the staging tables.
+    Live tables are not touched, so analysts keep reading them during the load.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+    """
+    logger.info("Building shadow star tables..")
+    for table in star_tables:
+        # songplays is inserted from the songplays of the staging tables, joined once into songplays_delta,
+        # keeping the ones already live: the shadow table is rebuilt from scratch
+        for query in table_queries[table].get("delta", []):
+            if query != songplays_delta_loaded_delete:
+                cur.execute(query)
+        cur.execute("DROP TABLE IF EXISTS {}{};".format(table, SHADOW_SUFFIX))
+        cur.execute(shadow_query(table_queries[table]["create"], table))
+        cur.execute(shadow_query(table_queries[table]["insert"], table))
+        conn.commit()
+
+
+def validate_shadow_tables(cur, min_ratio=0.0):
+    """Check that every shadow table is filled and did not shrink too much compared to the live one
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        min_ratio(float): minimum admissible ratio between shadow and live row counts
+
+    Returns:
+        dict
+    """
+    existing_tables = get_existing_tables(cur)
+    counts = {}
+    for table in star_tables:
+        n_shadow = count_rows(cur, table + SHADOW_SUFFIX)
+        n_live = count_rows(cur, table) if table in existing_tables else 0
+        counts[table] = {"shadow": n_shadow, "live": n_live}
+        logger.info("{}: {} rows in shadow, {} rows live".format(table, n_shadow, n_live))
+        if n_shadow == 0:
+            raise ShadowValidationError("shadow table of {} is empty".format(table))
+        if n_shadow < min_ratio * n_live:
+            raise ShadowValidationError("shadow table of {} has {} rows, less than {:.0%} of the {} live rows".format(
+                table, n_shadow, min_ratio, n_live))
+    return counts
+
+
+def _rename(old_name, new_name):
+    return "ALTER TABLE {} RENAME TO {};".format(old_name, new_name)
+
+
+def _run_in_transaction(cur, conn, statements):
+    """Execute a list of statements in a single transaction, rolling back on failure"""
+    try:
+        for statement in statements:
+            cur.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def swap_shadow_tables(cur, conn):
+    """Promote the shadow tables to live in one transaction.
+    The replaced live tables are kept with the previous suffix for rollback.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+    """
+    logger.info("Swapping shadow tables into the star schema..")
+    existing_tables = get_existing_tables(cur)
+    statements = []
+    for table in star_tables:
+        if table + PREVIOUS_SUFFIX in existing_tables:
+            statements.append("DROP TABLE {}{};".format(table, PREVIOUS_SUFFIX))
+        if table in existing_tables:
+            statements.append(_rename(table, table + PREVIOUS_SUFFIX))
+        statements.append(_rename(table + SHADOW_SUFFIX, table))
+    _run_in_transaction(cur, conn, statements + table_versions_queries(star_tables))
+
+
+def rollback_swap(cur, conn):
+    """Restore the previous version of the star tables in one transaction.
+    The rolled back version is kept as shadow, so it can be swapped in again.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+    """
+    logger.info("Restoring previous version of the star schema..")
+    existing_tables = get_existing_tables(cur)
+    missing_tables = [table for table in star_tables if table + PREVIOUS_SUFFIX not in existing_tables]
+    if missing_tables:
+        raise Exception("no previous version of {}".format(", ".join(missing_tables)))
+    statements = []
+    for table in star_tables:
+        if table + SHADOW_SUFFIX in existing_tables:
+            statements.append("DROP TABLE {}{};".format(table, SHADOW_SUFFIX))
+        statements.append(_rename(table, table + SHADOW_SUFFIX))
+        statements.append(_rename(table + PREVIOUS_SUFFIX, table))
+    _run_in_transaction(cur, conn, statements + table_versions_queries(star_tables))
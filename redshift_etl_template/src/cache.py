@@ -0,0 +1,189 @@
+import os
+import re
+import hashlib
+import threading
+import pandas as pd
+
+from redshift_etl_template.src.sql_queries import staging_tables, star_tables, history_tables
+from redshift_etl_template.src.aggregate_queries import aggregate_tables
+from redshift_etl_template.src.utils import get_typed_dataframe
+from redshift_etl_template.constants import DIR_DATA, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DIR_CACHE = os.path.join(DIR_DATA, "query_cache")
+cached_tables = staging_tables + star_tables + history_tables + aggregate_tables
+
+# the version of a table is a counter incremented by every write, never reset when the table is recreated:
+# two writes within the same second get different versions, so a cached result never outlives its rows
+table_versions_create = ("""
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name 		VARCHAR 	NOT NULL,
+    version 		BIGINT 		NOT NULL
+)
+diststyle all
+;""")
+table_versions_update = "UPDATE table_versions SET version = version + 1 WHERE table_name IN ({})"
+table_versions_insert = ("""
+INSERT INTO table_versions (table_name, version)
+SELECT t.table_name, 1
+FROM ({}) AS t
+WHERE NOT EXISTS (SELECT 1 FROM table_versions AS v WHERE v.table_name = t.table_name)
+""")
+table_versions_select = ("SELECT table_name, MAX(version) FROM table_versions WHERE table_name IN ({}) "
+                         "GROUP BY table_name")
+
+
+def _quote_list(names):
+    return ", ".join("'{}'".format(name) for name in names)
+
+
+def table_versions_queries(tables):
+    """Build the statements recording that the etl has written on some tables,
+    invalidating the cached results that read them.
+    They are run in the transaction of the writes, so the new version is committed together with the new rows
+    Args:
+        tables(list): names of the written tables
+
+    Returns:
+        list
+    """
+    return [
+        table_versions_create,
+        table_versions_update.format(_quote_list(tables)),
+        table_versions_insert.format(" UNION ALL ".join("SELECT '{}' AS table_name".format(table)
+                                                        for table in tables))
+    ]
+
+
+def normalize_query(query):
+    """Normalize the layout of a query, so that equivalent queries share the same cache entry
+    Args:
+        query(str): sql query
+
+    Returns:
+        str
+    """
+    return re.sub(r"\s+", " ", query).strip().rstrip(";").strip()
+
+
+def get_referenced_tables(query):
+    """Get the tables read by a query, None if it reads a relation without version,
+    whose writes would not invalidate the cached result
+    Args:
+        query(str): sql query
+
+    Returns:
+        list
+    """
+    # the FROM of EXTRACT(part FROM column) does not read a relation
+    query = re.sub(r"\bEXTRACT\s*\(\s*\w+\s+FROM\b", "EXTRACT(", query, flags=re.IGNORECASE)
+    ctes = {name.lower() for name in re.findall(r"(?:\bWITH|,)\s+(\w+)\s+AS\s*\(", query, flags=re.IGNORECASE)}
+    names = {name.lower() for name in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)", query, flags=re.IGNORECASE)} - ctes
+    if any(name not in cached_tables for name in names):
+        return None
+    return sorted(names)
+
+
+class QueryCache:
+    """Cache the results of read queries on disk as parquet files.
+    Entries are keyed by the normalized query and by the versions of the tables it reads,
+    so a write of the etl on one of these tables makes the entry unreachable.
+    The least recently used entries are evicted when the cache exceeds its size.
+    A cache can be shared by several threads, and its directory by several processes:
+    entries are written atomically and an entry evicted by someone else is a miss.
+    """
+
+    def __init__(self, cache_dir=DIR_CACHE, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, cur, query):
+        """Build the key of a query, None if it reads a table without version
+        Args:
+            cur(psycopg2.cursor): psycopg2 cursor
+            query(str): sql query
+
+        Returns:
+            str
+        """
+        tables = get_referenced_tables(query)
+        if not tables:
+            return None
+        cur.execute(table_versions_select.format(_quote_list(tables)))
+        versions = dict(cur.fetchall())
+        if set(versions) != set(tables):
+            return None
+        token = ";".join("{}={}".format(table, versions[table]) for table in tables)
+        return hashlib.sha256("{}|{}".format(normalize_query(query), token).encode("utf-8")).hexdigest()
+
+    def _read(self, path):
+        """Read an entry and mark it as recently used, None if it is missing"""
+        try:
+            os.utime(path)
+            return pd.read_parquet(path)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, df):
+        """Write an entry through a temporary file, so that it is never read half written"""
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def get_dataframe(self, cur, query):
+        """Get the result of a query, from the cache if it is still valid
+        Args:
+            cur(psycopg2.cursor): psycopg2 cursor
+            query(str): sql query
+
+        Returns:
+            pd.DataFrame
+        """
+        key = self.get_key(cur, query)
+        path = os.path.join(self.cache_dir, "{}.parquet".format(key))
+        if key is not None:
+            with self.lock:
+                df = self._read(path)
+                if df is not None:
+                    self.hits += 1
+                    return df
+        with self.lock:
+            self.misses += 1
+        # the query runs outside of the lock, so that the threads query the database concurrently
+        cur.execute(query)
+        df = get_typed_dataframe(cur.fetchall(), cur.description)
+        if key is not None:
+            with self.lock:
+                self._write(path, df)
+                self.evict()
+        return df
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits its size"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".parquet"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # evicted by another process meanwhile
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
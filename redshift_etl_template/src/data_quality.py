@@ -0,0 +1,128 @@
+import datetime
+import pandas as pd
+
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Declarative checks for each table:
+# - not_null: columns that must not contain nulls
+# - primary_key: column that must not contain duplicates
+# - foreign_keys: column -> (referenced table, referenced column), every value must be referenced
+# - ranges: column -> (lower bound, upper bound), None for an open bound
+quality_checks = {
+    "staging_events": {
+        "ranges": {"ts": (0, None)}
+    },
+    "staging_songs": {},
+    "songplays": {
+        "not_null": ["start_time", "user_id", "level", "song_id", "artist_id", "session_id", "user_agent"],
+        "primary_key": "songplay_id",
+        "foreign_keys": {
+            "user_id": ("users", "user_id"),
+            "song_id": ("songs", "song_id"),
+            "artist_id": ("artists", "artist_id"),
+            "start_time": ("time", "start_time")
+        },
+        "ranges": {"start_time": (datetime.datetime(2000, 1, 1), None)}
+    },
+    "users": {
+        "not_null": ["level"],
+        "primary_key": "user_id"
+    },
+    "songs": {
+        "not_null": ["title", "artist_id"]
+    },
+    "artists": {
+        "not_null": ["name"]
+    },
+    "time": {
+        "not_null": ["hour", "day", "week", "month", "year", "weekday"],
+        "ranges": {"start_time": (datetime.datetime(2000, 1, 1), None)}
+    }
+}
+
+
+def compile_checks(table, checks):
+    """Compile all the checks of a table into a single aggregate query,
+    so that the table is scanned only once
+    Args:
+        table(str): name of the table
+        checks(dict): declarative checks of the table
+
+    Returns:
+        str
+    """
+    aggregates = ["COUNT(*) AS row_count"]
+    joins = []
+    for column in checks.get("not_null", []):
+        aggregates.append("SUM(CASE WHEN t.{0} IS NULL THEN 1 ELSE 0 END) AS null__{0}".format(column))
+    if "primary_key" in checks:
+        aggregates.append("COUNT(t.{0}) - COUNT(DISTINCT t.{0}) AS duplicate__{0}".format(checks["primary_key"]))
+    for i, (column, (ref_table, ref_column)) in enumerate(checks.get("foreign_keys", {}).items()):
+        alias = "fk{}".format(i)
+        joins.append("LEFT JOIN (SELECT DISTINCT {1} FROM {0}) AS {2} ON t.{3} = {2}.{1}".format(
+            ref_table, ref_column, alias, column))
+        aggregates.append("SUM(CASE WHEN t.{0} IS NOT NULL AND {1}.{2} IS NULL THEN 1 ELSE 0 END) AS orphan__{0}".format(
+            column, alias, ref_column))
+    for column in checks.get("ranges", {}):
+        aggregates.append("MIN(t.{0}) AS min__{0}".format(column))
+        aggregates.append("MAX(t.{0}) AS max__{0}".format(column))
+    return "SELECT\n    {}\nFROM {} AS t\n{};".format(",\n    ".join(aggregates), table, "\n".join(joins))
+
+
+def evaluate_checks(table, checks, result):
+    """Compare the aggregates of a table against its checks
+    Args:
+        table(str): name of the table
+        checks(dict): declarative checks of the table
+        result(dict): aggregates returned by the compiled query
+
+    Returns:
+        list
+    """
+    row_count = result["row_count"]
+    report = [{"table": table, "check": "row_count", "column": None, "value": row_count,
+               "passed": row_count > 0}]
+    for column in checks.get("not_null", []):
+        null_rate = result["null__" + column] / row_count if row_count else 0.0
+        report.append({"table": table, "check": "null_rate", "column": column, "value": null_rate,
+                       "passed": null_rate == 0})
+    if "primary_key" in checks:
+        column = checks["primary_key"]
+        duplicates = result["duplicate__" + column]
+        report.append({"table": table, "check": "duplicate_key", "column": column, "value": duplicates,
+                       "passed": duplicates == 0})
+    for column in checks.get("foreign_keys", {}):
+        orphans = result["orphan__" + column]
+        report.append({"table": table, "check": "orphan_key", "column": column, "value": orphans,
+                       "passed": orphans == 0})
+    for column, (lower, upper) in checks.get("ranges", {}).items():
+        min_value, max_value = result["min__" + column], result["max__" + column]
+        passed = min_value is None or (
+            (lower is None or min_value >= lower) and (upper is None or max_value <= upper))
+        report.append({"table": table, "check": "range", "column": column, "value": (min_value, max_value),
+                       "passed": passed})
+    return report
+
+
+def run_quality_checks(cur, checks=quality_checks):
+    """Run one aggregate scan for each table and build the quality report
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        checks(dict): declarative checks, by table
+
+    Returns:
+        pd.DataFrame
+    """
+    report = []
+    for table, table_checks in checks.items():
+        cur.execute(compile_checks(table, table_checks))
+        columns = [desc[0] for desc in cur.description]
+        result = dict(zip(columns, cur.fetchone()))
+        report.extend(evaluate_checks(table, table_checks, result))
+    df_report = pd.DataFrame(report, columns=["table", "check", "column", "value", "passed"])
+    n_failed = (~df_report["passed"]).sum()
+    logger.info("{} checks run, {} failed".format(len(df_report), n_failed))
+    return df_report
@@ -0,0 +1,134 @@
+import re
+import time
+import threading
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# options of a dataset overriding the sources of the configuration
+SOURCE_OPTIONS = ["log_data", "song_data", "log_jsonpath"]
+
+
+def load_datasets(path):
+    """Read the dataset definitions, one section per dataset:
+    schema is the target schema, log_data, song_data and log_jsonpath its sources
+    (s3 prefixes on redshift, local paths on postgres), defaulting to the ones of the configuration.
+    Args:
+        path(str): path of the definitions file
+
+    Returns:
+        list of dict
+    """
+    parser = configparser.ConfigParser()
+    if not parser.read(path):
+        raise Exception("cannot read the dataset definitions {}".format(path))
+    datasets = []
+    for name in parser.sections():
+        dataset = {"name": name, "schema": parser.get(name, "schema", fallback=name)}
+        if not re.fullmatch(r"[A-Za-z_]\w*", dataset["schema"]):
+            raise ValueError("invalid schema {} for dataset {}".format(dataset["schema"], name))
+        for option in SOURCE_OPTIONS:
+            dataset[option] = parser.get(name, option, fallback=None)
+        datasets.append(dataset)
+    if not datasets:
+        raise Exception("no dataset defined in {}".format(path))
+    if len({dataset["schema"] for dataset in datasets}) < len(datasets):
+        raise ValueError("every dataset needs its own schema")
+    return datasets
+
+
+def build_dataset_config(config, dataset, backend_name):
+    """Copy the configuration, replacing its sources with the ones of a dataset
+    Args:
+        config(configparser.ConfigParser): configuration of the current machine
+        dataset(dict): dataset definition
+        backend_name(str): backend reading the sources, s3 on redshift, local files otherwise
+
+    Returns:
+        configparser.ConfigParser
+    """
+    dataset_config = configparser.ConfigParser()
+    dataset_config.read_dict(config)
+    section = "S3" if backend_name == "redshift" else "LOCAL"
+    if not dataset_config.has_section(section):
+        dataset_config.add_section(section)
+    for option in SOURCE_OPTIONS:
+        if dataset[option] is not None:
+            dataset_config.set(section, option, dataset[option])
+    return dataset_config
+
+
+class ConcurrencyBudget:
+    """Global budget of steps running at once on the cluster, shared by all the datasets.
+    Records the time spent waiting for the budget, to tell the cluster capacity from the work itself."""
+
+    def __init__(self, size):
+        self.size = size
+        self._semaphore = threading.BoundedSemaphore(size)
+
+    def run(self, step, metrics):
+        """Run a step within the budget
+        Args:
+            step(function): step of a dataset, without arguments
+            metrics(dict): metrics of the dataset, wait_s is increased by the wait for the budget
+        """
+        start = time.perf_counter()
+        with self._semaphore:
+            metrics["wait_s"] += time.perf_counter() - start
+            return step()
+
+
+class DatasetRunner:
+    """Run the pipeline of several datasets concurrently, on the connections of a shared pool.
+    A failing dataset is rolled back and reported, without stopping the others.
+    """
+
+    def __init__(self, pool, budget, max_datasets=4):
+        self.pool = pool
+        self.budget = budget
+        self.max_datasets = max_datasets
+
+    def _run_dataset(self, pipeline, dataset):
+        metrics = {"dataset": dataset["name"], "schema": dataset["schema"], "status": "running",
+                   "duration_s": 0.0, "wait_s": 0.0, "steps": 0, "songplays": None, "error": None}
+        start = time.perf_counter()
+        conn = self.pool.getconn()
+        try:
+            pipeline(conn, dataset, lambda step: self._run_step(step, metrics), metrics)
+            metrics["status"] = "succeeded"
+        except Exception as e:
+            conn.rollback()
+            metrics["status"] = "failed"
+            metrics["error"] = str(e)
+            logger.error("Dataset {} failed: {}".format(dataset["name"], e))
+        finally:
+            self.pool.putconn(conn)
+            metrics["duration_s"] = time.perf_counter() - start
+        logger.info("Dataset {dataset} {status} in {duration_s:.2f}s, {wait_s:.2f}s waiting for the budget, "
+                    "{steps} steps".format(**metrics))
+        return metrics
+
+    def _run_step(self, step, metrics):
+        result = self.budget.run(step, metrics)
+        metrics["steps"] += 1
+        return result
+
+    def run(self, pipeline, datasets):
+        """Run the pipeline of every dataset
+        Args:
+            pipeline(function): called with a pooled connection, the dataset, a function running
+                a step within the budget and the metrics of the dataset
+            datasets(list): dataset definitions
+
+        Returns:
+            pd.DataFrame, metrics of every dataset
+        """
+        with ThreadPoolExecutor(max_workers=self.max_datasets) as executor:
+            futures = [executor.submit(self._run_dataset, pipeline, dataset) for dataset in datasets]
+            return pd.DataFrame([future.result() for future in futures])
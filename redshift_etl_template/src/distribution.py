@@ -0,0 +1,284 @@
+import re
+import hashlib
+from itertools import combinations
+from collections import Counter
+import pandas as pd
+
+from redshift_etl_template.src.sql_queries import staging_events_table_create, staging_songs_table_create
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+EVEN = "even"
+# separator of the columns of a compound key, hashed together into a single distribution value
+COMPOUND_SEPARATOR = "+"
+
+# candidate distribution keys and songplays join key of each staging table
+distribution_candidates = {
+    "staging_events": {
+        "create_query": staging_events_table_create,
+        "candidates": ["artist", "song", "sessionid", "userid"],
+        "join": ("artist", "staging_songs", "artist_name")
+    },
+    "staging_songs": {
+        "create_query": staging_songs_table_create,
+        "candidates": ["artist_name", "title", "song_id", "artist_id"],
+        "join": ("artist_name", "staging_events", "artist")
+    }
+}
+
+n_slices_query = "SELECT COUNT(*) FROM stv_slices;"
+# distribution key of a table as it is on the cluster, changed by a deep copy unlike the DDL of the project
+distkey_query = "SELECT \"column\" FROM pg_table_def WHERE tablename = '{}' AND distkey;"
+slice_rows_query = """
+SELECT slice, SUM(rows) AS n_rows
+FROM stv_tbl_perm
+WHERE TRIM(name) = '{}'
+GROUP BY slice
+ORDER BY slice;
+"""
+hot_keys_query = """
+SELECT {0} AS key, COUNT(*) AS n_rows
+FROM {1}
+GROUP BY {0}
+ORDER BY n_rows DESC
+LIMIT {2};
+"""
+# a random filter reads the table once without sorting it, unlike ORDER BY RANDOM()
+sample_rows_query = "SELECT {} FROM {} WHERE RANDOM() < {} LIMIT {};"
+count_rows_query = "SELECT COUNT(*) FROM {};"
+
+
+def get_candidate_distributions(table):
+    """Get the distributions that can be simulated and applied to a staging table
+    Args:
+        table(str): name of the staging table
+
+    Returns:
+        list, candidate keys and 'even'
+    """
+    return distribution_candidates[table]["candidates"] + [EVEN]
+
+
+def get_compound_distributions(table):
+    """Get the compound keys of a staging table, pairs of candidate keys hashed together.
+    They are simulated only: a redshift DISTKEY is a single column, and the COPY of the staging tables
+    cannot fill a column holding the hash of the pair
+    Args:
+        table(str): name of the staging table
+
+    Returns:
+        list, keys as 'column+column'
+    """
+    return [COMPOUND_SEPARATOR.join(pair) for pair in combinations(distribution_candidates[table]["candidates"], 2)]
+
+
+def get_distkey(create_query):
+    """Get the distribution key declared in a create statement
+    Args:
+        create_query(str): create statement of the table
+
+    Returns:
+        str, 'even' if no key is declared
+    """
+    match = re.search(r"DISTKEY\s*\((\w+)\)", create_query, flags=re.IGNORECASE)
+    return match.group(1).lower() if match else EVEN
+
+
+def get_live_distkey(cur, table):
+    """Get the distribution key of a table on the cluster
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        table(str): name of the table
+
+    Returns:
+        str, 'even' if the table is not distributed on a key
+    """
+    cur.execute(distkey_query.format(table))
+    row = cur.fetchone()
+    return row[0].lower() if row else EVEN
+
+
+def get_key_values(df_sample, distribution):
+    """Get the values of a distribution key in the sampled rows, the pairs of values for a compound key
+    Args:
+        df_sample(pd.DataFrame): sampled rows of the table
+        distribution(str): distribution key
+
+    Returns:
+        list
+    """
+    columns = distribution.split(COMPOUND_SEPARATOR)
+    if len(columns) == 1:
+        return df_sample[distribution].tolist()
+    return list(df_sample[columns].itertuples(index=False, name=None))
+
+
+def simulate_slice_rows(keys, n_slices):
+    """Simulate the rows stored by each slice when a table is distributed on a key.
+    Null keys hash to the same value, so they all end up on one slice.
+    Args:
+        keys(list): values of the distribution key
+        n_slices(int): number of slices of the cluster
+
+    Returns:
+        list
+    """
+    counts = [0] * n_slices
+    for key in keys:
+        digest = hashlib.md5(str(key).encode("utf-8")).hexdigest()
+        counts[int(digest, 16) % n_slices] += 1
+    return counts
+
+
+def simulate_even_rows(n_rows, n_slices):
+    """Simulate the rows stored by each slice with a round robin distribution
+    Args:
+        n_rows(int): rows of the table
+        n_slices(int): number of slices of the cluster
+
+    Returns:
+        list
+    """
+    return [n_rows // n_slices + (1 if i < n_rows % n_slices else 0) for i in range(n_slices)]
+
+
+def skew_ratio(slice_rows):
+    """Ratio between the rows of the biggest slice and the average rows of a slice
+    Args:
+        slice_rows(list): rows stored by each slice
+
+    Returns:
+        float
+    """
+    total = sum(slice_rows)
+    if total == 0:
+        return 1.0
+    return max(slice_rows) / (total / len(slice_rows))
+
+
+def get_hot_keys(keys, n_keys=5):
+    """Get the most frequent values of a key
+    Args:
+        keys(list): values of the key
+        n_keys(int): number of values to be returned
+
+    Returns:
+        list of (value, rows) tuples
+    """
+    return Counter(keys).most_common(n_keys)
+
+
+def recommend_distribution(df_sample, table, n_slices, other_distkey):
+    """Rank the candidate distributions of a staging table by simulated skew,
+    estimating the redistribution needed by the songplays join for each of them.
+    A compound key never joins collocated, the hash of the pair differs from the hash of the join column
+    Args:
+        df_sample(pd.DataFrame): sampled rows of the table, with the candidate columns
+        table(str): name of the staging table
+        n_slices(int): number of slices of the cluster
+        other_distkey(str): current distribution key of the other side of the join
+
+    Returns:
+        pd.DataFrame
+    """
+    join_column, _, other_join_column = distribution_candidates[table]["join"]
+    other_collocated = other_distkey == other_join_column
+    rows = []
+    for candidate in get_candidate_distributions(table) + get_compound_distributions(table):
+        if candidate == EVEN:
+            slice_rows = simulate_even_rows(len(df_sample), n_slices)
+        else:
+            slice_rows = simulate_slice_rows(get_key_values(df_sample, candidate), n_slices)
+        collocated = candidate == join_column
+        if collocated and other_collocated:
+            join_step = "collocated"
+        elif collocated or other_collocated:
+            join_step = "redistribute one side"
+        else:
+            join_step = "redistribute both sides"
+        rows.append({
+            "distribution": candidate,
+            "skew_ratio": skew_ratio(slice_rows),
+            "songplays_join": join_step,
+            "applicable": candidate in get_candidate_distributions(table)
+        })
+    df_candidates = pd.DataFrame(rows).sort_values(["skew_ratio", "distribution"]).reset_index(drop=True)
+    return df_candidates
+
+
+def deep_copy_statements(table, create_query, distribution):
+    """Build the statements recreating a table with another distribution and copying its rows
+    Args:
+        table(str): name of the table
+        create_query(str): create statement of the table
+        distribution(str): new distribution key, or 'even'
+
+    Returns:
+        list
+    """
+    if distribution not in get_candidate_distributions(table):
+        raise ValueError("{} is not a candidate distribution of {}".format(distribution, table))
+    copy_table = table + "_deep_copy"
+    new_distribution = "diststyle even" if distribution == EVEN else \
+        "diststyle key\nDISTKEY ({})".format(distribution)
+    query = re.sub(r"diststyle\s+\w+(\s+DISTKEY\s*\(\w+\))?", new_distribution, create_query, flags=re.IGNORECASE)
+    query = re.sub(r"(CREATE TABLE IF NOT EXISTS\s+){}\b".format(table), r"\g<1>{}".format(copy_table), query)
+    return [
+        "DROP TABLE IF EXISTS {};".format(copy_table),
+        query,
+        "INSERT INTO {} SELECT * FROM {};".format(copy_table, table),
+        "DROP TABLE {};".format(table),
+        "ALTER TABLE {} RENAME TO {};".format(copy_table, table)
+    ]
+
+
+def get_slice_rows(cur, table):
+    """Get the rows stored by each slice for a table
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        table(str): name of the table
+
+    Returns:
+        list
+    """
+    cur.execute(slice_rows_query.format(table))
+    return [n_rows for _, n_rows in cur.fetchall()]
+
+
+def get_n_slices(cur):
+    cur.execute(n_slices_query)
+    return cur.fetchone()[0]
+
+
+def get_table_hot_keys(cur, table, column, n_keys=5):
+    """Get the most frequent values of a column of a table
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        table(str): name of the table
+        column(str): name of the column
+        n_keys(int): number of values to be returned
+
+    Returns:
+        list of (value, rows) tuples
+    """
+    cur.execute(hot_keys_query.format(column, table, n_keys))
+    return cur.fetchall()
+
+
+def sample_table(cur, table, n_rows):
+    """Sample about n_rows rows of the candidate key columns of a table, with a random filter
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        table(str): name of the table
+        n_rows(int): number of rows to be sampled
+
+    Returns:
+        pd.DataFrame
+    """
+    columns = distribution_candidates[table]["candidates"]
+    cur.execute(count_rows_query.format(table))
+    fraction = min(1.0, n_rows / max(cur.fetchone()[0], 1))
+    cur.execute(sample_rows_query.format(", ".join(columns), table, fraction, n_rows))
+    return pd.DataFrame(cur.fetchall(), columns=columns)
@@ -0,0 +1,181 @@
+import os
+import json
+import shutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from redshift_etl_template.src import sources
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# query exporting each star table and its partition columns
+export_tables = {
+    "songplays": (
+        "SELECT *, EXTRACT(year FROM start_time)::INT AS year, EXTRACT(month FROM start_time)::INT AS month "
+        "FROM songplays",
+        ["year", "month"]
+    ),
+    "time": ("SELECT * FROM time", ["year", "month"]),
+    "users": ("SELECT * FROM users", []),
+    "songs": ("SELECT * FROM songs", []),
+    "artists": ("SELECT * FROM artists", [])
+}
+
+# arrow types of the postgres type oids of the exported columns, strings for the others.
+# The schema is fixed from the cursor, so that a batch of nulls is not inferred as the null type.
+arrow_types = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp("us")
+}
+
+unload_query = """
+UNLOAD ('{}')
+TO '{}'
+IAM_ROLE '{}'
+FORMAT AS PARQUET
+{}MANIFEST VERBOSE
+ALLOWOVERWRITE
+PARALLEL ON;
+"""
+
+
+def build_unload_query(table, uri, iam_role):
+    """Build the statement unloading a star table to partitioned parquet files, in parallel from every slice
+    Args:
+        table(str): name of the star table
+        uri(str): s3 prefix of the exported table
+        iam_role(str): arn of the role allowing redshift to write on s3
+
+    Returns:
+        str
+    """
+    select_query, partition_columns = export_tables[table]
+    partition = "PARTITION BY ({})\n".format(", ".join(partition_columns)) if partition_columns else ""
+    return unload_query.format(select_query, uri.rstrip("/") + "/", iam_role, partition)
+
+
+def count_rows(cur, table):
+    cur.execute("SELECT COUNT(*) FROM {};".format(table))
+    return cur.fetchone()[0]
+
+
+def read_manifest_rows(manifest):
+    """Sum the rows written in the files listed by a verbose manifest
+    Args:
+        manifest(dict): content of the manifest
+
+    Returns:
+        int
+    """
+    return sum(entry["meta"]["record_count"] for entry in manifest["entries"])
+
+
+def clear_prefix(s3, uri):
+    """Delete the objects stored under an s3 prefix
+    Args:
+        s3(boto3.resources.base.ServiceResource): s3 resource
+        uri(str): s3 prefix to be cleared
+
+    Returns:
+        int, number of deleted objects
+    """
+    # the trailing slash keeps the prefixes starting with the same name, as songplays_old for songplays
+    bucket, prefix = sources.parse_s3_uri(uri.rstrip("/") + "/")
+    responses = s3.Bucket(bucket).objects.filter(Prefix=prefix).delete()
+    n_deleted = sum(len(response.get("Deleted", [])) for response in responses)
+    logger.info("{} objects deleted under {}".format(n_deleted, uri))
+    return n_deleted
+
+
+def unload_table(cur, s3, table, uri, iam_role):
+    """Unload a star table to s3 and verify the rows written against the table.
+    The prefix is cleared first: ALLOWOVERWRITE replaces only the files written again,
+    and the partitions of months no longer in the table would be left next to the new manifest
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        s3(boto3.resources.base.ServiceResource): s3 resource
+        table(str): name of the star table
+        uri(str): s3 prefix of the exported table
+        iam_role(str): arn of the role allowing redshift to write on s3
+
+    Returns:
+        int
+    """
+    n_rows = count_rows(cur, table)
+    clear_prefix(s3, uri)
+    cur.execute(build_unload_query(table, uri, iam_role))
+    bucket, prefix = sources.parse_s3_uri(uri.rstrip("/") + "/manifest")
+    manifest = json.loads(s3.Object(bucket, prefix).get()["Body"].read())
+    n_written = read_manifest_rows(manifest)
+    if n_written != n_rows:
+        raise Exception("{} has {} rows but {} were unloaded".format(table, n_rows, n_written))
+    logger.info("{} rows of {} unloaded in {} files".format(n_written, table, len(manifest["entries"])))
+    return n_written
+
+
+def get_arrow_schema(description):
+    """Build the arrow schema of the rows of a cursor
+    Args:
+        description(tuple): description of the cursor
+
+    Returns:
+        pa.Schema
+    """
+    return pa.schema([(desc[0], arrow_types.get(desc[1], pa.string())) for desc in description])
+
+
+def export_table_local(conn, table, path, batch_size=100000):
+    """Write the same partitioned parquet layout of the unload from a local database,
+    streaming the rows with a server side cursor.
+    The directory is cleared first, so that no file of a previous export is left next to the new manifest
+    Args:
+        conn(psycopg2.connection): psycopg2 connection
+        table(str): name of the star table
+        path(str): local directory of the exported table
+        batch_size(int): rows fetched and written at once
+
+    Returns:
+        int
+    """
+    select_query, partition_columns = export_tables[table]
+    n_rows = count_rows(conn.cursor(), table)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    entries = []
+    with conn.cursor(name="export_{}".format(table)) as cur:
+        cur.itersize = batch_size
+        cur.execute(select_query)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            schema = get_arrow_schema(cur.description)
+            batch = pa.Table.from_pydict({field.name: list(values) for field, values in zip(schema, zip(*rows))},
+                                         schema=schema)
+            pq.write_to_dataset(
+                batch,
+                path,
+                partition_cols=partition_columns or None,
+                basename_template="part-{}-{{i}}.parquet".format(len(entries)),
+                file_visitor=lambda written_file: entries.append({
+                    "url": written_file.path,
+                    "meta": {"record_count": written_file.metadata.num_rows}
+                })
+            )
+    manifest = {"entries": entries}
+    with open(os.path.join(path, "manifest"), "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    n_written = read_manifest_rows(manifest)
+    if n_written != n_rows:
+        raise Exception("{} has {} rows but {} were exported".format(table, n_rows, n_written))
+    logger.info("{} rows of {} exported in {} files".format(n_written, table, len(entries)))
+    return n_written
@@ -0,0 +1,186 @@
+import os
+import re
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from redshift_etl_template.src import sources
+from redshift_etl_template.src.validation import parse_table_schema
+from redshift_etl_template.src.sql_queries import staging_events_table_create, staging_songs_table_create
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+EXTERNAL_SCHEMA = "spectrum"
+
+# raw sources readable in place, replacing the staging tables
+external_sources = {
+    "staging_events": {
+        "name": "log_events",
+        "option": "log_data",
+        "create": staging_events_table_create,
+        "key": ["sessionId", "itemInSession", "ts"],
+        "partitioned": True
+    },
+    "staging_songs": {
+        "name": "song_records",
+        "option": "song_data",
+        "create": staging_songs_table_create,
+        "key": ["song_id"],
+        "partitioned": False
+    }
+}
+spectrum_types = {"INT": "INT", "BIGINT": "BIGINT", "FLOAT": "DOUBLE PRECISION", "VARCHAR": "VARCHAR({})"}
+duckdb_types = {"INT": "INTEGER", "BIGINT": "BIGINT", "FLOAT": "DOUBLE", "VARCHAR": "VARCHAR"}
+
+external_schema_create = ("""
+CREATE EXTERNAL SCHEMA IF NOT EXISTS {}
+FROM DATA CATALOG DATABASE '{}'
+IAM_ROLE '{}'
+CREATE EXTERNAL DATABASE IF NOT EXISTS;
+""")
+external_table_drop = "DROP TABLE IF EXISTS {}.{};"
+external_partition_add = "ALTER TABLE {}.{} ADD IF NOT EXISTS PARTITION (year={}, month={}) LOCATION '{}';"
+
+
+def get_partition(path):
+    """Get the year and month partition of a source file from its YYYY/MM folders
+    Args:
+        path(str): key or path of the file
+
+    Returns:
+        tuple of int, None if the file is not in a partition folder
+    """
+    match = re.search(r"(?:^|/)(\d{4})/(\d{2})/", path.replace(os.sep, "/"))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def build_external_table_create(schema, source, location):
+    """Build the statement registering a raw source as a spectrum table of json files
+    Args:
+        schema(str): external schema
+        source(dict): declaration of the source in external_sources
+        location(str): s3 prefix of the source files
+
+    Returns:
+        str
+    """
+    columns = ["    {} {}".format(column.lower(), spectrum_types[sql_type].format(length))
+               for column, sql_type, length in parse_table_schema(source["create"])]
+    partitions = "PARTITIONED BY (year INT, month INT)\n" if source["partitioned"] else ""
+    return ("CREATE EXTERNAL TABLE {}.{} (\n{}\n)\n{}"
+            "ROW FORMAT SERDE 'org.openx.data.jsonserde.JsonSerDe'\n"
+            "STORED AS TEXTFILE\n"
+            "LOCATION '{}/';").format(schema, source["name"], ",\n".join(columns), partitions, location.rstrip("/"))
+
+
+def register_external_tables(conn, s3, config, schema=EXTERNAL_SCHEMA, catalog_database="sparkify"):
+    """Register the raw sources as external tables, with a partition for every YYYY/MM folder of the events.
+    External ddl cannot run inside a transaction, so the statements are run in autocommit.
+    Args:
+        conn(psycopg2.connection): psycopg2 connection
+        s3(boto3.resources.base.ServiceResource): s3 resource
+        config(configparser.ConfigParser): configuration of the current machine
+        schema(str): external schema
+        catalog_database(str): database of the data catalog holding the external tables
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        cur.execute(external_schema_create.format(schema, catalog_database, config.get("IAM_ROLE", "arn")))
+        for source in external_sources.values():
+            uri = config.get("S3", source["option"]).rstrip("/")
+            cur.execute(external_table_drop.format(schema, source["name"]))
+            cur.execute(build_external_table_create(schema, source, uri))
+            if not source["partitioned"]:
+                continue
+            bucket, prefix = sources.parse_s3_uri(uri)
+            partitions = sorted({get_partition(key[len(prefix):]) for key in sources.list_source_keys(s3, uri)}
+                                - {None})
+            for year, month in partitions:
+                cur.execute(external_partition_add.format(
+                    schema, source["name"], year, month, "{}/{}/{:02d}/".format(uri, year, month)))
+            logger.info("{}.{} registered with {} partitions".format(schema, source["name"], len(partitions)))
+    finally:
+        conn.autocommit = autocommit
+
+
+def _partition_filter(months):
+    return " OR ".join("(year = {} AND month = {})".format(year, month) for year, month in months)
+
+
+def external_query(query, schema=EXTERNAL_SCHEMA, months=None):
+    """Rewrite a query on the staging tables to read the external tables instead.
+    The raw records are deduplicated on their natural key, as the staging tables are after COPY,
+    and the events are restricted to the given months so that only their partitions are scanned.
+    Args:
+        query(str): query reading staging_events and staging_songs
+        schema(str): external schema
+        months(list): (year, month) tuples of the events to be read, all if None
+
+    Returns:
+        str
+    """
+    for table, source in external_sources.items():
+        where = ""
+        if source["partitioned"] and months:
+            where = " WHERE {}".format(_partition_filter(months))
+        subquery = ("(SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY {key}) AS key_rank "
+                    "FROM {schema}.{name}{where}) AS raw WHERE key_rank = 1)").format(
+            key=", ".join(source["key"]), schema=schema, name=source["name"], where=where)
+        query = re.sub(r"\b{}\b(?!\.)(?:\s+AS\s+(\w+))?".format(table),
+                       lambda match, table=table, subquery=subquery: "{} AS {}".format(
+                           subquery, match.group(1) or table),
+                       query, flags=re.IGNORECASE)
+    return query
+
+
+def _duckdb_select(source, pattern, partition=None):
+    """Select the typed columns of the json files of a pattern, as COPY would load them"""
+    schema = parse_table_schema(source["create"])
+    raw_columns = ", ".join("'{}': 'VARCHAR'".format(column) for column, _, _ in schema)
+    columns = ", ".join(
+        "{0} AS {0}".format(column) if sql_type == "VARCHAR" else
+        "TRY_CAST(NULLIF({0}, '') AS {1}) AS {0}".format(column, duckdb_types[sql_type])
+        for column, sql_type, _ in schema)
+    if partition is not None:
+        columns += ", {} AS year, {} AS month".format(*partition)
+    return "SELECT {} FROM read_json('{}', columns = {{{}}}, format = 'auto')".format(
+        columns, pattern, raw_columns)
+
+
+def connect_local(directories, schema=EXTERNAL_SCHEMA):
+    """Open an in-memory duckdb database exposing local copies of the raw sources
+    with the same names, columns and partitions of the external tables.
+    The events are a union of one select per YYYY/MM folder with constant partition columns,
+    so a filter on year and month skips the files of the other months.
+    Args:
+        directories(dict): local directory of each staging table in external_sources
+        schema(str): schema of the views
+
+    Returns:
+        duckdb.DuckDBPyConnection
+    """
+    if duckdb is None:
+        raise Exception("duckdb is needed to query local copies of the sources: pip install duckdb")
+    con = duckdb.connect()
+    con.execute("CREATE SCHEMA IF NOT EXISTS {};".format(schema))
+    for table, source in external_sources.items():
+        directory = directories[table].rstrip("/")
+        if source["partitioned"]:
+            partitions = sorted({get_partition(os.path.relpath(root, directory) + "/")
+                                 for root, _, names in os.walk(directory)
+                                 if any(name.endswith(".json") for name in names)} - {None})
+            selects = [_duckdb_select(source, "{}/{}/{:02d}/*.json".format(directory, year, month), (year, month))
+                       for year, month in partitions]
+            select = "\nUNION ALL\n".join(selects)
+        else:
+            select = _duckdb_select(source, "{}/**/*.json".format(directory))
+        con.execute("CREATE VIEW {}.{} AS {};".format(schema, source["name"], select))
+    return con
@@ -0,0 +1,336 @@
+import os
+import time
+
+from redshift_etl_template.src import sources
+from redshift_etl_template.src.sql_queries import staging_events_copy_manifest, songplay_table_select
+from redshift_etl_template.src.cache import table_versions_queries
+from redshift_etl_template.src.aggregates import execute_merge
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+staging_events_batch_create = "CREATE TABLE IF NOT EXISTS staging_events_batch (LIKE staging_events);"
+staging_events_batch_delete = "DELETE FROM staging_events_batch;"
+staging_events_batch_copy_manifest = staging_events_copy_manifest.replace(
+    "COPY staging_events ", "COPY staging_events_batch ")
+follow_files_create = ("""
+CREATE TABLE IF NOT EXISTS follow_files (
+    file 		VARCHAR(1024) 	NOT NULL,
+    batch_id 		VARCHAR 	NOT NULL,
+    loaded_at 		TIMESTAMP 	NOT NULL
+)
+diststyle all
+SORTKEY (file)
+;""")
+follow_files_select = "SELECT file FROM follow_files;"
+follow_files_insert = "INSERT INTO follow_files (file, batch_id, loaded_at) VALUES {}"
+follow_batches_create = ("""
+CREATE TABLE IF NOT EXISTS follow_batches (
+    batch_id 		VARCHAR 	NOT NULL,
+    n_files 		INT 		NOT NULL,
+    n_bytes 		BIGINT 		NOT NULL,
+    n_events 		BIGINT 		NOT NULL,
+    n_songplays 	BIGINT 		NOT NULL,
+    duration_s 		FLOAT 		NOT NULL,
+    ended_at 		TIMESTAMP 	NOT NULL
+)
+diststyle all
+SORTKEY (ended_at)
+;""")
+follow_batches_insert = """
+INSERT INTO follow_batches (batch_id, n_files, n_bytes, n_events, n_songplays, duration_s, ended_at)
+VALUES (%s, %s, %s, %s, %s, %s, GETDATE())
+"""
+# events of the batch, one per natural key. What is already loaded is decided on songplays and time,
+# staging_events is replaced by every load and does not remember the events of the previous ones
+staging_events_new_drop = "DROP TABLE IF EXISTS staging_events_new"
+staging_events_new_create = ("""
+CREATE TEMP TABLE staging_events_new AS
+SELECT
+    artist, auth, firstName, gender, itemInSession, lastName, length, level, location,
+    method, page, registration, sessionId, song, status, ts, userAgent, userId
+FROM (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY sessionId, itemInSession, ts ORDER BY ts) AS key_rank
+    FROM staging_events_batch
+) AS b
+WHERE key_rank = 1
+;""")
+# songplays of the batch whose songplay_id is not in songplays yet
+songplays_new_drop = "DROP TABLE IF EXISTS songplays_new"
+songplays_new_create = ("""
+CREATE TEMP TABLE songplays_new AS
+SELECT *
+FROM (""" + songplay_table_select.replace("JOIN staging_events AS e", "JOIN staging_events_new AS e") + """) AS n
+WHERE NOT EXISTS (SELECT 1 FROM songplays AS p WHERE p.songplay_id = n.songplay_id)
+;""")
+songplay_new_insert = ("""
+INSERT INTO songplays (
+    songplay_id,
+    start_time,
+    user_id,
+    level,
+    song_id,
+    artist_id,
+    session_id,
+    location,
+    user_agent
+)
+SELECT songplay_id, start_time, user_id, level, song_id, artist_id, session_id, location, user_agent
+FROM songplays_new
+;""")
+time_new_insert = ("""
+INSERT INTO time (
+    start_time,
+    hour,
+    day,
+    week,
+    month,
+    year,
+    weekday
+)
+SELECT
+    DISTINCT (tmp.start_time)            AS stat_time,
+    EXTRACT(hour FROM tmp.start_time)    AS hour,
+    EXTRACT(day FROM tmp.start_time)     AS day,
+    EXTRACT(week FROM tmp.start_time)    AS week,
+    EXTRACT(month FROM tmp.start_time)   AS month,
+    EXTRACT(year FROM tmp.start_time)    AS year,
+    TO_CHAR(tmp.start_time, 'Day')       AS weekday
+FROM (
+    SELECT TIMESTAMP 'epoch' + (n.ts / 1000) * INTERVAL '1 second' AS start_time
+    FROM staging_events_new AS n
+    WHERE n.ts > 0
+) AS tmp
+WHERE NOT EXISTS (SELECT 1 FROM time AS t WHERE t.start_time = tmp.start_time)
+;""")
+follow_tables = ["songplays", "time"]
+
+
+class S3Source:
+    """Event files stored under an s3 prefix"""
+
+    def __init__(self, s3, uri, suffix=".json"):
+        self.s3 = s3
+        self.uri = uri
+        self.suffix = suffix
+
+    def list_files(self):
+        """
+        Returns:
+            list of dict with path, size and modification time of every file
+        """
+        bucket, prefix = sources.parse_s3_uri(self.uri)
+        return [{"path": "s3://{}/{}".format(bucket, obj.key), "size": obj.size,
+                 "modified": obj.last_modified.timestamp()}
+                for obj in self.s3.Bucket(bucket).objects.filter(Prefix=prefix) if obj.key.endswith(self.suffix)]
+
+
+class LocalSource:
+    """Event files written in a local directory, standing in for the s3 prefix"""
+
+    def __init__(self, directory, suffix=".json"):
+        self.directory = directory
+        self.suffix = suffix
+
+    def list_files(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in sorted(names):
+                if name.endswith(self.suffix):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    files.append({"path": path, "size": stat.st_size, "modified": stat.st_mtime})
+        return files
+
+
+class MicroBatcher:
+    """Group the files found by the polls into batches.
+    A batch is released when its files reach max_bytes or when its oldest file waited max_seconds.
+    At most max_pending files are held: the others are left in the source and offered again by the next polls,
+    so a slow warehouse slows down the polling instead of growing the queue.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_seconds=300.0, max_pending=1000):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.max_pending = max_pending
+        self.pending = []
+
+    def offer(self, files, now):
+        """Queue new files while there is room
+        Args:
+            files(list): files not loaded nor queued yet
+            now(float): current time
+
+        Returns:
+            int, number of queued files
+        """
+        accepted = files[:max(self.max_pending - len(self.pending), 0)]
+        for file in accepted:
+            self.pending.append(dict(file, queued=now))
+        return len(accepted)
+
+    def is_ready(self, now):
+        if not self.pending:
+            return False
+        return sum(file["size"] for file in self.pending) >= self.max_bytes or \
+            now - self.pending[0]["queued"] >= self.max_seconds
+
+    def take(self):
+        """Remove the next batch from the queue, at least one file and up to max_bytes
+
+        Returns:
+            list
+        """
+        n_bytes = 0
+        for i, file in enumerate(self.pending):
+            n_bytes += file["size"]
+            if i > 0 and n_bytes > self.max_bytes:
+                break
+        else:
+            i = len(self.pending)
+        batch, self.pending = self.pending[:i], self.pending[i:]
+        return batch
+
+    def requeue(self, batch):
+        """Put back a batch that could not be loaded at the head of the queue, keeping its queue times
+        Args:
+            batch(list): files of the batch
+        """
+        self.pending = batch + self.pending
+
+
+class Follower:
+    """Load new event files in micro batches, appending their plays and timestamps to the star schema.
+    Each batch is copied, merged into the tables and the aggregates and recorded in follow_files
+    in a single transaction,
+    so a restarted follower resumes from the first file not loaded.
+    A file is known once its batch is committed, a batch that fails is queued again.
+    """
+
+    def __init__(self, backend, cur, conn, source, batcher, s3=None, manifest_prefix=None):
+        self.backend = backend
+        self.cur = cur
+        self.conn = conn
+        self.source = source
+        self.batcher = batcher
+        self.s3 = s3
+        self.manifest_prefix = manifest_prefix
+        self.n_batches = 0
+        for query in [staging_events_batch_create, follow_files_create, follow_batches_create]:
+            self.cur.execute(query)
+        self.conn.commit()
+        self.cur.execute(follow_files_select)
+        self.known_files = {row[0] for row in self.cur.fetchall()}
+
+    def poll(self, now):
+        """List the source and queue the files neither loaded nor queued yet
+
+        Returns:
+            int, number of queued files
+        """
+        queued_files = {file["path"] for file in self.batcher.pending}
+        new_files = [file for file in self.source.list_files()
+                     if file["path"] not in self.known_files and file["path"] not in queued_files]
+        new_files.sort(key=lambda file: (file["modified"], file["path"]))
+        n_queued = self.batcher.offer(new_files, now)
+        if n_queued < len(new_files):
+            logger.info("{} new files left in the source, the queue is full".format(len(new_files) - n_queued))
+        return n_queued
+
+    def _copy_batch(self, batch_id, paths):
+        if self.backend.name == "redshift":
+            bucket = sources.parse_s3_uri(paths[0])[0]
+            keys = [sources.parse_s3_uri(path)[1] for path in paths]
+            manifest_uri = "{}/{}.manifest".format(self.manifest_prefix.rstrip("/"), batch_id)
+            sources.write_manifest(self.s3, manifest_uri, sources.build_manifest(bucket, keys))
+            self.cur.execute(staging_events_batch_copy_manifest.format(manifest_uri))
+        else:
+            self.backend.bulk_load_files("staging_events_batch", paths, "staging_events")
+
+    def load_batch(self, batch):
+        """Copy a batch of files and append its songplays and timestamps not loaded yet to the tables.
+        If the batch fails, it is rolled back and its files are queued again
+        Args:
+            batch(list): files of the batch
+
+        Returns:
+            dict, metrics of the batch
+        """
+        start = time.perf_counter()
+        batch_id = "{}-{:06d}".format(time.strftime("%Y%m%dT%H%M%S"), self.n_batches)
+        paths = [file["path"] for file in batch]
+        n_bytes = sum(file["size"] for file in batch)
+        try:
+            self.cur.execute(staging_events_batch_delete)
+            self._copy_batch(batch_id, paths)
+            self.cur.execute(staging_events_new_drop)
+            self.cur.execute(staging_events_new_create)
+            self.cur.execute("SELECT COUNT(*) FROM staging_events_new;")
+            n_events = self.cur.fetchone()[0]
+            self.cur.execute(songplays_new_drop)
+            self.cur.execute(songplays_new_create)
+            self.cur.execute(songplay_new_insert)
+            n_songplays = max(self.cur.rowcount, 0)
+            if n_songplays > 0:
+                execute_merge(self.cur, "songplays_new")
+            self.cur.execute(time_new_insert)
+            self.cur.execute(songplays_new_drop)
+            self.cur.execute(staging_events_new_drop)
+            self.cur.execute(follow_files_insert.format(", ".join(["(%s, %s, GETDATE())"] * len(paths))),
+                             [value for path in paths for value in (path, batch_id)])
+            duration = time.perf_counter() - start
+            self.cur.execute(follow_batches_insert, (batch_id, len(paths), n_bytes, n_events, n_songplays, duration))
+            for query in table_versions_queries(follow_tables):
+                self.cur.execute(query)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            self.batcher.requeue(batch)
+            raise
+        self.known_files.update(paths)
+        self.n_batches += 1
+        metrics = {
+            "batch_id": batch_id,
+            "n_files": len(paths),
+            "n_bytes": n_bytes,
+            "n_events": n_events,
+            "n_songplays": n_songplays,
+            "duration_s": duration,
+            "rows_per_s": n_events / max(duration, 1e-9),
+            "latency_s": time.time() - min(file["modified"] for file in batch)
+        }
+        logger.info("Batch {batch_id}: {n_files} files, {n_bytes} bytes, {n_events} events, "
+                    "{n_songplays} songplays, {rows_per_s:.0f} rows/s, end-to-end latency {latency_s:.1f}s"
+                    .format(**metrics))
+        return metrics
+
+    def run(self, poll_interval=30.0, max_batches=None):
+        """Poll the source and load the ready batches until interrupted,
+        then load the files still queued.
+        A failed batch is retried after the next poll
+        Args:
+            poll_interval(float): seconds between two polls
+            max_batches(int): stop after loading this number of batches, never if None
+
+        Returns:
+            list of dict, metrics of the loaded batches
+        """
+        history = []
+        try:
+            while max_batches is None or len(history) < max_batches:
+                self.poll(time.time())
+                while self.batcher.is_ready(time.time()) and (max_batches is None or len(history) < max_batches):
+                    try:
+                        history.append(self.load_batch(self.batcher.take()))
+                    except Exception as e:
+                        logger.warning("Batch failed ({}), its files are queued again".format(e))
+                        break
+                if max_batches is None or len(history) < max_batches:
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            logger.info("Interrupted, loading the queued files..")
+            while self.batcher.pending:
+                history.append(self.load_batch(self.batcher.take()))
+        return history
@@ -0,0 +1,62 @@
+from redshift_etl_template.src.sql_queries import pending_events_table_create, late_songplays_create, \
+    late_songplays_drop, late_songplays_existing_delete, late_songplays_insert, pending_events_matched_delete, \
+    pending_events_expired_delete, pending_events_insert
+from redshift_etl_template.src.aggregates import execute_merge
+from redshift_etl_template.src.cache import table_versions_queries
+from redshift_etl_template.src.transactions import run_in_transaction
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def execute_reconcile(cur, window_days=7, refresh_aggregates=True):
+    """Insert the songplays of the pending events whose song has been loaded by the current run,
+    expire the events pending for longer than the window and keep the new unmatched events.
+    Only the pending events are joined, so the cost is proportional to them and not to the history.
+    The late songplays are merged into the aggregate tables in the same transaction, left open
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        window_days(int): days an event is kept waiting for its song
+        refresh_aggregates(bool): if True, add the late songplays to the aggregate tables
+
+    Returns:
+        int
+    """
+    logger.info("Reconciling late events..")
+    statements = [
+        pending_events_table_create,
+        late_songplays_drop,
+        late_songplays_create,
+        late_songplays_existing_delete,
+        late_songplays_insert,
+        pending_events_matched_delete,
+        pending_events_expired_delete.format(int(window_days)),
+        pending_events_insert
+    ] + table_versions_queries(["songplays"])
+    for statement in statements:
+        cur.execute(statement)
+    cur.execute("SELECT COUNT(*) FROM late_songplays;")
+    n_late = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM pending_events;")
+    n_pending = cur.fetchone()[0]
+    logger.info("{} late songplays inserted, {} events still pending".format(n_late, n_pending))
+    if refresh_aggregates and n_late > 0:
+        execute_merge(cur, "late_songplays")
+    cur.execute(late_songplays_drop)
+    return n_late
+
+
+def reconcile_late_events(cur, conn, window_days=7, refresh_aggregates=True):
+    """Reconcile the late events (see execute_reconcile) in one transaction,
+    so that a failure inserts no songplay and merges nothing into the aggregates
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        window_days(int): days an event is kept waiting for its song
+        refresh_aggregates(bool): if True, add the late songplays to the aggregate tables
+
+    Returns:
+        int
+    """
+    return run_in_transaction(conn, lambda: execute_reconcile(cur, window_days, refresh_aggregates))
@@ -0,0 +1,112 @@
+import time
+
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+run_ledger_create = ("""
+CREATE TABLE IF NOT EXISTS etl_run_ledger (
+    run_id 		VARCHAR 	NOT NULL,
+    stage 		VARCHAR 	NOT NULL,
+    attempt 		INT 		NOT NULL,
+    status 		VARCHAR 	NOT NULL,
+    started_at 		TIMESTAMP 	NOT NULL,
+    ended_at 		TIMESTAMP 	NULL,
+    n_rows 		BIGINT 		NULL,
+    error 		VARCHAR(1024) 	NULL
+)
+diststyle all
+SORTKEY (run_id, stage)
+;""")
+run_ledger_completed = """
+SELECT stage FROM etl_run_ledger WHERE run_id = %s AND status = 'completed'
+"""
+run_ledger_last_attempt = """
+SELECT COALESCE(MAX(attempt), 0) FROM etl_run_ledger WHERE run_id = %s AND stage = %s
+"""
+run_ledger_start = """
+INSERT INTO etl_run_ledger (run_id, stage, attempt, status, started_at)
+VALUES (%s, %s, %s, 'running', GETDATE())
+"""
+run_ledger_end = """
+UPDATE etl_run_ledger SET status = %s, ended_at = GETDATE(), n_rows = %s, error = %s
+WHERE run_id = %s AND stage = %s AND attempt = %s
+"""
+
+
+class RunLedger:
+    """Record the stages of an etl run, so that a new attempt of the same run
+    skips the completed stages and retries only the others.
+    A stage is marked as completed in the same transaction of its statements,
+    so a stage is either fully applied and recorded, or not applied at all.
+    The attempts of a stage are numbered across the processes of the run,
+    an attempt interrupted by a crash stays recorded as running.
+    """
+
+    def __init__(self, cur, conn, run_id, max_retries=3, backoff=30.0):
+        self.cur = cur
+        self.conn = conn
+        self.run_id = run_id
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cur.execute(run_ledger_create)
+        self.conn.commit()
+
+    def get_completed_stages(self):
+        self.cur.execute(run_ledger_completed, (self.run_id,))
+        return {row[0] for row in self.cur.fetchall()}
+
+    def get_last_attempt(self, stage):
+        self.cur.execute(run_ledger_last_attempt, (self.run_id, stage))
+        return self.cur.fetchone()[0]
+
+    def _attempt_stage(self, stage, queries, attempt):
+        self.cur.execute(run_ledger_start, (self.run_id, stage, attempt))
+        self.conn.commit()
+        try:
+            if callable(queries):
+                n_rows = queries(self.cur)
+            else:
+                n_rows = 0
+                for query in queries:
+                    self.cur.execute(query)
+                    n_rows += max(self.cur.rowcount, 0)
+            self.cur.execute(run_ledger_end, ("completed", n_rows, None, self.run_id, stage, attempt))
+            self.conn.commit()
+            return n_rows
+        except Exception as e:
+            self.conn.rollback()
+            self.cur.execute(run_ledger_end, ("failed", None, str(e)[:1024], self.run_id, stage, attempt))
+            self.conn.commit()
+            raise
+
+    def run_stages(self, stages):
+        """Run the stages not completed by a previous attempt of the run, retrying the failed ones
+        with an exponential backoff
+        Args:
+            stages(list): (stage name, statements) tuples, in execution order.
+                The statements are a list of queries, or a function executing them on a cursor
+                without committing and returning the number of rows written
+        """
+        completed_stages = self.get_completed_stages()
+        for stage, queries in stages:
+            if stage in completed_stages:
+                logger.info("Run {}: skipping stage {}, already completed".format(self.run_id, stage))
+                continue
+            first_attempt = self.get_last_attempt(stage) + 1
+            for retry in range(self.max_retries):
+                attempt = first_attempt + retry
+                start = time.perf_counter()
+                try:
+                    n_rows = self._attempt_stage(stage, queries, attempt)
+                    logger.info("Run {}: stage {} completed, {} rows in {:.2f}s".format(
+                        self.run_id, stage, n_rows, time.perf_counter() - start))
+                    break
+                except Exception as e:
+                    if retry == self.max_retries - 1:
+                        raise
+                    wait = self.backoff * 2 ** retry
+                    logger.warning("Run {}: stage {} failed at attempt {} ({}), retrying in {:.0f}s".format(
+                        self.run_id, stage, attempt, e, wait))
+                    time.sleep(wait)
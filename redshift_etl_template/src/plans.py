@@ -0,0 +1,291 @@
+import os
+import re
+import json
+import hashlib
+import pandas as pd
+
+from redshift_etl_template.src.sql_queries import star_tables, table_queries, songplay_table_select, \
+    staging_events_unique_create, staging_songs_unique_create, users_window_create, staging_tables, history_tables, \
+    drop_table_queries, create_table_queries, users_scd_queries, insert_table_queries
+from redshift_etl_template.constants import DIR_DATA_TEST, logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DIR_PLANS = os.path.join(DIR_DATA_TEST, "plans")
+
+# statements whose plans are guarded: the songplays join, the star inserts and the statements rewriting
+# the COPY targets, COPY itself cannot be explained
+plan_statements = dict(
+    [("delta_songplays", songplay_table_select)] +
+    [("insert_{}".format(table), table_queries[table]["insert"]) for table in star_tables] + [
+        ("duplicates_staging_events", table_queries["staging_events"]["duplicates"]),
+        ("dedupe_staging_events", staging_events_unique_create),
+        ("duplicates_staging_songs", table_queries["staging_songs"]["duplicates"]),
+        ("dedupe_staging_songs", staging_songs_unique_create),
+        ("history_users", users_window_create)
+    ])
+
+# rules holding whatever the baseline: the songplays join stays a hash join, and on redshift
+# it joins the staging tables on their distribution keys without moving rows between the nodes
+hash_join_statements = ["delta_songplays"]
+colocated_statements = ["delta_songplays"]
+PLAN_FIXTURES_SCHEMA = "plan_fixtures"
+
+# fixtures of the tests loaded before explaining the statements, so that the plans are chosen
+# on the statistics of filled tables and not on the defaults of empty ones
+fixture_files = {
+    "staging_events": ["df_songplays_staging_events.csv", "df_user_staging_events.csv"],
+    "staging_songs": ["df_songplays_staging_songs.csv", "df_songs_staging_songs.csv"]
+}
+# every round doubles the staging tables with a copy of their rows under new keys,
+# the copied events play the copied songs only
+fixture_copies = {
+    "staging_events": ("""
+INSERT INTO staging_events
+SELECT
+    artist, auth, firstName, gender, itemInSession, lastName, length, level, location, method, page, registration,
+    sessionId + {0}, song || '~{1}', status, ts + {0}, userAgent, userId + {0}
+FROM staging_events
+;"""),
+    "staging_songs": ("""
+INSERT INTO staging_songs
+SELECT
+    artist_id || '~{1}', artist_latitude, artist_location, artist_longitude, artist_name,
+    duration, num_songs, song_id || '~{1}', title || '~{1}', year
+FROM staging_songs
+;""")
+}
+
+# cost of the redistribution steps of a join, from none to moving both tables
+redistribution_ranks = {
+    "DS_DIST_NONE": 0,
+    "DS_DIST_ALL_NONE": 0,
+    "DS_DIST_INNER": 1,
+    "DS_DIST_OUTER": 2,
+    "DS_DIST_ALL_INNER": 3,
+    "DS_BCAST_INNER": 3,
+    "DS_DIST_BOTH": 4
+}
+plan_node_pattern = re.compile(
+    r"^\s*(?:->\s*)?(?:XN\s+)?(?P<op>[A-Za-z][A-Za-z ]*?)(?:\s+(?P<dist>DS_[A-Z_]+))?"
+    r'(?:\s+on\s+"?(?P<relation>[\w.]+)"?[^(]*?)?\s+\(cost=[\d.]+\.\.(?P<cost>[\d.]+)')
+
+
+def read_fixture(path):
+    """Read a csv fixture of the tests, without its comment lines
+    Args:
+        path(str): path of the csv file
+
+    Returns:
+        pd.DataFrame
+    """
+    df = pd.read_csv(path)
+    df = df.loc[~df.iloc[:, 0].astype(str).str.startswith("#", na=False), :]
+    return df.astype(object).where(pd.notnull(df), None)
+
+
+def load_fixtures(cur, conn, rounds=10):
+    """Recreate the tables of the etl in the current schema, fill the staging tables with the fixtures of the tests,
+    doubled at every round, run the etl dedupe and inserts on them and analyze every table
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor, on the schema of the fixtures
+        conn(psycopg2.connection): psycopg2 connection
+        rounds(int): number of times the staging tables are doubled
+    """
+    for query in drop_table_queries + create_table_queries:
+        cur.execute(query)
+    for table, files in fixture_files.items():
+        for name in files:
+            df = read_fixture(os.path.join(DIR_DATA_TEST, name))
+            query = "INSERT INTO {} ({}) VALUES ({});".format(
+                table, ", ".join(df.columns), ", ".join(["%s"] * len(df.columns)))
+            for row in df.itertuples(index=False, name=None):
+                cur.execute(query, row)
+    for i in range(rounds):
+        for table in staging_tables:
+            cur.execute(fixture_copies[table].format(10000 * 2 ** i, i))
+    for query in table_queries["staging_events"]["dedupe"] + table_queries["staging_songs"]["dedupe"] + \
+            users_scd_queries + insert_table_queries:
+        cur.execute(query)
+    conn.commit()
+    for table in staging_tables + star_tables + history_tables + ["songplays_delta"]:
+        cur.execute("ANALYZE {};".format(table))
+    conn.commit()
+    logger.info("Fixtures loaded and analyzed, {} rounds".format(rounds))
+
+
+def statement_hash(query):
+    """Hash of a statement, ignoring the layout and the final semicolon
+    Args:
+        query(str): sql statement
+
+    Returns:
+        str
+    """
+    return hashlib.md5(" ".join(query.strip().rstrip(";").split()).encode("utf-8")).hexdigest()
+
+
+def explain(cur, query):
+    """Get the plan of a statement
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        query(str): sql statement
+
+    Returns:
+        list of str, lines of the plan
+    """
+    cur.execute("EXPLAIN " + query.strip().rstrip(";"))
+    return [row[0] for row in cur.fetchall()]
+
+
+def normalize_plan(lines):
+    """Reduce a plan to what should not change silently:
+    its nodes, the join types, the redistribution steps and the estimated cost.
+    Aliases, row estimates, conditions and the costs of the single nodes are left out.
+    Args:
+        lines(list): lines of the plan, as returned by EXPLAIN
+
+    Returns:
+        dict
+    """
+    nodes, joins, redistribution = [], [], []
+    cost = None
+    for line in lines:
+        match = plan_node_pattern.match(line)
+        if match is None:
+            continue
+        op = " ".join(match.group("op").split())
+        node = op
+        if match.group("dist"):
+            node += " " + match.group("dist")
+            redistribution.append(match.group("dist"))
+        if match.group("relation"):
+            node += " on " + match.group("relation")
+        nodes.append(node)
+        if "Join" in op or "Nested Loop" in op:
+            joins.append(op)
+        if cost is None:
+            cost = float(match.group("cost"))
+    return {"nodes": nodes, "joins": joins, "redistribution": redistribution, "cost": cost}
+
+
+def check_rules(name, plan):
+    """Check a normalized plan against the rules of its statement, independently of its baseline
+    Args:
+        name(str): name of the statement
+        plan(dict): normalized plan of the statement
+
+    Returns:
+        list, violated rules
+    """
+    violations = []
+    if name in hash_join_statements and (not plan["joins"] or any(join != "Hash Join" for join in plan["joins"])):
+        violations.append("joins are {}, only hash joins are accepted".format(plan["joins"]))
+    if name in colocated_statements and any(redistribution_ranks.get(step, 4) > 0 for step in plan["redistribution"]):
+        violations.append("redistribution {}, the join should be collocated".format(plan["redistribution"]))
+    return violations
+
+
+def compare_plans(baseline, plan, cost_tolerance=0.5):
+    """Compare a normalized plan against its baseline
+    Args:
+        baseline(dict): normalized plan accepted in the baseline
+        plan(dict): normalized plan of the current statement
+        cost_tolerance(float): admitted relative growth of the estimated cost
+
+    Returns:
+        tuple of list, regressions and other differences
+    """
+    regressions, changes = [], []
+    n_loops = sum("Nested Loop" in join for join in plan["joins"])
+    n_loops_baseline = sum("Nested Loop" in join for join in baseline["joins"])
+    if n_loops > n_loops_baseline:
+        regressions.append("nested loops went from {} to {}".format(n_loops_baseline, n_loops))
+    ranks = sorted((redistribution_ranks.get(step, 4) for step in plan["redistribution"]), reverse=True)
+    ranks_baseline = sorted((redistribution_ranks.get(step, 4) for step in baseline["redistribution"]),
+                            reverse=True)
+    if ranks > ranks_baseline:
+        regressions.append("redistribution went from {} to {}".format(
+            baseline["redistribution"], plan["redistribution"]))
+    if baseline["cost"] is not None and plan["cost"] is not None and \
+            plan["cost"] > baseline["cost"] * (1 + cost_tolerance):
+        regressions.append("estimated cost went from {:.2f} to {:.2f}".format(baseline["cost"], plan["cost"]))
+    if not regressions and plan["nodes"] != baseline["nodes"]:
+        changes.append("nodes went from {} to {}".format(baseline["nodes"], plan["nodes"]))
+    return regressions, changes
+
+
+def load_plans(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_plans(path, plans):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(plans, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+class RecordedPlanCursor:
+    """Cursor answering EXPLAIN with the plans recorded on a database,
+    standing in for the warehouse where there is none.
+    A statement changed since its recording has no plan, and has to be recorded again."""
+
+    def __init__(self, recorded):
+        self.recorded = {plan["statement_hash"]: plan["plan"] for plan in recorded.values()}
+        self._rows = []
+
+    def execute(self, query, params=None):
+        query = re.sub(r"^\s*EXPLAIN\s+", "", query)
+        key = statement_hash(query)
+        if key not in self.recorded:
+            raise Exception("no recorded plan for the statement, record it again:\n{}".format(query))
+        self._rows = [(line,) for line in self.recorded[key]]
+
+    def fetchall(self):
+        return self._rows
+
+
+def record_plans(cur, statements=None):
+    """Explain every statement
+    Args:
+        cur(psycopg2.cursor): cursor of the database where the tables of the statements exist
+        statements(dict): name -> statement, plan_statements if None
+
+    Returns:
+        dict
+    """
+    statements = statements or plan_statements
+    return {name: {"statement_hash": statement_hash(query), "plan": explain(cur, query)}
+            for name, query in statements.items()}
+
+
+def check_plans(cur, baselines, statements=None, cost_tolerance=0.5):
+    """Explain every statement, check the rules of its plan and compare it against the baseline
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor, or a RecordedPlanCursor
+        baselines(dict): name -> normalized plan accepted as baseline
+        statements(dict): name -> statement, plan_statements if None
+        cost_tolerance(float): admitted relative growth of the estimated cost
+
+    Returns:
+        dict, name -> (regressions, changes)
+    """
+    statements = statements or plan_statements
+    results = {}
+    for name, query in statements.items():
+        if name not in baselines:
+            results[name] = (["no baseline"], [])
+            continue
+        plan = normalize_plan(explain(cur, query))
+        regressions, changes = compare_plans(baselines[name], plan, cost_tolerance)
+        results[name] = (check_rules(name, plan) + regressions, changes)
+        for regression in results[name][0]:
+            logger.warning("{}: {}".format(name, regression))
+        for change in results[name][1]:
+            logger.info("{}: {}".format(name, change))
+    return results
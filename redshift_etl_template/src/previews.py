@@ -0,0 +1,65 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from redshift_etl_template.src.utils import get_typed_dataframe
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+preview_query = "SELECT * FROM {} LIMIT {};"
+count_query = "SELECT COUNT(*) FROM {};"
+
+
+def preview_table(pool, table, n_elem=5, statement_timeout=60.0, cache=None):
+    """Get the head and the row count of a table on a connection of the pool
+    Args:
+        pool(psycopg2.pool.AbstractConnectionPool): pool of connections to the database
+        table(str): name of the table
+        n_elem(int): number of elements of the head
+        statement_timeout(float): seconds after which each query is cancelled
+        cache(QueryCache): if given, reuse the results cached since the last write on the table
+
+    Returns:
+        dict
+    """
+    start = time.perf_counter()
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SET statement_timeout TO {};".format(int(statement_timeout * 1000)))
+        query = preview_query.format(table, n_elem)
+        if cache is not None:
+            df = cache.get_dataframe(cur, query)
+        else:
+            cur.execute(query)
+            df = get_typed_dataframe(cur.fetchall(), cur.description)
+        cur.execute(count_query.format(table))
+        n_rows = cur.fetchone()[0]
+        return {"table": table, "df": df, "n_rows": n_rows, "duration": time.perf_counter() - start, "error": None}
+    except Exception as e:
+        return {"table": table, "df": None, "n_rows": None, "duration": time.perf_counter() - start, "error": str(e)}
+    finally:
+        conn.rollback()
+        pool.putconn(conn)
+
+
+def preview_tables(pool, tables, max_workers=4, n_elem=5, statement_timeout=60.0, cache=None):
+    """Preview tables concurrently, yielding every result as soon as its table completes.
+    A failing or timed out table is reported in its result without stopping the others.
+    Args:
+        pool(psycopg2.pool.AbstractConnectionPool): pool with at least max_workers connections
+        tables(list): names of the tables
+        max_workers(int): maximum number of tables queried at once
+        n_elem(int): number of elements of each head
+        statement_timeout(float): seconds after which each query is cancelled
+        cache(QueryCache): if given, reuse the results cached since the last write on the table
+
+    Returns:
+        generator of dict
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(preview_table, pool, table, n_elem, statement_timeout, cache)
+                   for table in tables]
+        for future in as_completed(futures):
+            yield future.result()
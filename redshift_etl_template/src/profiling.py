@@ -0,0 +1,134 @@
+import pandas as pd
+
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# postgres type oids of the columns with an order: int2, int4, int8, float4, float8, numeric, timestamp
+ORDERED_TYPE_CODES = {20, 21, 23, 700, 701, 1700, 1114}
+# fraction of blocks read by the local fallback
+LOCAL_SAMPLE_PERCENT = 10
+
+table_info_redshift = """
+SELECT "table", size AS size_mb, tbl_rows AS n_rows, skew_rows, unsorted, diststyle
+FROM svv_table_info
+WHERE "table" IN ({});
+"""
+table_info_postgres = """
+SELECT c.relname AS "table", pg_total_relation_size(c.oid) / (1024 * 1024) AS size_mb,
+    c.reltuples::BIGINT AS n_rows, NULL AS skew_rows, NULL AS unsorted, NULL AS diststyle
+FROM pg_class AS c
+WHERE c.relname IN ({}) AND c.relkind = 'r';
+"""
+
+
+def is_redshift(cur):
+    """Check if the cursor points to a redshift database or to a local postgres one
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+
+    Returns:
+        bool
+    """
+    cur.execute("SELECT version();")
+    return "Redshift" in cur.fetchone()[0]
+
+
+def get_columns(cur, table):
+    """Get the columns of a table without reading its rows
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        table(str): name of the table
+
+    Returns:
+        list of (name, is_ordered) tuples
+    """
+    cur.execute("SELECT * FROM {} LIMIT 0;".format(table))
+    return [(desc[0], desc[1] in ORDERED_TYPE_CODES) for desc in cur.description]
+
+
+def get_quantile_alias(column, quantile):
+    return "{}_p{:g}".format(column, quantile * 100)
+
+
+def profile_query(table, columns, quantiles=(0.5,), redshift=True, sample_percent=LOCAL_SAMPLE_PERCENT):
+    """Build the query estimating the distinct values of every column and the quantiles
+    of the ordered ones, all with one scan of the table
+    Args:
+        table(str): name of the table
+        columns(list): (name, is_ordered) tuples of the columns
+        quantiles(tuple): quantiles to be estimated on the ordered columns
+        redshift(bool): if False, compute them exactly over a sample of blocks of a postgres table
+        sample_percent(float): percentage of blocks read by the postgres query
+
+    Returns:
+        str
+    """
+    approximate = "APPROXIMATE " if redshift else ""
+    aggregates = ["{}COUNT(DISTINCT {}) AS \"{}\"".format(approximate, name, name) for name, _ in columns]
+    aggregates += ["{}PERCENTILE_DISC({}) WITHIN GROUP (ORDER BY {}) AS \"{}\"".format(
+        approximate, quantile, name, get_quantile_alias(name, quantile))
+        for name, is_ordered in columns if is_ordered for quantile in quantiles]
+    query = "SELECT {} FROM {}".format(", ".join(aggregates), table)
+    if not redshift:
+        query += " TABLESAMPLE SYSTEM ({})".format(sample_percent)
+    return query + ";"
+
+
+def get_table_info(cur, tables, redshift=True):
+    """Get the catalog statistics of the tables: size, rows, skew, unsorted percentage and distribution style
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        tables(list): names of the tables
+        redshift(bool): if False, read the postgres catalog
+
+    Returns:
+        pd.DataFrame
+    """
+    template = table_info_redshift if redshift else table_info_postgres
+    cur.execute(template.format(", ".join("'{}'".format(table) for table in tables)))
+    columns = [desc[0] for desc in cur.description]
+    return pd.DataFrame(cur.fetchall(), columns=columns)
+
+
+def profile_table(cur, table, quantiles=(0.5,), redshift=True, sample_percent=LOCAL_SAMPLE_PERCENT):
+    """Estimate cardinality and quantiles of every column of a table with a single query, without exact full scans
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        table(str): name of the table
+        quantiles(tuple): quantiles to be estimated on the ordered columns
+        redshift(bool): if False, use the local postgres fallback
+        sample_percent(float): percentage of blocks read by the local fallback
+
+    Returns:
+        pd.DataFrame
+    """
+    columns = get_columns(cur, table)
+    cur.execute(profile_query(table, columns, quantiles, redshift, sample_percent))
+    result = dict(zip([desc[0] for desc in cur.description], cur.fetchone()))
+    rows = []
+    for name, is_ordered in columns:
+        row = {"column": name, "approx_distinct": result[name]}
+        for quantile in quantiles:
+            row["p{:g}".format(quantile * 100)] = result[get_quantile_alias(name, quantile)] if is_ordered else None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def profile_tables(cur, tables, quantiles=(0.5,)):
+    """Profile a list of tables, detecting if the local fallback is needed
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        tables(list): names of the tables
+        quantiles(tuple): quantiles to be estimated on the ordered columns
+
+    Returns:
+        tuple of table statistics (pd.DataFrame) and column profiles by table (dict)
+    """
+    redshift = is_redshift(cur)
+    if not redshift:
+        logger.info("Not a redshift database, profiling over a {}% sample of blocks".format(LOCAL_SAMPLE_PERCENT))
+    df_info = get_table_info(cur, tables, redshift)
+    profiles = {table: profile_table(cur, table, quantiles, redshift) for table in tables}
+    return df_info, profiles
@@ -0,0 +1,98 @@
+import json
+import hashlib
+from urllib.parse import urlparse
+
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+SAMPLE_BUCKETS = 10000
+
+
+def parse_s3_uri(uri):
+    """Split an s3 uri into bucket and key prefix
+    Args:
+        uri(str): uri in the format s3://bucket/prefix
+
+    Returns:
+        tuple
+    """
+    parsed = urlparse(uri)
+    if parsed.scheme != "s3":
+        raise ValueError("not an s3 uri: {}".format(uri))
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+def list_source_keys(s3, uri, suffix=".json"):
+    """List the keys of the source files stored under an s3 prefix
+    Args:
+        s3(boto3.resources.base.ServiceResource): s3 resource
+        uri(str): s3 prefix of the source files
+        suffix(str): extension of the files to be listed
+
+    Returns:
+        list
+    """
+    bucket, prefix = parse_s3_uri(uri)
+    keys = [obj.key for obj in s3.Bucket(bucket).objects.filter(Prefix=prefix)
+            if obj.key.endswith(suffix)]
+    logger.info("Found {} files under {}".format(len(keys), uri))
+    return keys
+
+
+def is_key_sampled(key, fraction):
+    """Check if a file belongs to the sample.
+    The decision depends only on the key, so the same files are picked at every run
+    and a bigger fraction always contains the files of a smaller one.
+    Args:
+        key(str): key of the file
+        fraction(float): fraction of files to be sampled, in (0, 1]
+
+    Returns:
+        bool
+    """
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return int(digest, 16) % SAMPLE_BUCKETS < fraction * SAMPLE_BUCKETS
+
+
+def sample_keys(keys, fraction):
+    """Select a deterministic fraction of keys
+    Args:
+        keys(list): keys of the source files
+        fraction(float): fraction of files to be sampled, in (0, 1]
+
+    Returns:
+        list
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError("sample fraction has to be in (0, 1], got {}".format(fraction))
+    return [key for key in keys if is_key_sampled(key, fraction)]
+
+
+def build_manifest(bucket, keys):
+    """Build the content of a COPY manifest listing the given files
+    Args:
+        bucket(str): bucket of the files
+        keys(list): keys of the files
+
+    Returns:
+        dict
+    """
+    return {"entries": [{"url": "s3://{}/{}".format(bucket, key), "mandatory": True} for key in keys]}
+
+
+def write_manifest(s3, uri, manifest):
+    """Upload a manifest to s3
+    Args:
+        s3(boto3.resources.base.ServiceResource): s3 resource
+        uri(str): s3 destination of the manifest
+        manifest(dict): content of the manifest
+
+    Returns:
+        str
+    """
+    bucket, key = parse_s3_uri(uri)
+    s3.Object(bucket, key).put(Body=json.dumps(manifest).encode("utf-8"))
+    logger.info("Manifest with {} files written in {}".format(len(manifest["entries"]), uri))
+    return uri
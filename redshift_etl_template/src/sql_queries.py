@@ -8,6 +8,7 @@ config.read(CONFIG_PATH_DWH_CURRENT)
 # TABLES
 star_tables = ["songplays", "users", "songs", "artists", "time"]
 staging_tables = ["staging_events", "staging_songs"]
+history_tables = ["users_history"]
 
 # DROP TABLES
 staging_events_table_drop = "DROP TABLE IF EXISTS staging_events"
@@ -17,6 +18,7 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+users_history_table_drop = "DROP TABLE IF EXISTS users_history"
 
 # CREATE TABLES
 staging_events_table_create = ("""
@@ -62,7 +64,7 @@ DISTKEY (artist_name)
 ;""")
 songplay_table_create = ("""
 CREATE TABLE IF NOT EXISTS songplays (
-    songplay_id 	BIGINT IDENTITY(0,1) PRIMARY KEY,
+    songplay_id 	BIGINT 		NOT NULL PRIMARY KEY,
     start_time 		TIMESTAMP 	NOT NULL,
     user_id 		INT 		NOT NULL,
     level 		VARCHAR 	NOT NULL,
@@ -123,37 +125,111 @@ SORTKEY (start_time)
 ;""")
 
 # STAGING TABLES
-staging_events_copy = ("""COPY staging_events FROM '{}'
+# the staging tables are emptied in the transaction of their COPY, so that every load starts from scratch:
+# DELETE and not TRUNCATE, that would commit the open transaction on redshift
+staging_events_table_delete = "DELETE FROM staging_events;"
+staging_songs_table_delete = "DELETE FROM staging_songs;"
+# COPY of a staging table, formatted with the s3 source, the iam role and the json format
+staging_events_copy_template = """COPY staging_events FROM '{}'
 CREDENTIALS 'aws_iam_role={}'
 FORMAT AS JSON '{}'
 REGION 'us-west-2';
-""").format(
+"""
+staging_songs_copy_template = staging_events_copy_template.replace("COPY staging_events ", "COPY staging_songs ")
+staging_events_copy = staging_events_copy_template.format(
     config.get("S3", "log_data"),
     config.get("IAM_ROLE", "arn"),
     config.get("S3", "log_jsonpath")
 )
-staging_songs_copy = ("""COPY staging_songs FROM '{}'
+staging_songs_copy = staging_songs_copy_template.format(
+    config.get("S3", "song_data"),
+    config.get("IAM_ROLE", "arn"),
+    "auto"
+)
+
+staging_events_copy_manifest = ("""COPY staging_events FROM '{{}}'
+CREDENTIALS 'aws_iam_role={}'
+FORMAT AS JSON '{}'
+MANIFEST
+REGION 'us-west-2';
+""").format(
+    config.get("IAM_ROLE", "arn"),
+    config.get("S3", "log_jsonpath")
+)
+staging_songs_copy_manifest = ("""COPY staging_songs FROM '{{}}'
 CREDENTIALS 'aws_iam_role={}'
 FORMAT AS JSON 'auto'
+MANIFEST
 REGION 'us-west-2';
-;""").format(
-    config.get("S3", "song_data"),
+""").format(
     config.get("IAM_ROLE", "arn")
 )
 
+# STAGING DEDUPE - replayed or duplicated source files load the same records more than once.
+# Duplicates are removed once after COPY, keeping one row per natural key,
+# so the star inserts do not need to sort and deduplicate their results.
+staging_events_duplicates_select = ("""
+SELECT COUNT(*) FROM (
+    SELECT 1 FROM staging_events GROUP BY sessionId, itemInSession, ts HAVING COUNT(*) > 1
+) AS duplicates;
+""")
+staging_events_unique_create = ("""
+CREATE TEMP TABLE staging_events_unique AS
+SELECT
+    artist, auth, firstName, gender, itemInSession, lastName, length, level, location,
+    method, page, registration, sessionId, song, status, ts, userAgent, userId
+FROM (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY sessionId, itemInSession, ts ORDER BY ts) AS key_rank
+    FROM staging_events
+) AS e
+WHERE key_rank = 1
+;""")
+staging_events_unique_insert = "INSERT INTO staging_events SELECT * FROM staging_events_unique;"
+staging_events_unique_drop = "DROP TABLE IF EXISTS staging_events_unique"
+staging_songs_duplicates_select = ("""
+SELECT COUNT(*) FROM (
+    SELECT 1 FROM staging_songs GROUP BY song_id HAVING COUNT(*) > 1
+) AS duplicates;
+""")
+staging_songs_unique_create = ("""
+CREATE TEMP TABLE staging_songs_unique AS
+SELECT
+    artist_id, artist_latitude, artist_location, artist_longitude, artist_name,
+    duration, num_songs, song_id, title, year
+FROM (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY song_id) AS key_rank
+    FROM staging_songs
+) AS s
+WHERE key_rank = 1
+;""")
+staging_songs_unique_insert = "INSERT INTO staging_songs SELECT * FROM staging_songs_unique;"
+staging_songs_unique_drop = "DROP TABLE IF EXISTS staging_songs_unique"
+
 # STAR TABLES - sql2sql
-songplay_table_insert = ("""
-INSERT INTO songplays (
-    start_time,
-    user_id,
-    level,
-    song_id,
-    artist_id,
-    session_id,
-    location,
-    user_agent
-)
-SELECT DISTINCT
+# surrogate key of a play, hashed from the natural key of its event:
+# the same event always gets the same id, whichever run or partition inserts it
+songplay_id_hash = ("""STRTOL(LEFT(MD5(
+        COALESCE(CAST({0}.sessionid AS VARCHAR), '') || '|' || COALESCE(CAST({0}.iteminsession AS VARCHAR), '') || '|' ||
+        COALESCE(CAST({0}.userid AS VARCHAR), '') || '|' || COALESCE(CAST({0}.ts AS VARCHAR), '')
+    ), 15), 16)""")
+# one song per (artist_name, title): several songs can share them, and an event matching all of them
+# would give several songplays with the same songplay_id, the hash of the event key
+staging_songs_matched = ("""(
+    SELECT song_id, artist_id, artist_name, title
+    FROM (
+        SELECT
+            song_id, artist_id, artist_name, title,
+            ROW_NUMBER() OVER (PARTITION BY artist_name, title ORDER BY song_id) AS song_rank
+        FROM staging_songs AS songs
+        WHERE
+            song_id IS NOT NULL AND
+            artist_id IS NOT NULL
+    ) AS ranked
+    WHERE song_rank = 1
+)""")
+songplay_table_select = ("""
+SELECT
+    """ + songplay_id_hash.format("e") + """ AS songplay_id,
     TIMESTAMP 'epoch' + (e.ts / 1000) * INTERVAL '1 second' AS start_time, 
     e.userid AS user_id, 
     e.level AS level, 
@@ -162,7 +238,7 @@ SELECT DISTINCT
     e.sessionid AS session_id, 
     e.location AS location, 
     e.useragent AS user_agent
-FROM staging_songs AS s
+FROM """ + staging_songs_matched + """ AS s
 JOIN staging_events AS e
 ON  e.artist = s.artist_name AND e.song = s.title
 WHERE   
@@ -171,12 +247,37 @@ WHERE
     e.userid IS NOT NULL AND
     e.level IS NOT NULL AND
     e.sessionid IS NOT NULL AND
-    e.useragent IS NOT NULL AND
-    s.song_id IS NOT NULL AND
-    s.artist_id IS NOT NULL 
-ORDER BY start_time
+    e.useragent IS NOT NULL
+""")
+# songplays of the staging tables not loaded yet, joined once per run: the same rows are inserted into songplays
+# (or into the month tables) and merged into the aggregate tables, that never join the staging tables again.
+# It is a regular table, so that the aggregates of a resumed run still find the rows inserted before the stop.
+songplays_delta_table_drop = "DROP TABLE IF EXISTS songplays_delta"
+songplays_delta_table_create = ("""
+CREATE TABLE songplays_delta AS""" + songplay_table_select + ";")
+# the songplays already loaded by a previous run are removed from the delta,
+# so a rerun over the same staging data inserts them once
+songplays_delta_loaded_delete = ("""
+DELETE FROM songplays_delta
+USING songplays AS p
+WHERE songplays_delta.songplay_id = p.songplay_id
 ;""")
-user_table_insert = """
+songplay_table_insert = ("""
+INSERT INTO songplays (
+    songplay_id,
+    start_time,
+    user_id,
+    level,
+    song_id,
+    artist_id,
+    session_id,
+    location,
+    user_agent
+)
+SELECT songplay_id, start_time, user_id, level, song_id, artist_id, session_id, location, user_agent
+FROM songplays_delta
+;""")
+user_table_insert = ("""
 INSERT INTO users (
     user_id,
     first_name,
@@ -184,18 +285,18 @@ INSERT INTO users (
     gender,
     level
 )
-SELECT 
-    DISTINCT (l.userid) AS user_id,
-    l.firstname AS first_name,
-    l.lastname AS last_name,
-    l.gender AS gender,
-    l.level AS level
-FROM staging_events AS l
+SELECT
+    h.user_id,
+    h.first_name,
+    h.last_name,
+    h.gender,
+    h.level
+FROM users_history AS h
 WHERE
-    l.userid IS NOT NULL AND l.userid >= 0 AND
-    l.level IS NOT NULL AND
-    l.page = 'NextSong'
-"""
+    h.is_current AND
+    NOT EXISTS (SELECT 1 FROM users AS u WHERE u.user_id = h.user_id)
+ORDER BY h.user_id
+;""")
 song_table_insert = ("""
 INSERT INTO songs (
     song_id,
@@ -216,7 +317,8 @@ WHERE
     s.title IS NOT NULL AND 
     s.artist_id IS NOT NULL AND
     s.year > 0 AND
-    s.duration > 0
+    s.duration > 0 AND
+    NOT EXISTS (SELECT 1 FROM songs AS t WHERE t.song_id = s.song_id)
 ORDER BY s.song_id
 """)
 artist_table_insert = ("""
@@ -236,7 +338,8 @@ SELECT
 FROM staging_songs AS s
 WHERE 
     s.artist_id IS NOT NULL AND
-    s.artist_name IS NOT NULL
+    s.artist_name IS NOT NULL AND
+    NOT EXISTS (SELECT 1 FROM artists AS t WHERE t.artist_id = s.artist_id)
 ORDER BY artist_id
 """)
 time_table_insert = ("""
@@ -263,8 +366,202 @@ FROM (
     FROM staging_events
     WHERE staging_events.ts > 0
 ) AS tmp
+WHERE NOT EXISTS (SELECT 1 FROM time AS t WHERE t.start_time = tmp.start_time)
 """)
 
+# USERS HISTORY - type 2 slowly changing dimension of the users.
+# Every change of (first_name, last_name, gender, level) seen in the staged events opens a new version.
+# Versions are compared by a hash of their attributes, so a run writes only the users that changed,
+# and users keeps the current version of every user.
+user_row_hash = ("""MD5(
+        COALESCE({0}, '') || '|' || COALESCE({1}, '') || '|' || COALESCE({2}, '') || '|' || COALESCE({3}, '')
+    )""")
+users_history_table_create = ("""
+CREATE TABLE IF NOT EXISTS users_history (
+    user_id 		INT 		NOT NULL,
+    first_name 		VARCHAR 	NULL,
+    last_name 		VARCHAR 	NULL,
+    gender 		VARCHAR 	NULL,
+    level 		VARCHAR 	NOT NULL,
+    row_hash 		CHAR(32) 	NOT NULL,
+    valid_from 		TIMESTAMP 	NOT NULL,
+    valid_to 		TIMESTAMP 	NULL,
+    is_current 		BOOLEAN 	NOT NULL
+)
+diststyle all
+SORTKEY (user_id, valid_from)
+;""")
+# versions of the staging window: the first event of each user and every event changing its attributes
+users_window_drop = "DROP TABLE IF EXISTS users_window"
+users_window_create = ("""
+CREATE TEMP TABLE users_window AS
+SELECT
+    c.user_id, c.first_name, c.last_name, c.gender, c.level, c.row_hash, c.valid_from,
+    ROW_NUMBER() OVER (PARTITION BY c.user_id ORDER BY c.valid_from) AS version_rank
+FROM (
+    SELECT
+        e.userid AS user_id,
+        e.firstname AS first_name,
+        e.lastname AS last_name,
+        e.gender AS gender,
+        e.level AS level,
+        """ + user_row_hash.format("e.firstname", "e.lastname", "e.gender", "e.level") + """ AS row_hash,
+        TIMESTAMP 'epoch' + (e.ts / 1000) * INTERVAL '1 second' AS valid_from,
+        LAG(""" + user_row_hash.format("e.firstname", "e.lastname", "e.gender", "e.level") + """)
+            OVER (PARTITION BY e.userid ORDER BY e.ts) AS previous_hash
+    FROM staging_events AS e
+    WHERE
+        e.userid IS NOT NULL AND e.userid >= 0 AND
+        e.level IS NOT NULL AND
+        e.ts IS NOT NULL AND
+        e.page = 'NextSong'
+) AS c
+WHERE c.previous_hash IS NULL OR c.previous_hash <> c.row_hash
+;""")
+# versions already recorded: replayed events, or a first version equal to the current one
+users_window_unchanged_delete = ("""
+DELETE FROM users_window
+USING users_history AS h
+WHERE
+    h.user_id = users_window.user_id AND h.is_current AND (
+        users_window.valid_from <= h.valid_from OR
+        (users_window.version_rank = 1 AND users_window.row_hash = h.row_hash)
+    )
+;""")
+users_history_close = ("""
+UPDATE users_history
+SET valid_to = w.valid_from, is_current = FALSE
+FROM (
+    SELECT user_id, MIN(valid_from) AS valid_from
+    FROM users_window
+    GROUP BY user_id
+) AS w
+WHERE users_history.user_id = w.user_id AND users_history.is_current
+;""")
+users_history_insert = ("""
+INSERT INTO users_history (
+    user_id,
+    first_name,
+    last_name,
+    gender,
+    level,
+    row_hash,
+    valid_from,
+    valid_to,
+    is_current
+)
+SELECT
+    v.user_id, v.first_name, v.last_name, v.gender, v.level, v.row_hash, v.valid_from, v.valid_to,
+    CASE WHEN v.valid_to IS NULL THEN TRUE ELSE FALSE END AS is_current
+FROM (
+    SELECT
+        w.user_id, w.first_name, w.last_name, w.gender, w.level, w.row_hash, w.valid_from,
+        LEAD(w.valid_from) OVER (PARTITION BY w.user_id ORDER BY w.valid_from) AS valid_to
+    FROM users_window AS w
+) AS v
+;""")
+# users whose current version changed, inserted again by user_table_insert
+user_changed_delete = ("""
+DELETE FROM users
+USING users_history AS h
+WHERE
+    users.user_id = h.user_id AND h.is_current AND
+    h.row_hash <> """ + user_row_hash.format("users.first_name", "users.last_name", "users.gender", "users.level") + """
+;""")
+
+# LATE EVENTS - NextSong events waiting for their song metadata
+pending_events_table_drop = "DROP TABLE IF EXISTS pending_events"
+pending_events_table_create = ("""
+CREATE TABLE IF NOT EXISTS pending_events (
+    artist 		VARCHAR,
+    song 		VARCHAR,
+    itemInSession 	INT,
+    sessionId 		INT,
+    ts 			BIGINT,
+    userId 		INT,
+    level 		VARCHAR,
+    location 		VARCHAR,
+    userAgent 		VARCHAR,
+    first_seen 		TIMESTAMP 	NOT NULL
+)
+diststyle key
+DISTKEY (artist)
+SORTKEY (first_seen)
+;""")
+late_songplays_create = ("""
+CREATE TEMP TABLE late_songplays AS
+SELECT DISTINCT
+    """ + songplay_id_hash.format("p") + """ AS songplay_id,
+    TIMESTAMP 'epoch' + (p.ts / 1000) * INTERVAL '1 second' AS start_time,
+    p.userid AS user_id,
+    p.level AS level,
+    s.song_id AS song_id,
+    s.artist_id AS artist_id,
+    p.sessionid AS session_id,
+    p.location AS location,
+    p.useragent AS user_agent
+FROM """ + staging_songs_matched + """ AS s
+JOIN pending_events AS p
+ON  p.artist = s.artist_name AND p.song = s.title
+;""")
+late_songplays_drop = "DROP TABLE IF EXISTS late_songplays"
+# the late songplays already in songplays are removed, so that only the inserted ones are merged into the aggregates
+late_songplays_existing_delete = ("""
+DELETE FROM late_songplays
+USING songplays AS sp
+WHERE late_songplays.songplay_id = sp.songplay_id
+;""")
+late_songplays_insert = ("""
+INSERT INTO songplays (
+    songplay_id,
+    start_time,
+    user_id,
+    level,
+    song_id,
+    artist_id,
+    session_id,
+    location,
+    user_agent
+)
+SELECT songplay_id, start_time, user_id, level, song_id, artist_id, session_id, location, user_agent
+FROM late_songplays
+;""")
+pending_events_matched_delete = ("""
+DELETE FROM pending_events
+USING staging_songs AS s
+WHERE
+    pending_events.artist = s.artist_name AND
+    pending_events.song = s.title AND
+    s.song_id IS NOT NULL AND
+    s.artist_id IS NOT NULL
+;""")
+pending_events_expired_delete = ("""
+DELETE FROM pending_events
+WHERE first_seen < DATEADD(day, -{}, GETDATE())
+;""")
+pending_events_insert = ("""
+INSERT INTO pending_events
+SELECT
+    e.artist, e.song, e.itemInSession, e.sessionId, e.ts, e.userId, e.level, e.location, e.userAgent, GETDATE()
+FROM staging_events AS e
+WHERE
+    e.page = 'NextSong' AND
+    e.ts IS NOT NULL AND
+    e.userid IS NOT NULL AND
+    e.level IS NOT NULL AND
+    e.sessionid IS NOT NULL AND
+    e.useragent IS NOT NULL AND
+    NOT EXISTS (
+        SELECT 1 FROM staging_songs AS s
+        WHERE e.artist = s.artist_name AND e.song = s.title AND
+            s.song_id IS NOT NULL AND s.artist_id IS NOT NULL
+    ) AND
+    NOT EXISTS (
+        SELECT 1 FROM pending_events AS p
+        WHERE p.sessionId = e.sessionId AND p.itemInSession = e.itemInSession AND p.ts = e.ts
+    )
+;""")
+
 # QUERY LISTS
 create_table_queries = [
     staging_events_table_create,
@@ -273,7 +570,9 @@ create_table_queries = [
     user_table_create,
     song_table_create,
     artist_table_create,
-    time_table_create
+    time_table_create,
+    users_history_table_create,
+    pending_events_table_create
 ]
 drop_table_queries = [
     staging_events_table_drop,
@@ -282,16 +581,90 @@ drop_table_queries = [
     user_table_drop,
     song_table_drop,
     artist_table_drop,
-    time_table_drop
+    time_table_drop,
+    users_history_table_drop,
+    pending_events_table_drop
+]
+staging_drop_table_queries = [
+    staging_events_table_drop,
+    staging_songs_table_drop
+]
+staging_create_table_queries = [
+    staging_events_table_create,
+    staging_songs_table_create
+]
+star_create_table_queries = [
+    songplay_table_create,
+    user_table_create,
+    song_table_create,
+    artist_table_create,
+    time_table_create
+]
+staging_events_dedupe_queries = [
+    staging_events_unique_drop,
+    staging_events_unique_create,
+    staging_events_table_delete,
+    staging_events_unique_insert,
+    staging_events_unique_drop
 ]
+staging_songs_dedupe_queries = [
+    staging_songs_unique_drop,
+    staging_songs_unique_create,
+    staging_songs_table_delete,
+    staging_songs_unique_insert,
+    staging_songs_unique_drop
+]
+# users_history is kept by the staging only and blue/green runs: it is the only record of the past versions,
+# reset only when create_tables.py recreates every table
+users_history_queries = [
+    users_history_table_create,
+    users_window_drop,
+    users_window_create,
+    users_window_unchanged_delete,
+    users_history_close,
+    users_history_insert,
+    users_window_drop
+]
+users_scd_queries = users_history_queries + [user_changed_delete]
 copy_table_queries = [
     staging_events_copy,
     staging_songs_copy
 ]
-insert_table_queries = [
+songplays_delta_queries = [
+    songplays_delta_table_drop,
+    songplays_delta_table_create,
+    songplays_delta_loaded_delete
+]
+insert_table_queries = songplays_delta_queries + [
     songplay_table_insert,
     user_table_insert,
     song_table_insert,
     artist_table_insert,
     time_table_insert
 ]
+
+# statements of every table, looked up by name: pairing the lists by position
+# would silently run the statements of a table on another one if a list were reordered
+table_queries = {
+    "staging_events": {
+        "create": staging_events_table_create,
+        "delete": staging_events_table_delete,
+        "copy": staging_events_copy,
+        "copy_template": staging_events_copy_template,
+        "duplicates": staging_events_duplicates_select,
+        "dedupe": staging_events_dedupe_queries
+    },
+    "staging_songs": {
+        "create": staging_songs_table_create,
+        "delete": staging_songs_table_delete,
+        "copy": staging_songs_copy,
+        "copy_template": staging_songs_copy_template,
+        "duplicates": staging_songs_duplicates_select,
+        "dedupe": staging_songs_dedupe_queries
+    },
+    "songplays": {"create": songplay_table_create, "delta": songplays_delta_queries, "insert": songplay_table_insert},
+    "users": {"create": user_table_create, "insert": user_table_insert},
+    "songs": {"create": song_table_create, "insert": song_table_insert},
+    "artists": {"create": artist_table_create, "insert": artist_table_insert},
+    "time": {"create": time_table_create, "insert": time_table_insert}
+}
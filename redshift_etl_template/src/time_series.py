@@ -0,0 +1,212 @@
+import re
+import datetime
+
+from redshift_etl_template.src.sql_queries import songplay_table_create
+from redshift_etl_template.src.blue_green import get_existing_tables
+from redshift_etl_template.src.profiling import is_redshift
+from redshift_etl_template.src.transactions import TransactionRunner
+from redshift_etl_template.src.cache import table_versions_queries
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# songplays split in one table per month of start_time, read through a view with the name of the table.
+# Old months are removed by dropping their table, and a load unsorts only the tables of its months.
+month_table_pattern = re.compile(r"^songplays_(\d{4})_(\d{2})$")
+songplay_schema = re.findall(r"^\s*(\w+)\s+(BIGINT|TIMESTAMP|INT|VARCHAR)", songplay_table_create, flags=re.MULTILINE)
+songplay_columns = [column for column, _ in songplay_schema]
+
+songplays_view_select = "SELECT COUNT(*) FROM pg_views WHERE schemaname = current_schema() AND viewname = 'songplays';"
+songplays_view_drop = "DROP VIEW IF EXISTS songplays;"
+songplays_delta_months = ("""
+SELECT DISTINCT EXTRACT(year FROM start_time) AS year, EXTRACT(month FROM start_time) AS month
+FROM songplays_delta
+ORDER BY year, month;
+""")
+# the songplays already in the table of the month are skipped, so a rerun does not insert them twice
+month_table_insert = ("""
+INSERT INTO {0} ({1})
+SELECT {1}
+FROM songplays_delta AS d
+WHERE
+    start_time >= '{2}' AND start_time < '{3}' AND
+    NOT EXISTS (SELECT 1 FROM {0} AS p WHERE p.songplay_id = d.songplay_id);
+""")
+# postgres prunes the months of a union all only through check constraints,
+# redshift skips their blocks with the zone maps of the start_time sort key
+month_table_check = "ALTER TABLE {0} ADD CONSTRAINT {0}_start_time CHECK (start_time >= '{1}' AND start_time < '{2}');"
+
+
+def get_month_table(year, month):
+    return "songplays_{}_{:02d}".format(year, month)
+
+
+def get_month_bounds(year, month):
+    """
+    Returns:
+        tuple of datetime.date, first day of the month and of the next one
+    """
+    start = datetime.date(year, month, 1)
+    end = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def build_month_table_create(year, month):
+    """Build the create statement of the songplays of a month, with the layout of songplays
+    Args:
+        year(int): year of start_time
+        month(int): month of start_time
+
+    Returns:
+        str
+    """
+    return songplay_table_create.replace("CREATE TABLE IF NOT EXISTS songplays ",
+                                         "CREATE TABLE IF NOT EXISTS {} ".format(get_month_table(year, month)))
+
+
+def build_view_create(schema, months):
+    """Build the late binding view reading the tables of the months as songplays.
+    The tables are not bound to the view, so they can be dropped or added without recreating what reads the view.
+    Args:
+        schema(str): schema of the month tables, required by a view without schema binding
+        months(list): (year, month) tuples of the month tables
+
+    Returns:
+        str
+    """
+    if months:
+        select = "\nUNION ALL\n".join("SELECT {} FROM {}.{}".format(
+            ", ".join(songplay_columns), schema, get_month_table(year, month)) for year, month in months)
+    else:
+        select = "SELECT {} WHERE 1 = 0".format(", ".join(
+            "CAST(NULL AS {}) AS {}".format(sql_type, column) for column, sql_type in songplay_schema))
+    return "CREATE VIEW songplays AS\n{}\nWITH NO SCHEMA BINDING;".format(select)
+
+
+def is_sliced(cur):
+    """Check if songplays is the view of the month tables
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+
+    Returns:
+        bool
+    """
+    cur.execute(songplays_view_select)
+    return cur.fetchone()[0] > 0
+
+
+def get_months(cur):
+    """Get the months having a table, oldest first
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+
+    Returns:
+        list of (year, month) tuples
+    """
+    months = [month_table_pattern.match(table) for table in get_existing_tables(cur)]
+    return sorted((int(match.group(1)), int(match.group(2))) for match in months if match is not None)
+
+
+def get_current_schema(cur):
+    cur.execute("SELECT current_schema();")
+    return cur.fetchone()[0]
+
+
+def drop_statements(cur):
+    """Build the statements dropping the view and the month tables, if any
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+
+    Returns:
+        list
+    """
+    statements = [songplays_view_drop] if is_sliced(cur) else []
+    return statements + ["DROP TABLE IF EXISTS {};".format(get_month_table(year, month))
+                         for year, month in get_months(cur)]
+
+
+def load_months(cur, conn, runner=None):
+    """Insert the songplays of the staging tables, joined once into songplays_delta, into the tables of their months,
+    creating the tables of the new months and adding them to the view
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        runner(TransactionRunner): runner grouping the statements into transactions
+
+    Returns:
+        list of (year, month) tuples, months written
+    """
+    cur.execute(songplays_delta_months)
+    months = [(int(year), int(month)) for year, month in cur.fetchall()]
+    existing_months = get_months(cur)
+    new_months = [month for month in months if month not in existing_months]
+    redshift = is_redshift(cur)
+    statements = []
+    for year, month in new_months:
+        statements.append(build_month_table_create(year, month))
+        if not redshift:
+            statements.append(month_table_check.format(get_month_table(year, month), *get_month_bounds(year, month)))
+    for year, month in months:
+        statements.append(month_table_insert.format(
+            get_month_table(year, month), ", ".join(songplay_columns), *get_month_bounds(year, month)))
+    if new_months:
+        statements += [songplays_view_drop,
+                       build_view_create(get_current_schema(cur), sorted(existing_months + new_months))]
+    logger.info("Inserting songplays into {} monthly tables, {} of them new..".format(len(months), len(new_months)))
+    runner = runner or TransactionRunner(cur, conn)
+    runner.execute_group(statements + table_versions_queries(["songplays"]))
+    return months
+
+
+def drop_old_months(cur, conn, retention_months):
+    """Drop the tables of the months older than the retention, counted back from the latest month.
+    The view is recreated without them in the same transaction.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        retention_months(int): number of months kept, the latest included
+
+    Returns:
+        list of (year, month) tuples, dropped months
+    """
+    months = get_months(cur)
+    if not months:
+        return []
+    year, month = months[-1]
+    index = year * 12 + month - 1 - (retention_months - 1)
+    first_kept = (index // 12, index % 12 + 1)
+    dropped = [m for m in months if m < first_kept]
+    if not dropped:
+        return []
+    statements = [songplays_view_drop,
+                  build_view_create(get_current_schema(cur), [m for m in months if m >= first_kept])]
+    statements += ["DROP TABLE {};".format(get_month_table(*m)) for m in dropped]
+    statements += table_versions_queries(["songplays"])
+    try:
+        for statement in statements:
+            cur.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("Dropped the songplays of {} months older than {}-{:02d}".format(len(dropped), *first_kept))
+    return dropped
+
+
+def vacuum_month(cur, conn, year, month):
+    """Vacuum the table of a month, the only one unsorted by a load of recent events.
+    Vacuum cannot run inside a transaction, so it runs in autocommit.
+    Args:
+        cur(psycopg2.cursor): psycopg2 cursor
+        conn(psycopg2.connection): psycopg2 connection
+        year(int): year of the month
+        month(int): month
+    """
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        cur.execute("VACUUM {};".format(get_month_table(year, month)))
+    finally:
+        conn.autocommit = autocommit
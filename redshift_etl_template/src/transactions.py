@@ -0,0 +1,117 @@
+import time
+
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# commit after every statement, after every group of statements or once per run
+COMMIT_POLICIES = ["statement", "group", "run"]
+
+
+def run_in_transaction(conn, execute):
+    """Call a function executing statements without committing them,
+    and commit them together, or roll them back if it fails
+    Args:
+        conn(psycopg2.connection): psycopg2 connection
+        execute(function): function executing the statements
+
+    Returns:
+        the result of the function
+    """
+    try:
+        result = execute()
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+
+
+class TransactionRunner:
+    """Execute statements grouping them into transactions according to a commit policy.
+    Every commit on redshift is serialized on the whole cluster,
+    so grouping related statements reduces the latency of a run.
+    """
+
+    def __init__(self, cur, conn, policy="statement"):
+        if policy not in COMMIT_POLICIES:
+            raise ValueError("unknown commit policy {}, use one of {}".format(policy, COMMIT_POLICIES))
+        self.cur = cur
+        self.conn = conn
+        self.policy = policy
+        self.n_statements = 0
+        self.n_commits = 0
+        self.commit_time = 0.0
+
+    def commit(self):
+        start = time.perf_counter()
+        self.conn.commit()
+        self.commit_time += time.perf_counter() - start
+        self.n_commits += 1
+
+    def execute_group(self, queries):
+        """Execute a group of related statements.
+        On failure the open transaction is rolled back and the error is raised again.
+        Args:
+            queries(list): statements to be executed
+        """
+        try:
+            for query in queries:
+                self.cur.execute(query)
+                self.n_statements += 1
+                if self.policy == "statement":
+                    self.commit()
+            if self.policy == "group":
+                self.commit()
+        except Exception:
+            logger.error("Statement failed, rolling back the open transaction")
+            self.conn.rollback()
+            raise
+
+    def execute_atomic(self, queries):
+        """Execute statements that must be applied together, in a single transaction whatever the policy:
+        they are committed at the end of the group, or with the rest of the run under the run policy.
+        On failure the open transaction is rolled back and the error is raised again.
+        Args:
+            queries(list): statements to be executed
+        """
+        try:
+            for query in queries:
+                self.cur.execute(query)
+                self.n_statements += 1
+            if self.policy != "run":
+                self.commit()
+        except Exception:
+            logger.error("Statement failed, rolling back the open transaction")
+            self.conn.rollback()
+            raise
+
+    def finish(self):
+        """Commit the statements left open by the run policy and log the commit statistics
+
+        Returns:
+            dict
+        """
+        if self.policy == "run":
+            self.commit()
+        return self.report()
+
+    def report(self):
+        """Estimate the time saved by the commits that have not been issued,
+        using the average latency of the observed ones
+
+        Returns:
+            dict
+        """
+        mean_commit_time = self.commit_time / self.n_commits if self.n_commits else 0.0
+        stats = {
+            "policy": self.policy,
+            "statements": self.n_statements,
+            "commits": self.n_commits,
+            "commit_time": self.commit_time,
+            "estimated_time_saved": mean_commit_time * max(self.n_statements - self.n_commits, 0)
+        }
+        logger.info("{policy} policy: {commits} commits for {statements} statements, "
+                    "{commit_time:.2f}s spent committing, ~{estimated_time_saved:.2f}s saved".format(**stats))
+        return stats
@@ -1,46 +1,72 @@
+import numpy as np
 import pandas as pd
 import psycopg2
 
+from redshift_etl_template.constants import logging
 
-def get_log_errors(cur):
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# postgres type oids of the result columns -> pandas dtypes
+pg_dtypes = {
+    16: "boolean",
+    20: "Int64",
+    21: "Int16",
+    23: "Int32",
+    700: "Float32",
+    701: "Float64",
+    25: "string",
+    1042: "string",
+    1043: "string",
+    1114: "datetime64[ns]",
+}
+# compact storage: the smallest nullable int holding the values, arrow strings,
+# and categories for the string columns with few distinct values (level, gender, weekday..)
+compact_int_dtypes = ["Int8", "Int16", "Int32", "Int64"]
+compact_string_dtype = "string[pyarrow]"
+category_max_ratio = 0.5
+
+
+def get_log_errors(cur, compact=True):
     """Get the error log from redshift database
     Args:
         cur(psycopg2.cursor): psycopg2 cursor
+        compact(bool): if True, store the columns with compact dtypes, else keep the values of the records
 
     Returns:
         pd.DataFrame
     """
     # get errors
     cur.execute("SELECT * FROM stl_load_errors ORDER BY starttime DESC LIMIT 10;")
-    res = cur.fetchall()
-    # build dataframe using query records
-    columns = [desc[0] for desc in cur.description]
-    lines = [list(line) for line in res]
-    df = pd.DataFrame(lines, columns=columns)
+    df = _get_result_dataframe(cur.fetchall(), cur.description, compact)
+    report_memory_usage(df, "stl_load_errors")
     # print only the error column
     print(df["err_reason"].values)
     return df
 
 
-def get_top_elements_from_table(cur, table, n_elem=5, viz=False):
+def get_top_elements_from_table(cur, table, n_elem=5, viz=False, cache=None, compact=True):
     """Get first 5 elements from a table of a database
     Args:
         cur(cursor): cursor of psycopg2
         table(str): name of the table to fetch
         n_elem(int): number of elements to be queried
         viz(bool): if True, visualise the extracted elements
+        cache(QueryCache): if given, reuse the results cached since the last write on the table
+        compact(bool): if True, store the columns with compact dtypes, else keep the values of the records
 
     Returns:
         pd.DataFrame
     """
-    # get query result
     limit = "" if n_elem == -1 else "LIMIT {}".format(n_elem)
-    cur.execute("SELECT * FROM {} {};".format(table, limit))
-    res = cur.fetchall()
-
-    # build dataframe using query records
-    columns = [desc[0] for desc in cur.description]
-    df = pd.DataFrame(res, columns=columns)
+    query = "SELECT * FROM {} {};".format(table, limit)
+    if cache is not None:
+        df = cache.get_dataframe(cur, query)
+    else:
+        # get query result
+        cur.execute(query)
+        df = _get_result_dataframe(cur.fetchall(), cur.description, compact)
+        report_memory_usage(df, table)
 
     if viz:
         with pd.option_context('display.max_columns', None):
@@ -49,18 +75,98 @@ def get_top_elements_from_table(cur, table, n_elem=5, viz=False):
     return df
 
 
-def get_res_as_dataframe(cur, viz=False):
+def get_res_as_dataframe(cur, viz=False, compact=True):
     """Get the result of a query as a pandas DataFrame
     Args:
         cur(psycopg2.cursor): psycopg2 cursor
         viz(bool): if True, print the extracted frame
+        compact(bool): if True, store the columns with compact dtypes, else keep the values of the records
 
     Returns:
         pd.DataFrame
     """
-    res = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    df = pd.DataFrame(res, columns=columns)
+    df = _get_result_dataframe(cur.fetchall(), cur.description, compact)
+    report_memory_usage(df, "result")
     if viz:
         print(df)
     return df
+
+
+def get_compact_array(values, type_code):
+    """Build a column with the smallest dtype able to hold its values
+    Args:
+        values(tuple): values of the column
+        type_code(int): postgres type oid of the column
+
+    Returns:
+        pandas array
+    """
+    dtype = pg_dtypes.get(type_code)
+    if dtype in compact_int_dtypes:
+        array = pd.array(values, dtype="Int64")
+        if array.isna().all():
+            return array.astype(compact_int_dtypes[0])
+        low, high = array.min(), array.max()
+        for int_dtype in compact_int_dtypes:
+            info = np.iinfo(int_dtype.lower())
+            if info.min <= low and high <= info.max:
+                return array.astype(int_dtype)
+    if dtype == "string":
+        if len(values) > 1 and len(set(values)) <= category_max_ratio * len(values):
+            return pd.Categorical(values)
+        return pd.array(values, dtype=compact_string_dtype)
+    if dtype is None:
+        return _infer_array(values)
+    return pd.array(values, dtype=dtype)
+
+
+def _infer_array(values):
+    """Column of a type without dtype mapping, inferred as when building the frame from the records"""
+    return pd.Series(list(values), dtype=None if values else object).array
+
+
+def _get_result_dataframe(rows, description, compact=True):
+    """Frame of a result for the helpers: compact, or with the values of the records as they are"""
+    if compact:
+        return get_typed_dataframe(rows, description, compact=True)
+    return pd.DataFrame(rows, columns=[desc[0] for desc in description])
+
+
+def get_typed_dataframe(rows, description, compact=False):
+    """Build a DataFrame from query records, typing its columns from the types of the result.
+    The columns are built one at a time from the records, without copying them into a frame of objects.
+    Args:
+        rows(list): records returned by the cursor
+        description(tuple): description of the cursor
+        compact(bool): if True, downcast the ints, store the strings in arrow
+            and the strings with few distinct values as categories
+
+    Returns:
+        pd.DataFrame
+    """
+    columns = list(zip(*rows)) if rows else [()] * len(description)
+    arrays = {}
+    for i, (desc, values) in enumerate(zip(description, columns)):
+        if compact:
+            arrays[i] = get_compact_array(values, desc[1])
+        elif desc[1] in pg_dtypes:
+            arrays[i] = pd.array(values, dtype=pg_dtypes[desc[1]])
+        else:
+            arrays[i] = _infer_array(values)
+    df = pd.DataFrame(arrays, index=pd.RangeIndex(len(rows)))
+    df.columns = [desc[0] for desc in description]
+    return df
+
+
+def report_memory_usage(df, name):
+    """Log the memory held by a DataFrame
+    Args:
+        df(pd.DataFrame): frame of a result
+        name(str): name of the result in the log
+
+    Returns:
+        int, bytes
+    """
+    n_bytes = int(df.memory_usage(index=False, deep=True).sum())
+    logger.info("{}: {} rows, {} columns, {:.1f} KiB".format(name, len(df), len(df.columns), n_bytes / 1024))
+    return n_bytes
@@ -0,0 +1,258 @@
+import os
+import re
+import json
+from multiprocessing import Pool
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import json as pa_json
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# redshift VARCHAR without length holds up to 256 bytes
+DEFAULT_VARCHAR_LENGTH = 256
+MAX_REPORTED_ERRORS = 20
+
+arrow_types = {
+    "INT": pa.int32(),
+    "BIGINT": pa.int64(),
+    "FLOAT": pa.float64(),
+    "VARCHAR": pa.string()
+}
+int_ranges = {
+    "INT": (-2 ** 31, 2 ** 31 - 1),
+    "BIGINT": (-2 ** 63, 2 ** 63 - 1)
+}
+
+
+def parse_table_schema(create_query):
+    """Get columns and types from a create statement
+    Args:
+        create_query(str): create statement of a staging table
+
+    Returns:
+        list of (column, type, length) tuples
+    """
+    body = create_query[create_query.index("(") + 1:create_query.rindex(")")]
+    schema = []
+    for match in re.finditer(r"^\s*(\w+)\s+(INT|BIGINT|FLOAT|VARCHAR)(?:\((\d+)\))?", body, flags=re.MULTILINE):
+        column, sql_type, length = match.groups()
+        schema.append((column, sql_type, int(length) if length else DEFAULT_VARCHAR_LENGTH))
+    return schema
+
+
+def parse_jsonpaths(jsonpaths):
+    """Get the keys selected by a jsonpaths file, in column order
+    Args:
+        jsonpaths(dict): content of the jsonpaths file
+
+    Returns:
+        list
+    """
+    keys = []
+    for path in jsonpaths["jsonpaths"]:
+        match = re.fullmatch(r"\$(?:\['(.+)'\]|\.(\w+))", path)
+        if match is None:
+            raise ValueError("unsupported jsonpath {}".format(path))
+        keys.append(match.group(1) or match.group(2))
+    return keys
+
+
+def check_value(value, sql_type, length):
+    """Check if a json value can be loaded into a column
+    Args:
+        value: parsed json value
+        sql_type(str): type of the column
+        length(int): maximum bytes of a VARCHAR column
+
+    Returns:
+        str, reason of the failure or None
+    """
+    if value is None:
+        return None
+    if sql_type != "VARCHAR" and isinstance(value, str):
+        # numbers in quotes are converted by COPY, empty strings become nulls
+        if value == "":
+            return None
+        try:
+            value = float(value) if sql_type == "FLOAT" else int(value)
+        except ValueError:
+            return "not a number"
+    if sql_type in int_ranges:
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or \
+                (isinstance(value, float) and not value.is_integer()):
+            return "not an integer"
+        low, high = int_ranges[sql_type]
+        if not low <= value <= high:
+            return "out of {} range".format(sql_type)
+    elif sql_type == "FLOAT":
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return "not a number"
+    elif sql_type == "VARCHAR":
+        if not isinstance(value, str):
+            return "not a string"
+        if len(value.encode("utf-8")) > length:
+            return "longer than {} bytes".format(length)
+    return None
+
+
+def read_records(path):
+    """Read the json records of a file, either one object per line or a single object
+    Args:
+        path(str): path of the json file
+
+    Returns:
+        list of (line number, record or None if malformed) tuples
+    """
+    with open(path, "rb") as json_file:
+        content = json_file.read()
+    try:
+        return [(1, json_loads(content))]
+    except ValueError:
+        lines = content.splitlines()
+    records = []
+    for i, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            records.append((i, json_loads(line)))
+        except ValueError:
+            records.append((i, None))
+    return records
+
+
+def read_vectorized(path, schema, keys=None):
+    """Parse a file of json records straight into typed arrow columns.
+    As COPY does, numbers in quotes are accepted for numeric columns and empty strings are loaded as nulls.
+    Raise pa.ArrowInvalid if a record is malformed or a field does not fit its column type.
+    Args:
+        path(str): path of the json file
+        schema(list): (column, type, length) tuples of the staging table
+        keys(list): json keys of the columns, in order; lowercase column names if None
+
+    Returns:
+        pa.Table
+    """
+    lookups = keys if keys is not None else [column.lower() for column, _, _ in schema]
+    raw = pa_json.read_json(path)
+    if keys is None:
+        raw = raw.rename_columns([name.lower() for name in raw.column_names])
+    arrays = {}
+    for key, (column, sql_type, length) in zip(lookups, schema):
+        if key not in raw.column_names:
+            arrays[column] = pa.nulls(raw.num_rows, type=arrow_types[sql_type])
+            continue
+        values = raw[key]
+        if sql_type == "VARCHAR":
+            if not (pa.types.is_string(values.type) or pa.types.is_null(values.type)):
+                raise pa.ArrowInvalid("{} is not a string".format(column))
+            values = values.cast(pa.string())
+            if pc.any(pc.greater(pc.binary_length(values), length)).as_py():
+                raise pa.ArrowInvalid("{} longer than {} bytes".format(column, length))
+        else:
+            if pa.types.is_string(values.type):
+                values = pc.if_else(pc.equal(values, ""), pa.scalar(None, pa.string()), values)
+            elif not (pa.types.is_integer(values.type) or pa.types.is_floating(values.type)
+                      or pa.types.is_null(values.type)):
+                raise pa.ArrowInvalid("{} is not a number".format(column))
+            values = values.cast(arrow_types[sql_type])
+        arrays[column] = values
+    return pa.table(arrays)
+
+
+def validate_file(path, schema, keys=None):
+    """Apply the jsonpaths mapping to a file, type check every field against the staging table
+    and convert the columns to arrow arrays.
+    Files are parsed in a vectorized way; only the files failing it are checked record by record
+    to report the bad rows.
+    Args:
+        path(str): path of the json file
+        schema(list): (column, type, length) tuples of the staging table
+        keys(list): json keys of the columns, in order; matched by column name if None (json 'auto')
+
+    Returns:
+        dict
+    """
+    try:
+        table = read_vectorized(path, schema, keys)
+        return {"file": path, "n_rows": table.num_rows, "n_bad_rows": 0, "errors": [], "table": table}
+    except pa.ArrowInvalid:
+        pass
+    records = read_records(path)
+    if keys is None:
+        lookups = [column.lower() for column, _, _ in schema]
+    else:
+        lookups = keys
+    errors = []
+    bad_lines = set()
+    columns = [[] for _ in schema]
+    for line, record in records:
+        if not isinstance(record, dict):
+            errors.append({"line": line, "column": None, "value": None, "reason": "malformed json"})
+            bad_lines.add(line)
+            continue
+        if keys is None:
+            record = {key.lower(): value for key, value in record.items()}
+        for values, (column, sql_type, length), key in zip(columns, schema, lookups):
+            value = record.get(key)
+            reason = check_value(value, sql_type, length)
+            if reason is not None:
+                errors.append({"line": line, "column": column, "value": value, "reason": reason})
+                bad_lines.add(line)
+                value = None
+            elif value == "" and sql_type != "VARCHAR":
+                value = None
+            elif value is not None and sql_type in int_ranges:
+                value = int(value)
+            elif value is not None and sql_type == "FLOAT":
+                value = float(value)
+            values.append(value)
+    arrays = {column: pa.array(values, type=arrow_types[sql_type])
+              for values, (column, sql_type, _) in zip(columns, schema)}
+    return {
+        "file": path,
+        "n_rows": len(records),
+        "n_bad_rows": len(bad_lines),
+        "errors": errors[:MAX_REPORTED_ERRORS],
+        "table": pa.table(arrays) if schema else None
+    }
+
+
+def _validate_file_summary(task):
+    """Validate a file in a worker process, returning only the report without the arrow table"""
+    path, schema, keys = task
+    report = validate_file(path, schema, keys)
+    report["nbytes"] = report.pop("table").nbytes
+    return report
+
+
+def list_json_files(directory):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                  for name in names if name.endswith(".json"))
+
+
+def validate_files(paths, schema, keys=None, processes=None):
+    """Validate json files in parallel across processes
+    Args:
+        paths(list): paths of the json files
+        schema(list): (column, type, length) tuples of the staging table
+        keys(list): json keys of the columns, matched by column name if None
+        processes(int): number of worker processes, one per core by default
+
+    Returns:
+        list of dict
+    """
+    with Pool(processes) as pool:
+        return pool.map(_validate_file_summary, [(path, schema, keys) for path in paths], chunksize=16)
+
+
+def load_jsonpaths(path):
+    with open(path) as jsonpaths_file:
+        return parse_jsonpaths(json.load(jsonpaths_file))
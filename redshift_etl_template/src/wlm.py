@@ -0,0 +1,170 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from redshift_etl_template.constants import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# first service class of the user defined queues in manual wlm
+USER_SERVICE_CLASS = 6
+# statements run at once when the queue has no fixed slots, as under auto wlm,
+# the concurrency of the default manual queue
+AUTO_WLM_SLOTS = 5
+
+wlm_slots_query = """
+SELECT num_query_tasks
+FROM stv_wlm_service_class_config
+WHERE service_class >= {}
+ORDER BY service_class
+LIMIT 1;
+""".format(USER_SERVICE_CLASS)
+wlm_queue_wait_query = """
+SELECT AVG(total_queue_time) / 1000000.0
+FROM (
+    SELECT total_queue_time
+    FROM stl_wlm_query
+    WHERE service_class >= {}
+    ORDER BY queue_start_time DESC
+    LIMIT {{}}
+) AS recent;
+""".format(USER_SERVICE_CLASS)
+
+
+def get_queue_capacity(slots, max_workers=None):
+    """Get the number of statements that can run at once in a wlm queue.
+    Auto wlm reports -1 slots, the queue is then sized on max_workers or on AUTO_WLM_SLOTS
+    Args:
+        slots(int): slots of the queue, less than 1 if they are not fixed
+        max_workers(int): maximum number of statements running at once, unbounded if None
+
+    Returns:
+        int
+    """
+    if slots is None or slots < 1:
+        return max_workers or AUTO_WLM_SLOTS
+    return slots if max_workers is None else min(slots, max_workers)
+
+
+class WlmCatalog:
+    """Read the wlm configuration and the recent queue waits from the redshift system tables"""
+    sets_slot_count = True
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def get_queue_slots(self):
+        self.cur.execute(wlm_slots_query)
+        return self.cur.fetchone()[0]
+
+    def get_recent_queue_wait(self, n_queries=10):
+        self.cur.execute(wlm_queue_wait_query.format(n_queries))
+        wait = self.cur.fetchone()[0]
+        return float(wait) if wait is not None else 0.0
+
+
+class FakeWlmCatalog:
+    """Stand-in of the wlm catalog for local databases and tests.
+    Queue waits are returned in order, the last one is repeated once they are over.
+    """
+    sets_slot_count = False
+
+    def __init__(self, slots=5, queue_waits=(0.0,)):
+        self.slots = slots
+        self.queue_waits = list(queue_waits)
+
+    def get_queue_slots(self):
+        return self.slots
+
+    def get_recent_queue_wait(self, n_queries=10):
+        if len(self.queue_waits) > 1:
+            return self.queue_waits.pop(0)
+        return self.queue_waits[0]
+
+
+class WlmScheduler:
+    """Run independent statements in parallel without exceeding the slots of the wlm queue.
+    Memory heavy statements take several slots, so that they get more working memory,
+    and the slots in use are reduced while the observed queue waits stay high.
+    """
+
+    def __init__(self, catalog, heavy_slots=2, max_queue_wait=1.0, max_workers=None):
+        self.catalog = catalog
+        self.slots = catalog.get_queue_slots()
+        self.auto = self.slots is None or self.slots < 1
+        self.max_capacity = get_queue_capacity(self.slots, max_workers)
+        self.capacity = self.max_capacity
+        self.heavy_slots = min(heavy_slots, self.capacity)
+        self.max_queue_wait = max_queue_wait
+        self.slots_in_use = 0
+        self.condition = threading.Condition()
+        self.catalog_lock = threading.Lock()
+        if self.auto:
+            logger.info("Auto wlm queue without fixed slots, running up to {} statements at once".format(
+                self.capacity))
+        else:
+            logger.info("Wlm queue with {} slots, running up to {} statements at once".format(
+                self.slots, self.capacity))
+
+    def get_slot_count(self, heavy):
+        return self.heavy_slots if heavy else 1
+
+    def adapt_capacity(self):
+        """Shrink the slots in use when queries queue, grow them back when they do not
+
+        Returns:
+            int
+        """
+        with self.catalog_lock:
+            wait = self.catalog.get_recent_queue_wait()
+        with self.condition:
+            if wait > self.max_queue_wait and self.capacity > self.heavy_slots:
+                self.capacity -= 1
+                logger.info("Queue wait {:.2f}s, capacity reduced to {} slots".format(wait, self.capacity))
+            elif wait <= self.max_queue_wait / 2 and self.capacity < self.max_capacity:
+                self.capacity += 1
+                logger.info("Queue wait {:.2f}s, capacity increased to {} slots".format(wait, self.capacity))
+            self.condition.notify_all()
+        return self.capacity
+
+    def _acquire(self, slot_count):
+        with self.condition:
+            self.condition.wait_for(lambda: self.slots_in_use + slot_count <= self.capacity)
+            self.slots_in_use += slot_count
+
+    def _release(self, slot_count):
+        with self.condition:
+            self.slots_in_use -= slot_count
+            self.condition.notify_all()
+
+    def _run_statement(self, connect, query, heavy):
+        slot_count = self.get_slot_count(heavy)
+        self._acquire(slot_count)
+        start = time.perf_counter()
+        conn = connect()
+        try:
+            cur = conn.cursor()
+            # auto wlm assigns the memory itself and ignores the slot count
+            if self.catalog.sets_slot_count and not self.auto:
+                cur.execute("SET wlm_query_slot_count TO {};".format(slot_count))
+            cur.execute(query)
+            conn.commit()
+        finally:
+            conn.close()
+            self._release(slot_count)
+        self.adapt_capacity()
+        return time.perf_counter() - start
+
+    def run(self, connect, statements):
+        """Execute statements on separate connections, committing each of them
+        Args:
+            connect(function): function returning a new psycopg2 connection
+            statements(list): (query, heavy) tuples, heavy statements get more slots
+
+        Returns:
+            list of durations in seconds
+        """
+        with ThreadPoolExecutor(max_workers=self.max_capacity) as pool:
+            futures = [pool.submit(self._run_statement, connect, query, heavy) for query, heavy in statements]
+            return [future.result() for future in futures]
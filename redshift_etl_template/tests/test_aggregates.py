@@ -0,0 +1,120 @@
+import os
+import unittest
+import pandas as pd
+
+from redshift_etl_template.constants import DIR_DATA_TEST, logging
+from redshift_etl_template.src import sql_queries
+from redshift_etl_template.src.aggregates import refresh_aggregates, merge_statements
+from redshift_etl_template.src.aggregate_queries import aggregates, aggregate_create_queries
+from redshift_etl_template.src.blue_green import get_existing_tables
+from redshift_etl_template.tests import utils_tests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+VIZ = False
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+
+class TestMergeStatements(unittest.TestCase):
+    """Check the statements summing a delta into an aggregate table.
+    Note: no aws infrastructure is needed"""
+
+    def test_merge_statements(self):
+        statements = merge_statements("plays_by_level", aggregates["plays_by_level"], "songplays_delta")
+        self.assertIn("FROM songplays_delta AS sp", statements[1])
+        self.assertIn("SET plays = plays_by_level.plays + d.plays", statements[2])
+        self.assertIn("WHERE NOT EXISTS (SELECT 1 FROM plays_by_level WHERE plays_by_level.level = d.level)",
+                      statements[3])
+
+
+class TestRefreshAggregates(unittest.TestCase):
+    """Insert the songplays of two windows of events and merge them into the aggregate tables.
+    Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
+    Note 2: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        self.df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_events.csv"))
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_songs.csv"))
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(self.cur, df_songs, viz=VIZ)
+        self.cur.execute(sql_queries.songplay_table_create)
+        self.conn.commit()
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def load_window(self, days):
+        """Stage the events shifted by some days and insert their songplays through songplays_delta"""
+        df_log = self.df_log.assign(ts=self.df_log["ts"] + days * MS_PER_DAY)
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, df_log, viz=VIZ)
+        for query in sql_queries.songplays_delta_queries + [sql_queries.songplay_table_insert]:
+            self.cur.execute(query)
+        self.conn.commit()
+
+    def get_plays(self, table):
+        self.cur.execute("SELECT COALESCE(SUM(plays), 0) FROM {};".format(table))
+        return self.cur.fetchone()[0]
+
+    def get_n_songplays(self):
+        self.cur.execute("SELECT COUNT(*) FROM songplays;")
+        return self.cur.fetchone()[0]
+
+    def test_merge_and_rebuild(self):
+        self.load_window(0)
+        refresh_aggregates(self.cur, self.conn)
+        n_first = self.get_n_songplays()
+        self.assertGreater(n_first, 0)
+        self.assertNotIn("songplays_delta", get_existing_tables(self.cur))
+        for table in aggregates:
+            self.assertEqual(self.get_plays(table), n_first)
+
+        self.load_window(31)
+        refresh_aggregates(self.cur, self.conn)
+        self.assertEqual(self.get_n_songplays(), 2 * n_first)
+        for table in aggregates:
+            self.assertEqual(self.get_plays(table), 2 * n_first)
+        self.cur.execute("SELECT COUNT(*) FROM plays_by_hour;")
+        self.assertEqual(self.cur.fetchone()[0], 2)
+
+        refresh_aggregates(self.cur, self.conn, full=True)
+        for table in aggregates:
+            self.assertEqual(self.get_plays(table), 2 * n_first)
+        self.cur.execute("SELECT aggregate, full_refresh FROM aggregate_refresh_log ORDER BY refreshed_at;")
+        df_log = pd.DataFrame(self.cur.fetchall(), columns=["aggregate", "full_refresh"])
+        self.assertEqual(len(df_log), 3 * len(aggregates))
+        self.assertEqual(int(df_log["full_refresh"].sum()), len(aggregates))
+
+    def test_repeated_run(self):
+        self.load_window(0)
+        refresh_aggregates(self.cur, self.conn)
+        n_songplays = self.get_n_songplays()
+        # the same staging tables are loaded again, none of their songplays is new
+        self.load_window(0)
+        self.assertEqual(refresh_aggregates(self.cur, self.conn), 0)
+        self.assertEqual(self.get_n_songplays(), n_songplays)
+        for table in aggregates:
+            self.assertEqual(self.get_plays(table), n_songplays)
+
+    def test_failed_merge_is_rolled_back(self):
+        self.load_window(0)
+        # the last aggregate cannot be merged, the others must not keep the delta
+        for query in aggregate_create_queries:
+            self.cur.execute(query)
+        self.cur.execute("DROP TABLE plays_by_song;")
+        self.cur.execute("CREATE TABLE plays_by_song (song_id VARCHAR NOT NULL, plays BIGINT NOT NULL);")
+        self.conn.commit()
+        with self.assertRaises(Exception):
+            refresh_aggregates(self.cur, self.conn)
+        self.assertIn("songplays_delta", get_existing_tables(self.cur))
+        self.assertEqual(self.get_plays("plays_by_level"), 0)
+        self.cur.execute("DROP TABLE plays_by_song;")
+        self.conn.commit()
+        refresh_aggregates(self.cur, self.conn)
+        for table in aggregates:
+            self.assertEqual(self.get_plays(table), self.get_n_songplays())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import configparser
+
+from redshift_etl_template.src.backends import translate_to_postgres, TranslatingCursor, WarehouseBackend, \
+    RedshiftBackend, PostgresBackend
+from redshift_etl_template.src.transactions import TransactionRunner
+from redshift_etl_template.src.sql_queries import songplays_delta_table_create, staging_events_table_create, \
+    staging_songs_table_create, pending_events_expired_delete
+from redshift_etl_template.src.aggregate_queries import aggregate_staleness_select, aggregates
+from redshift_etl_template.tests import utils_tests
+
+
+class FakeCursor:
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.n_commits = 0
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        self.n_commits += 1
+
+    def rollback(self):
+        pass
+
+
+class TestPostgresTranslation(unittest.TestCase):
+    """Check that the redshift dialect is removed from the statements of the project.
+    Note: no aws infrastructure is needed"""
+
+    def test_distribution_is_removed(self):
+        query = translate_to_postgres(staging_events_table_create)
+        for keyword in ["diststyle", "DISTKEY", "SORTKEY"]:
+            self.assertNotIn(keyword, query)
+        self.assertTrue(query.rstrip().endswith(";"))
+
+    def test_identity_becomes_serial(self):
+        query = translate_to_postgres("CREATE TABLE t (id BIGINT IDENTITY(0,1) PRIMARY KEY)")
+        self.assertEqual(query, "CREATE TABLE t (id BIGSERIAL PRIMARY KEY)")
+
+    def test_hex_parsing(self):
+        query = translate_to_postgres(songplays_delta_table_create)
+        self.assertNotIn("STRTOL", query)
+        self.assertIn("::BIT(64)::BIGINT AS songplay_id", query)
+
+    def test_date_functions(self):
+        query = translate_to_postgres(pending_events_expired_delete.format(7))
+        self.assertIn("(NOW() + INTERVAL '-7 day')", query)
+        query = translate_to_postgres(aggregate_staleness_select)
+        self.assertIn("EXTRACT(EPOCH FROM (NOW() - MAX(refreshed_at)))", query)
+        query = translate_to_postgres(aggregates["plays_by_hour"]["select"])
+        self.assertIn("(sp.start_time)::DATE AS day", query)
+
+    def test_cursor_translates(self):
+        cur = FakeCursor()
+        TranslatingCursor(cur, translate_to_postgres).execute("SELECT GETDATE()")
+        self.assertEqual(cur.queries, ["SELECT NOW()"])
+
+
+class TestRedshiftBackend(unittest.TestCase):
+    """Check the statements of the redshift bulk load.
+    Note: no aws infrastructure is needed"""
+
+    def setUp(self):
+        config = configparser.ConfigParser()
+        config.read_dict({"IAM_ROLE": {"arn": "arn:aws:iam::0:role/test"},
+                          "S3": {"log_data": "s3://bucket/log_data", "song_data": "s3://bucket/song_data",
+                                 "log_jsonpath": "s3://bucket/log_json_path.json"}})
+        self.conn = FakeConnection()
+        self.backend = RedshiftBackend(self.conn, config)
+
+    def test_backend_is_abstract(self):
+        with self.assertRaises(TypeError):
+            WarehouseBackend(self.conn, None)
+
+    def test_copy_query(self):
+        query = self.backend.get_copy_query("staging_events", self.backend.get_source("staging_events"))
+        self.assertTrue(query.startswith("COPY staging_events FROM 's3://bucket/log_data'"))
+        self.assertIn("FORMAT AS JSON 's3://bucket/log_json_path.json'", query)
+        query = self.backend.get_copy_query("staging_songs", "s3://bucket/other_songs")
+        self.assertTrue(query.startswith("COPY staging_songs FROM 's3://bucket/other_songs'"))
+        self.assertIn("FORMAT AS JSON 'auto'", query)
+
+    def test_load_follows_the_commit_policy(self):
+        cur = FakeCursor()
+        runner = TransactionRunner(cur, self.conn, "run")
+        self.backend.load_staging_tables(runner)
+        self.assertEqual(self.conn.n_commits, 0)
+        self.assertEqual([query for query in cur.queries if query.startswith("COPY")],
+                         [self.backend.get_copy_query(table, self.backend.get_source(table))
+                          for table in ["staging_events", "staging_songs"]])
+        runner.finish()
+        self.assertEqual(self.conn.n_commits, 1)
+
+
+@unittest.skipUnless(utils_tests.TEST_BACKEND == "postgres", "the local load reads a local database")
+class TestPostgresBackend(unittest.TestCase):
+    """Load local json files into the staging tables.
+    Note: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        self.cur.execute(staging_songs_table_create)
+        self.conn.commit()
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, "song.json"), "w") as json_file:
+            json.dump({"song_id": "SO1", "artist_id": "AR1", "artist_name": "Artist", "title": "Song",
+                       "num_songs": 1, "duration": 200.5, "year": 2008}, json_file)
+        self.backend = PostgresBackend(self.conn, utils_tests.config)
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+        shutil.rmtree(self.dir)
+
+    def test_load_replaces_the_staging_table(self):
+        self.backend.bulk_load("staging_songs", self.dir)
+        self.backend.bulk_load("staging_songs", self.dir, TransactionRunner(self.cur, self.conn, "group"))
+        self.cur.execute("SELECT COUNT(*) FROM staging_songs;")
+        self.assertEqual(self.cur.fetchone()[0], 1)
+        self.cur.execute("SELECT table_name FROM table_versions;")
+        self.assertEqual(self.cur.fetchall(), [("staging_songs",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
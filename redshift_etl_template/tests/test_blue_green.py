@@ -0,0 +1,81 @@
+import re
+import unittest
+
+from redshift_etl_template.src import blue_green, sql_queries
+
+
+class FakeCountCursor:
+    """Cursor answering the table listing and the row counts of the validation"""
+
+    def __init__(self, counts):
+        self.counts = counts
+        self._rows = []
+
+    def execute(self, query, params=None):
+        if "pg_tables" in query:
+            self._rows = [(table,) for table in self.counts]
+        else:
+            self._rows = [(self.counts[re.search(r"FROM (\w+)", query).group(1)],)]
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0]
+
+
+class TestShadowQueries(unittest.TestCase):
+    """Check that the star statements are redirected to the shadow tables.
+    Note: no aws infrastructure is needed"""
+
+    def test_create_is_redirected(self):
+        query = blue_green.shadow_query(sql_queries.time_table_create, "time")
+        self.assertIn("CREATE TABLE IF NOT EXISTS time_shadow (", query)
+        self.assertIn("start_time", query)
+
+    def test_insert_is_redirected(self):
+        query = blue_green.shadow_query(sql_queries.artist_table_insert, "artists")
+        self.assertIn("INSERT INTO artists_shadow(", query)
+        query = blue_green.shadow_query(sql_queries.songplay_table_insert, "songplays")
+        self.assertIn("INSERT INTO songplays_shadow (", query)
+        self.assertIn("FROM songplays_delta", query)
+
+    def test_sources_are_untouched(self):
+        query = blue_green.shadow_query(sql_queries.time_table_insert, "time")
+        self.assertIn("INSERT INTO time_shadow (", query)
+        self.assertIn("tmp.start_time", query)
+        self.assertNotIn("start_time_shadow", query)
+
+    def test_reads_of_the_target_are_redirected(self):
+        query = blue_green.shadow_query(sql_queries.user_table_insert, "users")
+        self.assertIn("INSERT INTO users_shadow (", query)
+        self.assertIn("FROM users_shadow AS u", query)
+        self.assertIn("FROM users_history AS h", query)
+
+
+class TestShadowTables(unittest.TestCase):
+    """Check the statements of the shadow tables and their validation.
+    Note: no aws infrastructure is needed"""
+
+    def test_statements_are_paired_by_table(self):
+        for table in sql_queries.star_tables:
+            create_query = sql_queries.table_queries[table]["create"]
+            insert_query = sql_queries.table_queries[table]["insert"]
+            self.assertIn("CREATE TABLE IF NOT EXISTS {} ".format(table), create_query)
+            self.assertRegex(insert_query, r"INSERT INTO {}\b".format(table))
+
+    def test_validation_errors(self):
+        counts = {table: 10 for table in sql_queries.star_tables}
+        counts.update({table + blue_green.SHADOW_SUFFIX: 10 for table in sql_queries.star_tables})
+        self.assertEqual(blue_green.validate_shadow_tables(FakeCountCursor(counts), 0.9)["users"],
+                         {"shadow": 10, "live": 10})
+        counts["songs" + blue_green.SHADOW_SUFFIX] = 5
+        with self.assertRaises(blue_green.ShadowValidationError):
+            blue_green.validate_shadow_tables(FakeCountCursor(counts), 0.9)
+        counts["songs" + blue_green.SHADOW_SUFFIX] = 0
+        with self.assertRaises(blue_green.ShadowValidationError):
+            blue_green.validate_shadow_tables(FakeCountCursor(counts))
+
+
+if __name__ == "__main__":
+    unittest.main()
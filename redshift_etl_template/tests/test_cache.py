@@ -0,0 +1,177 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+from redshift_etl_template.src import cache
+from redshift_etl_template.src.transactions import TransactionRunner
+from redshift_etl_template.scripts import etl
+from redshift_etl_template.tests import utils_tests
+
+
+class FakeCursor:
+    """Answer the version lookups with a dictionary and count the other queries"""
+
+    def __init__(self, versions):
+        self.versions = versions
+        self.n_queries = 0
+        self.description = None
+        self.rows = []
+
+    def execute(self, query):
+        if query.startswith("SELECT table_name, MAX(version) FROM table_versions"):
+            tables = re.findall(r"'(\w+)'", query)
+            self.rows = [(table, version) for table, version in self.versions.items() if table in tables]
+        else:
+            self.n_queries += 1
+            self.description = [("user_id", 23), ("level", 1043)]
+            self.rows = [(1, "free"), (2, "paid")]
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestQueryCache(unittest.TestCase):
+    """Check hits, invalidation and eviction of the query cache.
+    Note: no aws infrastructure is needed"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = cache.QueryCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_normalized_query_hits(self):
+        cur = FakeCursor({"users": 1})
+        df = self.cache.get_dataframe(cur, "SELECT * FROM users LIMIT 5;")
+        df_cached = self.cache.get_dataframe(cur, "SELECT *\n    FROM users\nLIMIT 5")
+        self.assertEqual(cur.n_queries, 1)
+        self.assertEqual(df_cached["level"].tolist(), df["level"].tolist())
+
+    def test_write_invalidates(self):
+        cur = FakeCursor({"users": 1})
+        self.cache.get_dataframe(cur, "SELECT * FROM users")
+        cur.versions["users"] = 2
+        self.cache.get_dataframe(cur, "SELECT * FROM users")
+        self.assertEqual(cur.n_queries, 2)
+
+    def test_unversioned_table_is_not_cached(self):
+        cur = FakeCursor({})
+        self.cache.get_dataframe(cur, "SELECT * FROM users")
+        self.cache.get_dataframe(cur, "SELECT * FROM users")
+        self.assertEqual(cur.n_queries, 2)
+
+    def test_unversioned_relation_is_not_cached(self):
+        cur = FakeCursor({"songplays": 1})
+        query = "SELECT * FROM songplays sp JOIN pending_events pe ON sp.session_id = pe.sessionid"
+        self.assertIsNone(cache.get_referenced_tables(query))
+        self.cache.get_dataframe(cur, query)
+        self.cache.get_dataframe(cur, query)
+        self.assertEqual(cur.n_queries, 2)
+        self.assertIsNone(cache.get_referenced_tables("SELECT relname FROM pg_catalog.pg_class"))
+
+    def test_referenced_tables(self):
+        query = """WITH recent AS (SELECT * FROM songplays)
+        SELECT EXTRACT(hour FROM start_time), COUNT(*) FROM recent JOIN users ON recent.user_id = users.user_id
+        GROUP BY 1"""
+        self.assertEqual(cache.get_referenced_tables(query), ["songplays", "users"])
+
+    def test_eviction(self):
+        self.cache.max_bytes = 0
+        cur = FakeCursor({"users": 1})
+        self.cache.get_dataframe(cur, "SELECT * FROM users")
+        self.cache.get_dataframe(cur, "SELECT * FROM users")
+        self.assertEqual(cur.n_queries, 2)
+
+    def test_shared_by_threads(self):
+        # every entry is larger than the cache, the threads evict the entries written by the others
+        self.cache.max_bytes = 1
+
+        def read_tables(i):
+            cur = FakeCursor({"users": 1, "songs": 1})
+            for j in range(20):
+                self.cache.get_dataframe(cur, "SELECT * FROM {} LIMIT {}".format(["users", "songs"][j % 2], i))
+            return cur.n_queries
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            n_queries = list(executor.map(read_tables, range(8)))
+        self.assertEqual(self.cache.hits + self.cache.misses, 8 * 20)
+        self.assertEqual(sum(n_queries), self.cache.misses)
+        self.assertFalse([name for name in os.listdir(self.cache_dir) if name.endswith(".tmp")])
+
+    def evict_by_another_process(self, function):
+        """Wrap an os function so that the entries are removed before it runs, as a concurrent eviction would"""
+        def evicted(path, *args, **kwargs):
+            if str(path).endswith(".parquet"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return function(path, *args, **kwargs)
+        return evicted
+
+    def test_entry_evicted_before_read(self):
+        cur = FakeCursor({"users": 1})
+        self.cache.get_dataframe(cur, "SELECT * FROM users")
+        with mock.patch("os.utime", self.evict_by_another_process(os.utime)):
+            df = self.cache.get_dataframe(cur, "SELECT * FROM users")
+        self.assertEqual(cur.n_queries, 2)
+        self.assertEqual(len(df), 2)
+
+    def test_entry_evicted_during_eviction(self):
+        cur = FakeCursor({"users": 1, "songs": 1})
+        self.cache.get_dataframe(cur, "SELECT * FROM users")
+        self.cache.get_dataframe(cur, "SELECT * FROM songs")
+        self.cache.max_bytes = 0
+        with mock.patch("os.stat", self.evict_by_another_process(os.stat)):
+            self.cache.evict()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+class TestTableVersions(unittest.TestCase):
+    """Check that the versions of the tables are committed with their writes.
+    Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
+    Note 2: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        self.cur.execute(cache.table_versions_create)
+        self.conn.commit()
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def get_versioned_tables(self):
+        self.cur.execute("SELECT table_name FROM table_versions ORDER BY table_name;")
+        return [row[0] for row in self.cur.fetchall()]
+
+    def test_failed_write_keeps_versions(self):
+        runner = TransactionRunner(self.cur, self.conn, "group")
+        with self.assertRaises(Exception):
+            etl.insert_tables(self.cur, self.conn, runner, ["INSERT INTO missing_table VALUES (1);"])
+        self.assertEqual(self.get_versioned_tables(), [])
+        etl.insert_tables(self.cur, self.conn, runner, ["SELECT 1;"])
+        self.assertEqual(self.get_versioned_tables(), sorted(etl.star_tables))
+
+    def test_writes_increment_versions(self):
+        # the writes follow each other within the same second, each of them gets a new version
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        key = cache.QueryCache(cache_dir).get_key
+        versions = []
+        for _ in range(3):
+            TransactionRunner(self.cur, self.conn, "group").execute_group(cache.table_versions_queries(["users"]))
+            self.cur.execute(cache.table_versions_select.format("'users'"))
+            versions.append(self.cur.fetchall())
+            versions.append(key(self.cur, "SELECT * FROM users"))
+        self.assertEqual(versions[0::2], [[("users", 1)], [("users", 2)], [("users", 3)]])
+        self.assertEqual(len(set(versions[1::2])), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
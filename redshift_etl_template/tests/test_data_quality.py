@@ -0,0 +1,37 @@
+import datetime
+import unittest
+
+from redshift_etl_template.src import data_quality
+
+
+class TestQualityChecks(unittest.TestCase):
+    """Check compilation and evaluation of the data quality checks.
+    Note: no aws infrastructure is needed"""
+
+    def test_single_scan_per_table(self):
+        query = data_quality.compile_checks("songplays", data_quality.quality_checks["songplays"])
+        self.assertEqual(query.count("FROM songplays"), 1)
+        self.assertIn("COUNT(t.songplay_id) - COUNT(DISTINCT t.songplay_id) AS duplicate__songplay_id", query)
+        self.assertIn("LEFT JOIN (SELECT DISTINCT user_id FROM users) AS fk0 ON t.user_id = fk0.user_id", query)
+        self.assertIn("MIN(t.start_time) AS min__start_time", query)
+
+    def test_evaluation(self):
+        checks = data_quality.quality_checks["users"]
+        report = data_quality.evaluate_checks("users", checks,
+                                              {"row_count": 10, "null__level": 1, "duplicate__user_id": 0})
+        passed = {(row["check"], row["column"]): row["passed"] for row in report}
+        self.assertTrue(passed[("row_count", None)])
+        self.assertFalse(passed[("null_rate", "level")])
+        self.assertTrue(passed[("duplicate_key", "user_id")])
+
+    def test_range(self):
+        checks = data_quality.quality_checks["time"]
+        result = {"row_count": 1, "min__start_time": datetime.datetime(1970, 1, 1),
+                  "max__start_time": datetime.datetime(2018, 11, 1)}
+        result.update({"null__" + column: 0 for column in checks["not_null"]})
+        report = data_quality.evaluate_checks("time", checks, result)
+        self.assertFalse(report[-1]["passed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
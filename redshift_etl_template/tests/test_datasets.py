@@ -0,0 +1,183 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import argparse
+import configparser
+
+from redshift_etl_template.scripts import etl
+from redshift_etl_template.src.datasets import load_datasets, build_dataset_config, ConcurrencyBudget, \
+    DatasetRunner
+from redshift_etl_template.src.backends import PostgresBackend
+from redshift_etl_template.tests import utils_tests
+
+EVENT_KEYS = ["artist", "auth", "firstName", "gender", "itemInSession", "lastName", "length", "level", "location",
+              "method", "page", "registration", "sessionId", "song", "status", "ts", "userAgent", "userId"]
+
+
+class FakeConnection:
+    """Connection recording its rollbacks"""
+
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePool:
+    """Pool recording the connections taken and not returned yet"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.taken = 0
+
+    def getconn(self):
+        with self.lock:
+            self.taken += 1
+        return FakeConnection()
+
+    def putconn(self, conn):
+        with self.lock:
+            self.taken -= 1
+
+
+class TestDatasetRunner(unittest.TestCase):
+    """Run fake pipelines of several datasets concurrently.
+    Note: no aws infrastructure is needed"""
+
+    def setUp(self):
+        self.tracker = {"lock": threading.Lock(), "running": 0, "max_running": 0}
+        self.datasets = [{"name": "dataset_{}".format(i), "schema": "dataset_{}".format(i)} for i in range(6)]
+
+    def step(self):
+        with self.tracker["lock"]:
+            self.tracker["running"] += 1
+            self.tracker["max_running"] = max(self.tracker["max_running"], self.tracker["running"])
+        threading.Event().wait(0.01)
+        with self.tracker["lock"]:
+            self.tracker["running"] -= 1
+
+    def pipeline(self, conn, dataset, run_step, metrics):
+        for _ in range(3):
+            run_step(self.step)
+        if dataset["name"] == "dataset_1":
+            raise Exception("missing source")
+        metrics["songplays"] = 10
+
+    def test_failure_is_isolated(self):
+        pool = FakePool()
+        df_metrics = DatasetRunner(pool, ConcurrencyBudget(4), max_datasets=3).run(self.pipeline, self.datasets)
+        self.assertEqual(list(df_metrics["dataset"]), [dataset["name"] for dataset in self.datasets])
+        failed = df_metrics[df_metrics["status"] == "failed"]
+        self.assertEqual(list(failed["dataset"]), ["dataset_1"])
+        self.assertEqual(failed["error"].iloc[0], "missing source")
+        self.assertEqual((df_metrics["status"] == "succeeded").sum(), 5)
+        self.assertTrue((df_metrics["steps"] == 3).all())
+        self.assertEqual(pool.taken, 0)
+
+    def test_budget_is_not_exceeded(self):
+        df_metrics = DatasetRunner(FakePool(), ConcurrencyBudget(2), max_datasets=6).run(self.pipeline, self.datasets)
+        self.assertLessEqual(self.tracker["max_running"], 2)
+        self.assertGreater(df_metrics["wait_s"].sum(), 0)
+
+
+class TestDatasetDefinitions(unittest.TestCase):
+    """Read the dataset definitions and build the configuration of a dataset.
+    Note: no aws infrastructure is needed"""
+
+    def write_definitions(self, content):
+        path = os.path.join(tempfile.mkdtemp(), "datasets.cfg")
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_load_datasets(self):
+        datasets = load_datasets(self.write_definitions(
+            "[eu]\nlog_data = s3://bucket/eu/log_data\n\n[us]\nschema = dataset_us\n"))
+        self.assertEqual([dataset["schema"] for dataset in datasets], ["eu", "dataset_us"])
+        self.assertEqual(datasets[0]["log_data"], "s3://bucket/eu/log_data")
+        self.assertIsNone(datasets[1]["song_data"])
+
+    def test_invalid_schemas(self):
+        with self.assertRaises(ValueError):
+            load_datasets(self.write_definitions("[eu]\nschema = eu; DROP TABLE users\n"))
+        with self.assertRaises(ValueError):
+            load_datasets(self.write_definitions("[eu]\nschema = shared\n\n[us]\nschema = shared\n"))
+
+    def test_build_dataset_config(self):
+        config = configparser.ConfigParser()
+        config.read_dict({"S3": {"log_data": "s3://bucket/log_data", "song_data": "s3://bucket/song_data"}})
+        dataset = {"name": "eu", "schema": "eu", "log_data": "s3://bucket/eu/log_data",
+                   "song_data": None, "log_jsonpath": None}
+        dataset_config = build_dataset_config(config, dataset, "redshift")
+        self.assertEqual(dataset_config.get("S3", "log_data"), "s3://bucket/eu/log_data")
+        self.assertEqual(dataset_config.get("S3", "song_data"), "s3://bucket/song_data")
+        self.assertEqual(config.get("S3", "log_data"), "s3://bucket/log_data")
+        self.assertEqual(build_dataset_config(config, dataset, "postgres").get("LOCAL", "log_data"),
+                         "s3://bucket/eu/log_data")
+
+
+@unittest.skipUnless(utils_tests.TEST_BACKEND == "postgres", "the datasets are loaded from local directories")
+class TestRunDatasets(unittest.TestCase):
+    """Load two datasets of local json files into their own schemas, on a shared pool of connections.
+    Note: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        self.dir = tempfile.mkdtemp()
+        path_jsonpaths = os.path.join(self.dir, "log_json_path.json")
+        with open(path_jsonpaths, "w") as jsonpaths_file:
+            json.dump({"jsonpaths": ["$['{}']".format(key) for key in EVENT_KEYS]}, jsonpaths_file)
+        self.write_json(os.path.join("song_data", "song.json"), {
+            "song_id": "SO1", "artist_id": "AR1", "artist_name": "Artist", "title": "Song",
+            "num_songs": 1, "duration": 200.5, "year": 2008})
+        definitions = ""
+        for name, n_events in [("eu", 2), ("us", 1)]:
+            for item_in_session in range(n_events):
+                self.write_json(os.path.join(name, "log_data", "events-{}.json".format(item_in_session)), {
+                    "artist": "Artist", "auth": "Logged In", "firstName": "Name", "gender": "F",
+                    "itemInSession": item_in_session, "lastName": "Surname", "length": 200.5, "level": "free",
+                    "location": "Location", "method": "PUT", "page": "NextSong", "registration": 1540919166796.0,
+                    "sessionId": 1, "song": "Song", "status": 200, "ts": 1541105830796 + item_in_session,
+                    "userAgent": "Agent", "userId": 1})
+            definitions += "[{0}]\nschema = {1}_{0}\nlog_data = {2}\nsong_data = {3}\nlog_jsonpath = {4}\n\n".format(
+                name, self.schema, os.path.join(self.dir, name, "log_data"), os.path.join(self.dir, "song_data"),
+                path_jsonpaths)
+        self.path_definitions = os.path.join(self.dir, "datasets.cfg")
+        with open(self.path_definitions, "w") as definitions_file:
+            definitions_file.write(definitions)
+
+    def tearDown(self):
+        for name in ["eu", "us"]:
+            self.cur.execute("DROP SCHEMA IF EXISTS {}_{} CASCADE;".format(self.schema, name))
+        self.conn.commit()
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+        shutil.rmtree(self.dir)
+
+    def write_json(self, name, content):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as json_file:
+            json.dump(content, json_file)
+
+    def test_run_datasets(self):
+        args = argparse.Namespace(datasets=self.path_definitions, concurrency_budget=None, max_datasets=2,
+                                  commit_policy="statement", skip_aggregates=False)
+        dsn = "host={} dbname={} user={} password={} port={}".format(*utils_tests.config['CLUSTER'].values())
+        df_metrics = etl.run_datasets(args, utils_tests.config, dsn, PostgresBackend(self.conn, utils_tests.config))
+        self.assertEqual(list(df_metrics["status"]), ["succeeded", "succeeded"], df_metrics["error"].tolist())
+        self.assertEqual(list(df_metrics["songplays"]), [2, 1])
+        for name, n_songplays in [("eu", 2), ("us", 1)]:
+            self.cur.execute("SELECT SUM(plays) FROM {}_{}.plays_by_hour;".format(self.schema, name))
+            self.assertEqual(self.cur.fetchone()[0], n_songplays)
+        # the tables of the datasets are not created in the schema of the connection
+        self.cur.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s;", (self.schema,))
+        self.assertEqual(self.cur.fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
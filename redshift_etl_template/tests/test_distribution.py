@@ -0,0 +1,144 @@
+import os
+import unittest
+import pandas as pd
+
+from redshift_etl_template.constants import DIR_DATA_TEST, logging
+from redshift_etl_template.src import distribution, sql_queries
+from redshift_etl_template.scripts import skew_advisor
+from redshift_etl_template.tests import utils_tests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+VIZ = False
+
+
+class FakeCursor:
+    """Answer the distribution key lookups with a dictionary and record the other queries"""
+
+    def __init__(self, distkeys):
+        self.distkeys = distkeys
+        self.queries = []
+        self.row = None
+
+    def execute(self, query):
+        self.queries.append(query)
+        table = query.split("tablename = '")[-1].split("'")[0]
+        self.row = (self.distkeys[table],) if table in self.distkeys else None
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class TestDistributionSimulation(unittest.TestCase):
+    """Check the simulation of the slices and the deep copy statements.
+    Note: no aws infrastructure is needed"""
+
+    def test_skew_ratio(self):
+        self.assertEqual(distribution.skew_ratio([10, 10, 10, 10]), 1.0)
+        self.assertEqual(distribution.skew_ratio([40, 0, 0, 0]), 4.0)
+        self.assertEqual(distribution.skew_ratio([0, 0]), 1.0)
+
+    def test_simulate_slice_rows(self):
+        slice_rows = distribution.simulate_slice_rows(["a", "b", "c", "a", None, None], 4)
+        self.assertEqual(len(slice_rows), 4)
+        self.assertEqual(sum(slice_rows), 6)
+        # equal keys, nulls included, always land on the same slice
+        slice_rows = distribution.simulate_slice_rows(["a"] * 5 + [None] * 3, 4)
+        self.assertEqual(sorted(n_rows for n_rows in slice_rows if n_rows), [3, 5])
+        self.assertEqual(max(distribution.simulate_slice_rows([None] * 3, 4)), 3)
+        self.assertEqual(distribution.simulate_even_rows(10, 4), [3, 3, 2, 2])
+
+    def test_get_distkey(self):
+        self.assertEqual(distribution.get_distkey(sql_queries.staging_events_table_create), "artist")
+        self.assertEqual(distribution.get_distkey(sql_queries.staging_songs_table_create), "artist_name")
+        self.assertEqual(distribution.get_distkey(sql_queries.songplay_table_create), distribution.EVEN)
+
+    def test_get_live_distkey(self):
+        cur = FakeCursor({"staging_events": "sessionid"})
+        self.assertEqual(distribution.get_live_distkey(cur, "staging_events"), "sessionid")
+        self.assertIn("pg_table_def", cur.queries[0])
+        self.assertEqual(distribution.get_live_distkey(cur, "staging_songs"), distribution.EVEN)
+
+    def test_compound_distributions(self):
+        # one artist plays most of the songs, the pair with the song spreads them over the slices
+        df_sample = pd.DataFrame({
+            "artist": ["a"] * 90 + ["b"] * 10,
+            "song": ["s{}".format(i) for i in range(100)],
+            "sessionid": [1] * 100,
+            "userid": [1] * 100
+        })
+        self.assertIn("artist+song", distribution.get_compound_distributions("staging_events"))
+        df_candidates = distribution.recommend_distribution(df_sample, "staging_events", 4, "artist_name")
+        df_candidates = df_candidates.set_index("distribution")
+        self.assertLess(df_candidates.loc["artist+song", "skew_ratio"], df_candidates.loc["artist", "skew_ratio"])
+        self.assertFalse(df_candidates.loc["artist+song", "applicable"])
+        self.assertEqual(df_candidates.loc["artist+song", "songplays_join"], "redistribute one side")
+        self.assertEqual(df_candidates.loc["artist", "songplays_join"], "collocated")
+
+    def test_apply_warns_about_the_ddl(self):
+        cur = FakeCursor({})
+        with self.assertLogs(skew_advisor.logger, "WARNING") as logs:
+            skew_advisor.apply_distribution(cur, FakeConnection(), "staging_events", "sessionid")
+        self.assertIn("create_tables.py", logs.output[0])
+        self.assertEqual(cur.queries[-1], "ALTER TABLE staging_events_deep_copy RENAME TO staging_events;")
+        with self.assertRaises(AssertionError):
+            with self.assertLogs(skew_advisor.logger, "WARNING"):
+                skew_advisor.apply_distribution(cur, FakeConnection(), "staging_events", "artist")
+
+    def test_deep_copy_statements(self):
+        statements = distribution.deep_copy_statements(
+            "staging_events", sql_queries.staging_events_table_create, "sessionid")
+        self.assertEqual(statements[0], "DROP TABLE IF EXISTS staging_events_deep_copy;")
+        self.assertIn("CREATE TABLE IF NOT EXISTS staging_events_deep_copy (", statements[1])
+        self.assertIn("diststyle key\nDISTKEY (sessionid)", statements[1])
+        self.assertNotIn("DISTKEY (artist)", statements[1])
+        self.assertIn("SORTKEY (ts)", statements[1])
+        self.assertEqual(statements[-1], "ALTER TABLE staging_events_deep_copy RENAME TO staging_events;")
+        statements = distribution.deep_copy_statements(
+            "staging_songs", sql_queries.staging_songs_table_create, distribution.EVEN)
+        self.assertIn("diststyle even", statements[1])
+        self.assertEqual(distribution.get_distkey(statements[1]), distribution.EVEN)
+
+    def test_apply_is_a_candidate(self):
+        with self.assertRaises(ValueError):
+            distribution.deep_copy_statements("staging_songs", sql_queries.staging_songs_table_create, "year")
+        with self.assertRaises(SystemExit):
+            skew_advisor.parse_input(["--table", "staging_songs", "--apply", "year"])
+        with self.assertRaises(SystemExit):
+            skew_advisor.parse_input(["--table", "staging_songs", "--apply", "artist_name+title"])
+        args = skew_advisor.parse_input(["--table", "staging_songs", "--apply", "EVEN"])
+        self.assertEqual(args.apply, "EVEN")
+
+
+class TestSampleTable(unittest.TestCase):
+    """Sample the candidate keys of the staged songs.
+    Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
+    Note 2: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def test_sample(self):
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songs_staging_songs.csv"))
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(self.cur, df_songs, viz=VIZ)
+        df_sample = distribution.sample_table(self.cur, "staging_songs", 100)
+        self.assertEqual(list(df_sample.columns), distribution.distribution_candidates["staging_songs"]["candidates"])
+        self.assertEqual(len(df_sample), len(df_songs))
+        self.assertLessEqual(len(distribution.sample_table(self.cur, "staging_songs", 2)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from redshift_etl_template.constants import logging
+from redshift_etl_template.src import export, sql_queries
+from redshift_etl_template.tests import utils_tests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+songplays_values = """
+INSERT INTO songplays VALUES
+    (1, '2018-11-01 10:00:00', 1, 'free', 'SO1', 'AR1', 10, NULL, 'agent'),
+    (2, '2018-11-02 10:00:00', 2, 'paid', 'SO2', 'AR2', 11, NULL, 'agent'),
+    (3, '2018-12-01 10:00:00', 1, 'paid', 'SO1', 'AR1', 12, 'Rome', 'agent');
+"""
+
+
+class FakeObject:
+    def __init__(self, objects, key):
+        self.objects = objects
+        self.key = key
+
+    def get(self):
+        return {"Body": io.BytesIO(self.objects[self.key])}
+
+
+class FakeObjects:
+    """Objects of a bucket, deleted in batches as the boto3 collection does"""
+
+    def __init__(self, objects, prefix=""):
+        self.objects = objects
+        self.prefix = prefix
+
+    def filter(self, Prefix):
+        return FakeObjects(self.objects, Prefix)
+
+    def delete(self):
+        keys = [key for key in self.objects if key.startswith(self.prefix)]
+        for key in keys:
+            del self.objects[key]
+        return [{"Deleted": [{"Key": key} for key in keys]}]
+
+
+class FakeBucket:
+    def __init__(self, objects):
+        self.objects = FakeObjects(objects)
+
+
+class FakeS3:
+    """S3 resource keeping the objects of a single bucket in a dictionary"""
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def Bucket(self, name):
+        return FakeBucket(self.objects)
+
+    def Object(self, bucket, key):
+        return FakeObject(self.objects, key)
+
+
+class FakeUnloadCursor:
+    """Count the rows of songplays and unload them to one partition per month of the rows"""
+
+    def __init__(self, s3, months):
+        self.s3 = s3
+        self.months = months
+        self.row = None
+
+    def execute(self, query):
+        if query.startswith("SELECT COUNT(*)"):
+            self.row = (len(self.months),)
+            return
+        entries = []
+        for month in sorted(set(self.months)):
+            key = "export/songplays/year=2018/month={}/0000_part_00.parquet".format(month)
+            self.s3.objects[key] = b""
+            entries.append({"url": "s3://bucket/" + key, "meta": {"record_count": self.months.count(month)}})
+        self.s3.objects["export/songplays/manifest"] = json.dumps({"entries": entries}).encode("utf-8")
+
+    def fetchone(self):
+        return self.row
+
+
+class TestUnload(unittest.TestCase):
+    """Unload songplays twice to the same prefix.
+    Note: no aws infrastructure is needed"""
+
+    def test_unload_again_removes_stale_partitions(self):
+        s3 = FakeS3({"export/songplays_old/manifest": b"{}"})
+        uri = "s3://bucket/export/songplays"
+        self.assertEqual(export.unload_table(FakeUnloadCursor(s3, [11, 11, 12]), s3, "songplays", uri, "arn"), 3)
+        self.assertIn("export/songplays/year=2018/month=12/0000_part_00.parquet", s3.objects)
+        # the rows of december are gone, their partition with them
+        self.assertEqual(export.unload_table(FakeUnloadCursor(s3, [11, 11]), s3, "songplays", uri, "arn"), 2)
+        self.assertEqual(sorted(s3.objects), [
+            "export/songplays/manifest",
+            "export/songplays/year=2018/month=11/0000_part_00.parquet",
+            "export/songplays_old/manifest"
+        ])
+
+
+@unittest.skipUnless(utils_tests.TEST_BACKEND == "postgres", "the local export reads a local database")
+class TestExportLocal(unittest.TestCase):
+    """Export songplays from the local database to partitioned parquet files.
+    Note: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        self.cur.execute(sql_queries.songplay_table_create)
+        self.conn.commit()
+        self.path = os.path.join(tempfile.mkdtemp(), "songplays")
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def read_manifest(self):
+        with open(os.path.join(self.path, "manifest")) as f:
+            return json.load(f)
+
+    def read_exported_table(self):
+        """Read the files of the manifest, failing if their schemas differ"""
+        return pa.concat_tables([pq.read_table(entry["url"]) for entry in self.read_manifest()["entries"]])
+
+    def test_empty_table(self):
+        self.assertEqual(export.export_table_local(self.conn, "songplays", self.path), 0)
+        self.assertEqual(self.read_manifest(), {"entries": []})
+
+    def test_partitions_and_null_batches(self):
+        self.cur.execute(songplays_values)
+        self.conn.commit()
+        # one row per batch, the location of the first two batches is null
+        self.assertEqual(export.export_table_local(self.conn, "songplays", self.path, batch_size=1), 3)
+        self.assertTrue(os.path.isdir(os.path.join(self.path, "year=2018", "month=11")))
+        self.assertTrue(os.path.isdir(os.path.join(self.path, "year=2018", "month=12")))
+        table = self.read_exported_table()
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(str(table.schema.field("location").type), "string")
+        self.assertEqual(sorted(table.column("songplay_id").to_pylist()), [1, 2, 3])
+
+    def test_export_again(self):
+        self.cur.execute(songplays_values)
+        self.conn.commit()
+        export.export_table_local(self.conn, "songplays", self.path, batch_size=1)
+        self.cur.execute("DELETE FROM songplays WHERE songplay_id = 3;")
+        self.conn.commit()
+        self.assertEqual(export.export_table_local(self.conn, "songplays", self.path), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.path, "year=2018", "month=12")))
+        self.assertEqual(self.read_exported_table().num_rows, 2)
+        self.assertEqual(len(self.read_manifest()["entries"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
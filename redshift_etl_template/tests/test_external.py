@@ -0,0 +1,60 @@
+import os
+import json
+import tempfile
+import unittest
+
+from redshift_etl_template.src import external
+from redshift_etl_template.src.external import get_partition, external_query, build_external_table_create, \
+    external_sources
+from redshift_etl_template.src.sql_queries import time_table_insert, songplays_delta_table_create
+
+
+class TestExternalTables(unittest.TestCase):
+    """Check the rewrite of the star queries on the external tables.
+    Note: no aws infrastructure is needed"""
+
+    def test_get_partition(self):
+        self.assertEqual(get_partition("log_data/2018/11/2018-11-01-events.json"), (2018, 11))
+        self.assertEqual(get_partition("2018/11/2018-11-01-events.json"), (2018, 11))
+        self.assertIsNone(get_partition("song_data/A/B/C/TRABCEI128F424C983.json"))
+
+    def test_external_query(self):
+        query = external_query(songplays_delta_table_create, months=[(2018, 11)])
+        self.assertNotIn("staging_", query)
+        self.assertIn("FROM spectrum.log_events WHERE (year = 2018 AND month = 11)) AS raw WHERE key_rank = 1) AS e",
+                      query)
+        self.assertIn("FROM spectrum.song_records) AS raw WHERE key_rank = 1) AS s", query)
+
+    def test_external_query_keeps_qualified_columns(self):
+        query = external_query(time_table_insert)
+        self.assertIn("AS staging_events\n    WHERE staging_events.ts > 0", query)
+
+    def test_external_table_create(self):
+        query = build_external_table_create("spectrum", external_sources["staging_events"], "s3://bucket/log_data/")
+        self.assertIn("    iteminsession INT,", query)
+        self.assertIn("    length DOUBLE PRECISION,", query)
+        self.assertIn("PARTITIONED BY (year INT, month INT)", query)
+        self.assertTrue(query.endswith("LOCATION 's3://bucket/log_data/';"))
+
+    @unittest.skipIf(external.duckdb is None, "duckdb is not installed")
+    def test_local_partitions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for year, month in [(2018, 10), (2018, 11)]:
+                os.makedirs(os.path.join(directory, "log_data", str(year), "{:02d}".format(month)))
+                with open(os.path.join(directory, "log_data", str(year), "{:02d}".format(month), "events.json"),
+                          "w") as log_file:
+                    log_file.write(json.dumps({"sessionId": 1, "itemInSession": month, "ts": 1, "userId": ""}))
+            os.makedirs(os.path.join(directory, "song_data", "A"))
+            with open(os.path.join(directory, "song_data", "A", "song.json"), "w") as song_file:
+                song_file.write(json.dumps({"song_id": "S1", "year": 2009}))
+            con = external.connect_local({"staging_events": os.path.join(directory, "log_data"),
+                                          "staging_songs": os.path.join(directory, "song_data")})
+            rows = con.execute("SELECT itemInSession, userId FROM spectrum.log_events "
+                               "WHERE year = 2018 AND month = 11").fetchall()
+            self.assertEqual(rows, [(11, None)])
+            self.assertEqual(con.execute("SELECT song_id, year FROM spectrum.song_records").fetchall(),
+                             [("S1", 2009)])
+
+
+if __name__ == "__main__":
+    unittest.main()
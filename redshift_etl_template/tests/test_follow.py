@@ -0,0 +1,167 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import configparser
+
+from redshift_etl_template.src.follow import MicroBatcher, LocalSource, Follower
+from redshift_etl_template.src.backends import PostgresBackend
+from redshift_etl_template.src.aggregate_queries import aggregates
+from redshift_etl_template.src.sql_queries import staging_events_table_create, staging_songs_table_create, \
+    songplay_table_create, time_table_create
+from redshift_etl_template.tests import utils_tests
+
+EVENT_KEYS = ["artist", "auth", "firstName", "gender", "itemInSession", "lastName", "length", "level", "location",
+              "method", "page", "registration", "sessionId", "song", "status", "ts", "userAgent", "userId"]
+
+
+def make_files(sizes):
+    return [{"path": "file-{}.json".format(i), "size": size, "modified": 0.0} for i, size in enumerate(sizes)]
+
+
+class TestMicroBatcher(unittest.TestCase):
+    """Check the release of the batches and the bound of the queue.
+    Note: no aws infrastructure is needed"""
+
+    def test_released_by_size(self):
+        batcher = MicroBatcher(max_bytes=100, max_seconds=60)
+        batcher.offer(make_files([40, 40]), now=0)
+        self.assertFalse(batcher.is_ready(now=1))
+        batcher.offer(make_files([40]), now=1)
+        self.assertTrue(batcher.is_ready(now=1))
+        self.assertEqual([file["size"] for file in batcher.take()], [40, 40])
+        self.assertEqual(len(batcher.pending), 1)
+
+    def test_released_by_age(self):
+        batcher = MicroBatcher(max_bytes=100, max_seconds=60)
+        batcher.offer(make_files([10]), now=0)
+        self.assertFalse(batcher.is_ready(now=59))
+        self.assertTrue(batcher.is_ready(now=60))
+
+    def test_big_file_is_a_batch(self):
+        batcher = MicroBatcher(max_bytes=100)
+        batcher.offer(make_files([500, 10]), now=0)
+        self.assertEqual([file["size"] for file in batcher.take()], [500])
+
+    def test_requeue(self):
+        batcher = MicroBatcher(max_bytes=100)
+        batcher.offer(make_files([60, 60]), now=0)
+        batch = batcher.take()
+        batcher.requeue(batch)
+        self.assertEqual([file["path"] for file in batcher.pending], ["file-0.json", "file-1.json"])
+        self.assertEqual(batcher.pending[0]["queued"], 0)
+
+    def test_backpressure(self):
+        batcher = MicroBatcher(max_pending=3)
+        self.assertEqual(batcher.offer(make_files([1, 1]), now=0), 2)
+        self.assertEqual(batcher.offer(make_files([1, 1]), now=0), 1)
+        self.assertEqual(batcher.offer(make_files([1]), now=0), 0)
+
+
+class TestLocalSource(unittest.TestCase):
+    """Note: no aws infrastructure is needed"""
+
+    def test_list_json_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "2018", "11"))
+            for name in [os.path.join("2018", "11", "a.json"), "b.json", "c.txt"]:
+                with open(os.path.join(directory, name), "w") as source_file:
+                    source_file.write("{}")
+            files = LocalSource(directory).list_files()
+        self.assertEqual(sorted(os.path.basename(file["path"]) for file in files), ["a.json", "b.json"])
+        self.assertEqual(files[0]["size"], 2)
+
+
+@unittest.skipUnless(utils_tests.TEST_BACKEND == "postgres", "the batches are loaded from a local directory")
+class TestFollower(unittest.TestCase):
+    """Load batches of local event files, checking what is recorded when a batch fails.
+    Note: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        for query in [staging_events_table_create, staging_songs_table_create, songplay_table_create,
+                      time_table_create]:
+            self.cur.execute(query)
+        self.cur.execute("INSERT INTO staging_songs (song_id, artist_id, artist_name, title) "
+                         "VALUES ('SO1', 'AR1', 'Artist', 'Song');")
+        self.conn.commit()
+        self.dir = tempfile.mkdtemp()
+        path_jsonpaths = os.path.join(self.dir, "log_json_path.json")
+        with open(path_jsonpaths, "w") as jsonpaths_file:
+            json.dump({"jsonpaths": ["$['{}']".format(key) for key in EVENT_KEYS]}, jsonpaths_file)
+        config = configparser.ConfigParser()
+        config.read_dict(utils_tests.config)
+        config.read_dict({"LOCAL": {"log_jsonpath": path_jsonpaths}})
+        self.events_dir = os.path.join(self.dir, "log_data")
+        os.makedirs(self.events_dir)
+        self.follower = Follower(PostgresBackend(self.conn, config), self.cur, self.conn,
+                                 LocalSource(self.events_dir), MicroBatcher())
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+        shutil.rmtree(self.dir)
+
+    def write_events(self, name, item_in_session, user_id=1):
+        event = {"artist": "Artist", "auth": "Logged In", "firstName": "Name", "gender": "F",
+                 "itemInSession": item_in_session, "lastName": "Surname", "length": 200.5, "level": "free",
+                 "location": "Location", "method": "PUT", "page": "NextSong", "registration": 1540919166796.0,
+                 "sessionId": 1, "song": "Song", "status": 200, "ts": 1541105830796 + item_in_session,
+                 "userAgent": "Agent", "userId": user_id}
+        with open(os.path.join(self.events_dir, name), "w") as events_file:
+            json.dump(event, events_file)
+
+    def count(self, table):
+        self.cur.execute("SELECT COUNT(*) FROM {};".format(table))
+        return self.cur.fetchone()[0]
+
+    def test_load_batch(self):
+        self.write_events("a.json", 0)
+        self.write_events("b.json", 1)
+        self.assertEqual(self.follower.poll(now=0), 2)
+        # a file is not queued twice while its batch waits
+        self.assertEqual(self.follower.poll(now=0), 0)
+        metrics = self.follower.load_batch(self.follower.batcher.take())
+        self.assertEqual((metrics["n_files"], metrics["n_events"], metrics["n_songplays"]), (2, 2, 2))
+        self.assertEqual(self.count("songplays"), 2)
+        self.assertEqual(self.count("follow_files"), 2)
+        self.assertEqual(self.follower.poll(now=1), 0)
+        for table in aggregates:
+            self.cur.execute("SELECT SUM(plays) FROM {};".format(table))
+            self.assertEqual(self.cur.fetchone()[0], 2)
+
+    def test_loaded_events_are_skipped(self):
+        self.write_events("a.json", 0)
+        self.follower.poll(now=0)
+        self.follower.load_batch(self.follower.batcher.take())
+        # a sample run reloads the staging tables, the event is replayed in another file
+        self.cur.execute("DELETE FROM staging_events;")
+        self.conn.commit()
+        self.write_events("b.json", 0)
+        self.follower.poll(now=1)
+        metrics = self.follower.load_batch(self.follower.batcher.take())
+        self.assertEqual((metrics["n_events"], metrics["n_songplays"]), (1, 0))
+        self.assertEqual(self.count("songplays"), 1)
+        self.assertEqual(self.count("time"), 1)
+
+    def test_failed_batch_is_queued_again(self):
+        self.write_events("a.json", 0)
+        self.write_events("b.json", 1, user_id="not a number")
+        self.follower.poll(now=0)
+        with self.assertRaises(Exception):
+            self.follower.load_batch(self.follower.batcher.take())
+        self.assertEqual(self.count("follow_files"), 0)
+        self.assertEqual(self.count("staging_events"), 0)
+        self.assertEqual(self.follower.known_files, set())
+        self.assertEqual(len(self.follower.batcher.pending), 2)
+        # once the file is fixed, the queued batch is loaded
+        self.write_events("b.json", 1)
+        self.assertEqual(self.follower.poll(now=1), 0)
+        metrics = self.follower.load_batch(self.follower.batcher.take())
+        self.assertEqual(metrics["n_songplays"], 2)
+        self.assertEqual(self.count("follow_files"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
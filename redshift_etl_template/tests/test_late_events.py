@@ -0,0 +1,84 @@
+import os
+import unittest
+
+from redshift_etl_template.constants import DIR_DATA_TEST, logging
+from redshift_etl_template.src import sql_queries
+from redshift_etl_template.src.late_events import reconcile_late_events
+from redshift_etl_template.src.aggregate_queries import aggregates
+from redshift_etl_template.tests import utils_tests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+VIZ = False
+
+
+class TestReconcileLateEvents(unittest.TestCase):
+    """Stage the events before their songs, and insert their songplays once the songs are staged.
+    Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
+    Note 2: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_events.csv"))
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, df_log, viz=VIZ)
+        self.cur.execute(sql_queries.staging_songs_table_create)
+        self.cur.execute(sql_queries.songplay_table_create)
+        self.conn.commit()
+        # the songs of the events are not loaded yet
+        self.assertEqual(reconcile_late_events(self.cur, self.conn), 0)
+        self.n_pending = self.count("pending_events")
+        self.assertGreater(self.n_pending, 0)
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def count(self, table):
+        self.cur.execute("SELECT COUNT(*) FROM {};".format(table))
+        return self.cur.fetchone()[0]
+
+    def get_plays(self, table):
+        self.cur.execute("SELECT COALESCE(SUM(plays), 0) FROM {};".format(table))
+        return self.cur.fetchone()[0]
+
+    def load_songs(self):
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_songs.csv"))
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(self.cur, df_songs, viz=VIZ)
+        self.conn.commit()
+
+    def test_match_and_merge(self):
+        self.load_songs()
+        n_late = reconcile_late_events(self.cur, self.conn)
+        self.assertGreater(n_late, 0)
+        self.assertEqual(self.count("songplays"), n_late)
+        self.assertLess(self.count("pending_events"), self.n_pending)
+        for table in aggregates:
+            self.assertEqual(self.get_plays(table), n_late)
+
+    def test_existing_songplays_are_not_merged_again(self):
+        self.cur.execute("CREATE TABLE pending_copy AS SELECT * FROM pending_events;")
+        self.conn.commit()
+        self.load_songs()
+        n_late = reconcile_late_events(self.cur, self.conn)
+        # the same events wait again, their songplays are already inserted
+        self.cur.execute("INSERT INTO pending_events SELECT * FROM pending_copy;")
+        self.conn.commit()
+        self.assertEqual(reconcile_late_events(self.cur, self.conn), 0)
+        self.assertEqual(self.count("songplays"), n_late)
+        for table in aggregates:
+            self.assertEqual(self.get_plays(table), n_late)
+
+    def test_expire(self):
+        self.cur.execute("UPDATE pending_events SET first_seen = first_seen - INTERVAL '10 days';")
+        # the next run stages other events
+        self.cur.execute("DELETE FROM staging_events;")
+        self.conn.commit()
+        self.assertEqual(reconcile_late_events(self.cur, self.conn, window_days=30), 0)
+        self.assertEqual(self.count("pending_events"), self.n_pending)
+        self.assertEqual(reconcile_late_events(self.cur, self.conn, window_days=7), 0)
+        self.assertEqual(self.count("pending_events"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
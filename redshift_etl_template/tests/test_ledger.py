@@ -0,0 +1,122 @@
+import os
+import unittest
+import pandas as pd
+
+from redshift_etl_template.constants import DIR_DATA_TEST, logging
+from redshift_etl_template.src import sql_queries
+from redshift_etl_template.src.ledger import RunLedger
+from redshift_etl_template.src.aggregates import execute_refresh
+from redshift_etl_template.src.aggregate_queries import aggregates
+from redshift_etl_template.tests import utils_tests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+VIZ = False
+RUN_ID = "test-run"
+
+
+class TestRunLedger(unittest.TestCase):
+    """Run stages through the ledger, skipping, retrying and resuming them.
+    Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
+    Note 2: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        self.cur.execute("CREATE TABLE loaded (stage VARCHAR);")
+        self.conn.commit()
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def get_ledger(self, max_retries=1):
+        return RunLedger(self.cur, self.conn, RUN_ID, max_retries, backoff=0.0)
+
+    def get_loaded(self):
+        self.cur.execute("SELECT stage FROM loaded ORDER BY stage;")
+        return [row[0] for row in self.cur.fetchall()]
+
+    def get_attempts(self, stage):
+        self.cur.execute("SELECT attempt, status FROM etl_run_ledger WHERE run_id = %s AND stage = %s "
+                         "ORDER BY attempt;", (RUN_ID, stage))
+        return self.cur.fetchall()
+
+    def test_skip_completed(self):
+        stages = [(stage, ["INSERT INTO loaded VALUES ('{}');".format(stage)]) for stage in ["a", "b"]]
+        self.get_ledger().run_stages(stages)
+        self.get_ledger().run_stages(stages)
+        self.assertEqual(self.get_loaded(), ["a", "b"])
+        self.assertEqual(self.get_attempts("a"), [(1, "completed")])
+
+    def test_retry(self):
+        calls = []
+
+        def flaky_stage(cur):
+            calls.append(len(calls))
+            cur.execute("INSERT INTO loaded VALUES ('a');")
+            if len(calls) == 1:
+                raise Exception("transient failure")
+            return 1
+
+        self.get_ledger(max_retries=2).run_stages([("a", flaky_stage)])
+        # the insert of the failed attempt is rolled back with it
+        self.assertEqual(self.get_loaded(), ["a"])
+        self.assertEqual(self.get_attempts("a"), [(1, "failed"), (2, "completed")])
+
+    def test_resume_after_failure(self):
+        stages = [("a", ["INSERT INTO loaded VALUES ('a');"]),
+                  ("b", ["INSERT INTO missing VALUES ('b');"])]
+        with self.assertRaises(Exception):
+            self.get_ledger().run_stages(stages)
+        # a process killed during its second attempt leaves it running
+        self.cur.execute("INSERT INTO etl_run_ledger (run_id, stage, attempt, status, started_at) "
+                         "VALUES (%s, 'b', 2, 'running', GETDATE());", (RUN_ID,))
+        self.cur.execute("CREATE TABLE missing (stage VARCHAR);")
+        self.conn.commit()
+        self.get_ledger().run_stages(stages)
+        self.assertEqual(self.get_loaded(), ["a"])
+        self.assertEqual(self.get_attempts("a"), [(1, "completed")])
+        self.assertEqual(self.get_attempts("b"), [(1, "failed"), (2, "running"), (3, "completed")])
+
+
+class TestResumeAggregates(unittest.TestCase):
+    """Resume a run whose aggregate refresh was completed, checking that the songplays are summed once.
+    Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
+    Note 2: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+        df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_events.csv"))
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_songs.csv"))
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, df_log, viz=VIZ)
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(self.cur, df_songs, viz=VIZ)
+        self.cur.execute(sql_queries.songplay_table_create)
+        self.conn.commit()
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def test_resume_after_refresh(self):
+        stages = [("insert_songplays", sql_queries.songplays_delta_queries + [sql_queries.songplay_table_insert]),
+                  ("refresh_aggregates", execute_refresh),
+                  ("reconcile_late_events", ["SELECT COUNT(*) FROM missing;"])]
+        with self.assertRaises(Exception):
+            RunLedger(self.cur, self.conn, RUN_ID, max_retries=1, backoff=0.0).run_stages(stages)
+        self.cur.execute("CREATE TABLE missing (id INT);")
+        self.conn.commit()
+        RunLedger(self.cur, self.conn, RUN_ID, max_retries=1, backoff=0.0).run_stages(stages)
+        self.cur.execute("SELECT COUNT(*) FROM songplays;")
+        n_songplays = self.cur.fetchone()[0]
+        self.assertGreater(n_songplays, 0)
+        for table in aggregates:
+            self.cur.execute("SELECT SUM(plays) FROM {};".format(table))
+            self.assertEqual(self.cur.fetchone()[0], n_songplays)
+        self.cur.execute("SELECT stage, n_rows FROM etl_run_ledger WHERE status = 'completed' ORDER BY stage;")
+        df_ledger = pd.DataFrame(self.cur.fetchall(), columns=["stage", "n_rows"]).set_index("stage")
+        self.assertEqual(df_ledger.loc["refresh_aggregates", "n_rows"], n_songplays)
+
+
+if __name__ == "__main__":
+    unittest.main()
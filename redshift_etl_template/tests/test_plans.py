@@ -0,0 +1,98 @@
+import os
+import unittest
+
+from redshift_etl_template.src import plans
+from redshift_etl_template.tests import utils_tests
+
+redshift_plan = [
+    "XN Hash Join DS_DIST_NONE  (cost=47.08..2550414.61 rows=1 width=190)",
+    "  Hash Cond: ((\"outer\".artist_name)::text = (\"inner\".artist)::text)",
+    "  ->  XN Seq Scan on staging_songs s  (cost=0.00..148.32 rows=14831 width=90)",
+    "  ->  XN Hash  (cost=45.84..45.84 rows=496 width=196)",
+    "        ->  XN Seq Scan on staging_events e  (cost=0.00..45.84 rows=496 width=196)",
+    "              Filter: ((page)::text = 'NextSong'::text)",
+    "----- Tables missing statistics: staging_events -----"
+]
+
+
+class TestPlans(unittest.TestCase):
+    """Check the normalization and the comparison of the plans.
+    Note: no aws infrastructure is needed"""
+
+    def test_normalize_redshift_plan(self):
+        plan = plans.normalize_plan(redshift_plan)
+        self.assertEqual(plan["nodes"], ["Hash Join DS_DIST_NONE", "Seq Scan on staging_songs", "Hash",
+                                         "Seq Scan on staging_events"])
+        self.assertEqual(plan["joins"], ["Hash Join"])
+        self.assertEqual(plan["redistribution"], ["DS_DIST_NONE"])
+        self.assertEqual(plan["cost"], 2550414.61)
+
+    def test_broadcast_is_a_regression(self):
+        baseline = plans.normalize_plan(redshift_plan)
+        plan = plans.normalize_plan([redshift_plan[0].replace("DS_DIST_NONE", "DS_BCAST_INNER")] + redshift_plan[1:])
+        regressions, _ = plans.compare_plans(baseline, plan)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("DS_BCAST_INNER", regressions[0])
+        regressions, _ = plans.compare_plans(plan, baseline)
+        self.assertEqual(regressions, [])
+
+    def test_nested_loop_and_cost_are_regressions(self):
+        baseline = plans.normalize_plan(redshift_plan)
+        plan = plans.normalize_plan(["XN Nested Loop DS_DIST_NONE  (cost=0.00..99999999.99 rows=1 width=190)"] +
+                                    redshift_plan[1:])
+        regressions, _ = plans.compare_plans(baseline, plan)
+        self.assertEqual(len(regressions), 2)
+        _, changes = plans.compare_plans(baseline, dict(baseline, nodes=baseline["nodes"][:-1]))
+        self.assertEqual(len(changes), 1)
+
+    def test_rules_hold_whatever_the_baseline(self):
+        loop = plans.normalize_plan(["XN Nested Loop DS_DIST_NONE  (cost=0.00..99999999.99 rows=1 width=190)"] +
+                                    redshift_plan[1:])
+        regressions, _ = plans.compare_plans(loop, loop)
+        self.assertEqual(regressions, [])
+        self.assertEqual(len(plans.check_rules("delta_songplays", loop)), 1)
+        broadcast = plans.normalize_plan([redshift_plan[0].replace("DS_DIST_NONE", "DS_BCAST_INNER")] +
+                                         redshift_plan[1:])
+        self.assertEqual(len(plans.check_rules("delta_songplays", broadcast)), 1)
+        self.assertEqual(plans.check_rules("delta_songplays", plans.normalize_plan(redshift_plan)), [])
+        self.assertEqual(plans.check_rules("insert_songplays", loop), [])
+
+    def test_changed_statement_has_no_recorded_plan(self):
+        recorded = {"insert_users": {"statement_hash": plans.statement_hash("SELECT 1;"), "plan": ["Result"]}}
+        cur = plans.RecordedPlanCursor(recorded)
+        self.assertEqual(plans.explain(cur, "SELECT   1"), ["Result"])
+        with self.assertRaises(Exception):
+            plans.explain(cur, "SELECT 2")
+
+    def test_recorded_plans_match_baselines(self):
+        for backend in ["redshift", "postgres"]:
+            recorded_path = os.path.join(plans.DIR_PLANS, "recorded_{}.json".format(backend))
+            cur = plans.RecordedPlanCursor(plans.load_plans(recorded_path))
+            baselines = plans.load_plans(os.path.join(plans.DIR_PLANS, "baseline_{}.json".format(backend)))
+            results = plans.check_plans(cur, baselines)
+            self.assertEqual({name: regressions for name, (regressions, _) in results.items() if regressions}, {})
+
+
+@unittest.skipUnless(utils_tests.TEST_BACKEND == "postgres", "the plans are explained on the local database")
+class TestFixturePlans(unittest.TestCase):
+    """Explain the statements on the loaded fixtures and check them against the postgres baseline.
+    Note: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def test_fixture_plans_match_baseline(self):
+        plans.load_fixtures(self.cur, self.conn)
+        baselines = plans.load_plans(os.path.join(plans.DIR_PLANS, "baseline_postgres.json"))
+        results = plans.check_plans(self.cur, baselines)
+        self.assertEqual({name: regressions for name, (regressions, _) in results.items() if regressions}, {})
+        plan = plans.normalize_plan(plans.explain(self.cur, plans.plan_statements["delta_songplays"]))
+        self.assertIn("Hash Join", plan["joins"])
+
+
+if __name__ == "__main__":
+    unittest.main()
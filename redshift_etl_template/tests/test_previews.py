@@ -0,0 +1,86 @@
+import time
+import unittest
+
+from redshift_etl_template.src.previews import preview_tables
+
+
+class FakeCursor:
+    """Return two typed rows for the previews and sleep on the slow tables"""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.description = None
+        self.result = []
+
+    def execute(self, query):
+        if query.startswith("SET"):
+            return
+        table = query.split("FROM ")[1].split()[0].rstrip(";")
+        if table == "broken":
+            raise Exception("canceling statement due to statement timeout")
+        time.sleep(self.delays.get(table, 0))
+        if query.startswith("SELECT COUNT"):
+            self.description = [("count", 20)]
+            self.result = [(2,)]
+        else:
+            self.description = [("user_id", 23), ("level", 1043)]
+            self.result = [(1, "free"), (None, "paid")]
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0]
+
+
+class FakeConnection:
+    def __init__(self, delays):
+        self.delays = delays
+
+    def cursor(self):
+        return FakeCursor(self.delays)
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, delays):
+        self.delays = delays
+        self.n_out = 0
+        self.max_out = 0
+
+    def getconn(self):
+        self.n_out += 1
+        self.max_out = max(self.max_out, self.n_out)
+        return FakeConnection(self.delays)
+
+    def putconn(self, conn):
+        self.n_out -= 1
+
+
+class TestPreviewTables(unittest.TestCase):
+    """Check that the previews are streamed in completion order, typed and isolated on failure.
+    Note: no aws infrastructure is needed"""
+
+    def test_streaming_order(self):
+        pool = FakePool({"slow": 0.3})
+        results = list(preview_tables(pool, ["slow", "fast"], max_workers=2))
+        self.assertEqual([result["table"] for result in results], ["fast", "slow"])
+        self.assertEqual(pool.max_out, 2)
+        self.assertEqual(pool.n_out, 0)
+
+    def test_typed_columns(self):
+        result = next(preview_tables(FakePool({}), ["users"]))
+        self.assertEqual(str(result["df"]["user_id"].dtype), "Int32")
+        self.assertEqual(str(result["df"]["level"].dtype), "string")
+        self.assertEqual(result["n_rows"], 2)
+
+    def test_failure_is_isolated(self):
+        results = {result["table"]: result for result in preview_tables(FakePool({}), ["broken", "users"])}
+        self.assertIn("timeout", results["broken"]["error"])
+        self.assertIsNone(results["users"]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import unittest
+
+from redshift_etl_template.constants import DIR_DATA_TEST, logging
+from redshift_etl_template.src import profiling
+from redshift_etl_template.tests import utils_tests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+VIZ = False
+
+
+class TestProfileQuery(unittest.TestCase):
+    """Check that the profile of a table is read with a single query.
+    Note: no aws infrastructure is needed"""
+
+    def test_single_query(self):
+        columns = [("song_id", False), ("year", True)]
+        query = profiling.profile_query("staging_songs", columns, (0.5, 0.9))
+        self.assertEqual(query.count("SELECT"), 1)
+        self.assertIn('APPROXIMATE COUNT(DISTINCT song_id) AS "song_id"', query)
+        self.assertIn('APPROXIMATE PERCENTILE_DISC(0.9) WITHIN GROUP (ORDER BY year) AS "year_p90"', query)
+        self.assertNotIn("ORDER BY song_id", query)
+
+    def test_local_query(self):
+        query = profiling.profile_query("staging_songs", [("year", True)], redshift=False, sample_percent=50)
+        self.assertNotIn("APPROXIMATE", query)
+        self.assertTrue(query.endswith("FROM staging_songs TABLESAMPLE SYSTEM (50);"))
+
+
+class TestProfileTable(unittest.TestCase):
+    """Profile the staged songs.
+    Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
+    Note 2: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def test_profile(self):
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songs_staging_songs.csv"))
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(self.cur, df_songs, viz=VIZ)
+        # the whole table is sampled, the tiny fixture fits in a single block
+        df_profile = profiling.profile_table(self.cur, "staging_songs", (0.5, 1),
+                                             profiling.is_redshift(self.cur), sample_percent=100)
+        self.assertEqual(list(df_profile.columns), ["column", "approx_distinct", "p50", "p100"])
+        df_profile = df_profile.set_index("column")
+        self.assertEqual(df_profile.loc["song_id", "approx_distinct"], 6)
+        self.assertEqual(df_profile.loc["year", "approx_distinct"], 3)
+        self.assertEqual(df_profile.loc["year", "p50"], 2009)
+        self.assertEqual(df_profile.loc["year", "p100"], 2010)
+        self.assertAlmostEqual(df_profile.loc["duration", "p100"], 223.9424)
+        self.assertTrue(df_profile.loc[["song_id", "title"], "p50"].isna().all())
+
+
+if __name__ == "__main__":
+    unittest.main()
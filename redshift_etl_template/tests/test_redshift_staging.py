@@ -2,7 +2,6 @@ import os
 import boto3
 import configparser
 import unittest
-import psycopg2
 
 from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, logging
 from redshift_etl_template.scripts import create_tables
@@ -14,6 +13,7 @@ logger.setLevel(logging.DEBUG)
 VIZ = False
 
 
+@unittest.skipUnless(utils_tests.TEST_BACKEND == "redshift", "COPY from s3 needs a redshift cluster")
 class TestStagingInsertion(unittest.TestCase):
     """Sample data from s3 and store them into memory.
     Then, perform insertion into Redshift database.
@@ -33,17 +33,14 @@ class TestStagingInsertion(unittest.TestCase):
             aws_access_key_id=KEY,
             aws_secret_access_key=SECRET
         )
-        logger.info("Connecting to the database..")
-        self.conn = psycopg2.connect(
-            "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-        self.cur = self.conn.cursor()
+        logger.info("Connecting to the database, in a schema of this test..")
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
 
         logger.info("Creating the tables..")
-        create_tables.drop_tables(self.cur, self.conn)
         create_tables.create_tables(self.cur, self.conn)
 
     def tearDown(self):
-        self.cur.close()
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
 
     def test_staging_log_parallel(self):
         logger.info("Processing sampled staged events data")
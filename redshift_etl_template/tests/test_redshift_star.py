@@ -1,12 +1,11 @@
 import os
 import unittest
-import configparser
-import psycopg2
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
-from redshift_etl_template.constants import CONFIG_PATH_DWH_CURRENT, DIR_DATA_TEST, logging
-from redshift_etl_template.scripts import create_tables
+from redshift_etl_template.constants import DIR_DATA_TEST, logging
+from redshift_etl_template.scripts import etl, create_tables
+from redshift_etl_template.src import sql_queries
 from redshift_etl_template.tests import utils_tests
 
 logger = logging.getLogger(__name__)
@@ -23,19 +22,15 @@ class TestStarInsertion(unittest.TestCase):
     Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
     Note 2: do not forget to destroy the infrastructure
     if you do not need it anymore ( script/destroy_infrastructure.py )
+    Note 3: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
     """
 
     def setUp(self):
-        logger.info("Connecting to the database..")
-        config = configparser.ConfigParser()
-        config.read(CONFIG_PATH_DWH_CURRENT)
-        self.conn = psycopg2.connect(
-            "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-        self.cur = self.conn.cursor()
+        logger.info("Connecting to the database, in a schema of this test..")
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
 
     def tearDown(self):
-        create_tables.drop_tables(self.cur, self.conn)
-        self.cur.close()
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
 
     def test_users(self):
         logger.info("Filling staging events to test users table")
@@ -48,6 +43,38 @@ class TestStarInsertion(unittest.TestCase):
         df_target.iloc[:, 0] = df_target.iloc[:, 0].astype(int)
         assert_frame_equal(df_users, df_target)
 
+    def test_users_history(self):
+        logger.info("Filling two windows of staging events to test the versions of the users")
+        df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_user_staging_events.csv"))
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, df_log, viz=VIZ)
+        df_users = utils_tests.create_and_fill_users_from_staged_events(self.cur, viz=VIZ)
+        logger.info("Replaying the first window..")
+        etl.update_users_history(self.cur, self.conn)
+        etl.insert_tables(self.cur, self.conn, queries=[sql_queries.user_table_insert])
+        df_history = utils_tests.get_users_history(self.cur)
+        self.assertEqual(len(df_history), 7)
+        self.assertEqual(df_history[df_history.user_id == 1]["level"].tolist(), ["free", "paid"])
+        self.assertEqual(df_history[df_history.user_id == 1]["is_current"].tolist(), [False, True])
+        logger.info("Filling the next window..")
+        df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_user_staging_events_next.csv"))
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, df_log, viz=VIZ)
+        etl.update_users_history(self.cur, self.conn)
+        etl.insert_tables(self.cur, self.conn, queries=[sql_queries.user_table_insert])
+        df_history = utils_tests.get_users_history(self.cur)
+        self.assertEqual(df_history[df_history.user_id == 1]["level"].tolist(), ["free", "paid", "free"])
+        self.assertEqual(df_history[df_history.user_id == 1]["is_current"].tolist(), [False, False, True])
+        self.assertEqual(df_history[df_history.user_id == 6]["level"].tolist(), ["free", "paid"])
+        self.assertEqual(len(df_history[df_history.user_id.isin([0, 2])]), 2)
+        self.assertTrue(df_history[df_history.is_current]["valid_to"].isnull().all())
+        self.assertTrue(df_history[~df_history.is_current]["valid_to"].notnull().all())
+        self.cur.execute("SELECT user_id, level FROM users ORDER BY user_id;")
+        self.assertEqual(self.cur.fetchall(), [(0, "free"), (1, "free"), (2, "free"), (3, "paid"), (4, "free"),
+                                               (5, "free"), (6, "paid")])
+        logger.info("Resetting the tables..")
+        create_tables.drop_tables(self.cur, self.conn)
+        create_tables.create_tables(self.cur, self.conn)
+        self.assertEqual(len(utils_tests.get_users_history(self.cur)), 0)
+
     def test_time(self):
         logger.info("Filling staging events to test time table")
         df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_time_staging_events.csv"))
@@ -91,7 +118,56 @@ class TestStarInsertion(unittest.TestCase):
         logger.info("Comparing with expected results..")
         df_target = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_target.csv"))
         df_target.iloc[:, 1] = df_target.iloc[:, 1].astype('datetime64[ns]')
-        assert_frame_equal(df_songsplay.iloc[:, 1:], df_target.iloc[:, 1:])  # ignore unreliable seed step
+        assert_frame_equal(df_songsplay, df_target)  # songplay_id is the hash of the event key
+
+
+    def test_songsplay_replayed_events(self):
+        logger.info("Filling staging tables twice with the same events to test the staging dedupe")
+        df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_events.csv"))
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, pd.concat([df_log, df_log]),
+                                                                            viz=VIZ)
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_songs.csv"))
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(self.cur, df_songs, viz=VIZ)
+        etl.dedupe_staging_tables(self.cur, self.conn)
+        logger.info("Filling from staging tables...")
+        df_songsplay = utils_tests.create_and_fill_songplays_from_staged_data(self.cur, viz=VIZ)
+        logger.info("Comparing with expected results..")
+        df_target = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_target.csv"))
+        df_target.iloc[:, 1] = df_target.iloc[:, 1].astype('datetime64[ns]')
+        assert_frame_equal(df_songsplay, df_target)
+
+    def test_songsplay_ambiguous_songs(self):
+        logger.info("Filling staging tables with two songs for every artist and title")
+        df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_events.csv"))
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, df_log, viz=VIZ)
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_songs.csv"))
+        df_songs_other = df_songs.assign(song_id="X" + df_songs["song_id"])
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(
+            self.cur, pd.concat([df_songs, df_songs_other]), viz=VIZ)
+        logger.info("Filling from staging tables...")
+        df_songsplay = utils_tests.create_and_fill_songplays_from_staged_data(self.cur, viz=VIZ)
+        logger.info("Comparing with expected results, every event matches the first song..")
+        df_target = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_target.csv"))
+        df_target.iloc[:, 1] = df_target.iloc[:, 1].astype('datetime64[ns]')
+        assert_frame_equal(df_songsplay, df_target)
+
+    def test_songsplay_rerun(self):
+        logger.info("Loading the same staging tables twice to test the rerun of the songplays insert")
+        df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_events.csv"))
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, df_log, viz=VIZ)
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_songs.csv"))
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(self.cur, df_songs, viz=VIZ)
+        self.cur.execute(sql_queries.songplay_table_create)
+        queries = sql_queries.songplays_delta_queries + [sql_queries.songplay_table_insert]
+        etl.insert_tables(self.cur, self.conn, queries=queries)
+        self.cur.execute("SELECT COUNT(*) FROM songplays;")
+        n_songplays = self.cur.fetchone()[0]
+        self.assertGreater(n_songplays, 0)
+        etl.insert_tables(self.cur, self.conn, queries=queries)
+        self.cur.execute("SELECT COUNT(*) FROM songplays;")
+        self.assertEqual(self.cur.fetchone()[0], n_songplays)
+        self.cur.execute("SELECT COUNT(*) FROM songplays_delta;")
+        self.assertEqual(self.cur.fetchone()[0], 0)
 
 
 if __name__ == "__main__":
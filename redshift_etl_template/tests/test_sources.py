@@ -0,0 +1,38 @@
+import unittest
+
+from redshift_etl_template.src import sources
+
+
+class TestSampling(unittest.TestCase):
+    """Check the key-hash sampling of the source files.
+    Note: no aws infrastructure is needed"""
+
+    def setUp(self):
+        self.keys = ["song_data/A/B/C/TRABC{:05d}.json".format(i) for i in range(2000)]
+
+    def test_sample_is_deterministic(self):
+        self.assertEqual(sources.sample_keys(self.keys, 0.1), sources.sample_keys(self.keys, 0.1))
+
+    def test_sample_size(self):
+        n_sampled = len(sources.sample_keys(self.keys, 0.1))
+        self.assertTrue(150 < n_sampled < 250)
+        self.assertEqual(sources.sample_keys(self.keys, 1), self.keys)
+
+    def test_sample_is_nested(self):
+        small = set(sources.sample_keys(self.keys, 0.05))
+        large = set(sources.sample_keys(self.keys, 0.2))
+        self.assertTrue(small.issubset(large))
+
+    def test_invalid_fraction(self):
+        with self.assertRaises(ValueError):
+            sources.sample_keys(self.keys, 0)
+
+    def test_manifest(self):
+        self.assertEqual(sources.parse_s3_uri("s3://udacity-dend/song_data"), ("udacity-dend", "song_data"))
+        manifest = sources.build_manifest("udacity-dend", self.keys[:2])
+        self.assertEqual(manifest["entries"][0]["url"], "s3://udacity-dend/" + self.keys[0])
+        self.assertTrue(manifest["entries"][0]["mandatory"])
+
+
+if __name__ == "__main__":
+    unittest.main()
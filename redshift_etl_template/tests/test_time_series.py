@@ -0,0 +1,94 @@
+import os
+import datetime
+import unittest
+import pandas as pd
+
+from redshift_etl_template.constants import DIR_DATA_TEST, logging
+from redshift_etl_template.src import time_series, sql_queries
+from redshift_etl_template.src.backends import translate_to_postgres
+from redshift_etl_template.tests import utils_tests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+VIZ = False
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+
+class TestMonthStatements(unittest.TestCase):
+    """Check the statements of the monthly songplays tables.
+    Note: no aws infrastructure is needed"""
+
+    def test_month_bounds(self):
+        self.assertEqual(time_series.get_month_bounds(2018, 11),
+                         (datetime.date(2018, 11, 1), datetime.date(2018, 12, 1)))
+        self.assertEqual(time_series.get_month_bounds(2018, 12),
+                         (datetime.date(2018, 12, 1), datetime.date(2019, 1, 1)))
+
+    def test_month_table_create(self):
+        query = time_series.build_month_table_create(2018, 11)
+        self.assertIn("CREATE TABLE IF NOT EXISTS songplays_2018_11 (", query)
+        self.assertIn("SORTKEY (start_time)", query)
+
+    def test_view_create(self):
+        query = time_series.build_view_create("public", [(2018, 11), (2018, 12)])
+        self.assertIn("FROM public.songplays_2018_11\nUNION ALL\nSELECT", query)
+        self.assertIn("FROM public.songplays_2018_12", query)
+        self.assertTrue(query.endswith("WITH NO SCHEMA BINDING;"))
+        self.assertNotIn("SCHEMA BINDING", translate_to_postgres(query))
+
+    def test_empty_view_create(self):
+        query = time_series.build_view_create(None, [])
+        self.assertIn("CAST(NULL AS BIGINT) AS songplay_id", query)
+        self.assertIn("CAST(NULL AS TIMESTAMP) AS start_time", query)
+        self.assertIn("WHERE 1 = 0", query)
+
+
+class TestMonthTables(unittest.TestCase):
+    """Fill songplays sliced by month from events of three months and drop the oldest one.
+    Note 1: Aws infrastructure has to be available at run time ( use script/create_infrastructure.py )
+    Note 2: with ETL_TEST_BACKEND=postgres, the tests run against the local database of the configuration
+    """
+
+    def setUp(self):
+        self.conn, self.cur, self.schema = utils_tests.connect_test_schema()
+
+    def tearDown(self):
+        utils_tests.drop_test_schema(self.conn, self.cur, self.schema)
+
+    def test_load_and_drop_months(self):
+        df_log = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_events.csv"))
+        df_log = pd.concat([df_log.assign(ts=df_log["ts"] + days * MS_PER_DAY) for days in [0, 31, 62]])
+        df_log_ins = utils_tests.create_and_fill_log_staging_from_dataframe(self.cur, df_log, viz=VIZ)
+        df_songs = utils_tests.read_test_csv(os.path.join(DIR_DATA_TEST, "df_songplays_staging_songs.csv"))
+        df_songs_ins = utils_tests.create_and_fill_songs_staging_from_dataframe(self.cur, df_songs, viz=VIZ)
+        self.cur.execute(time_series.build_view_create(None, []))
+        for query in sql_queries.songplays_delta_queries:
+            self.cur.execute(query)
+        self.conn.commit()
+        self.assertTrue(time_series.is_sliced(self.cur))
+
+        months = time_series.load_months(self.cur, self.conn)
+        self.assertEqual(months, [(2018, 11), (2018, 12), (2019, 1)])
+        self.assertEqual(time_series.get_months(self.cur), months)
+        self.cur.execute("SELECT COUNT(*) FROM songplays;")
+        self.assertEqual(self.cur.fetchone()[0], 3)
+        # a rerun with the same songplays_delta, e.g. a resumed run, does not insert them twice
+        self.assertEqual(time_series.load_months(self.cur, self.conn), months)
+        self.cur.execute("SELECT COUNT(*) FROM songplays;")
+        self.assertEqual(self.cur.fetchone()[0], 3)
+        if utils_tests.TEST_BACKEND == "postgres":
+            self.cur.execute("EXPLAIN SELECT COUNT(*) FROM songplays WHERE start_time >= '2019-01-01';")
+            plan = "\n".join(row[0] for row in self.cur.fetchall())
+            self.assertIn("songplays_2019_01", plan)
+            self.assertNotIn("songplays_2018_11", plan)
+
+        dropped = time_series.drop_old_months(self.cur, self.conn, 2)
+        self.assertEqual(dropped, [(2018, 11)])
+        self.assertEqual(time_series.get_months(self.cur), [(2018, 12), (2019, 1)])
+        self.cur.execute("SELECT COUNT(*) FROM songplays;")
+        self.assertEqual(self.cur.fetchone()[0], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+from redshift_etl_template.src.transactions import TransactionRunner
+from redshift_etl_template.scripts import etl
+
+
+class FakeConnection:
+    def __init__(self):
+        self.n_commits = 0
+        self.n_rollbacks = 0
+
+    def commit(self):
+        self.n_commits += 1
+
+    def rollback(self):
+        self.n_rollbacks += 1
+
+
+class FakeCursor:
+    def __init__(self, failing_query=None):
+        self.failing_query = failing_query
+        self.queries = []
+
+    def execute(self, query):
+        if query == self.failing_query:
+            raise Exception("failed {}".format(query))
+        self.queries.append(query)
+
+
+class TestTransactionRunner(unittest.TestCase):
+    """Check the number of commits issued by every policy.
+    Note: no aws infrastructure is needed"""
+
+    def run_policy(self, policy):
+        cur, conn = FakeCursor(), FakeConnection()
+        runner = TransactionRunner(cur, conn, policy)
+        runner.execute_group(["DROP a", "DROP b"])
+        runner.execute_group(["CREATE a", "CREATE b", "CREATE c"])
+        return conn, runner.finish()
+
+    def test_statement_policy(self):
+        conn, stats = self.run_policy("statement")
+        self.assertEqual(conn.n_commits, 5)
+        self.assertEqual(stats["commits"], 5)
+
+    def test_group_policy(self):
+        conn, stats = self.run_policy("group")
+        self.assertEqual(conn.n_commits, 2)
+        self.assertEqual(stats["statements"], 5)
+
+    def test_run_policy(self):
+        conn, stats = self.run_policy("run")
+        self.assertEqual(conn.n_commits, 1)
+
+    def test_rollback_on_failure(self):
+        cur, conn = FakeCursor(failing_query="CREATE b"), FakeConnection()
+        runner = TransactionRunner(cur, conn, "group")
+        with self.assertRaises(Exception):
+            runner.execute_group(["CREATE a", "CREATE b"])
+        self.assertEqual(conn.n_commits, 0)
+        self.assertEqual(conn.n_rollbacks, 1)
+
+    def test_atomic_group(self):
+        cur, conn = FakeCursor(), FakeConnection()
+        runner = TransactionRunner(cur, conn, "statement")
+        runner.execute_atomic(["DELETE a", "INSERT a"])
+        self.assertEqual(conn.n_commits, 1)
+        cur, conn = FakeCursor(), FakeConnection()
+        runner = TransactionRunner(cur, conn, "run")
+        runner.execute_atomic(["DELETE a", "INSERT a"])
+        self.assertEqual(conn.n_commits, 0)
+        runner.finish()
+        self.assertEqual(conn.n_commits, 1)
+
+    def test_atomic_group_rollback(self):
+        cur, conn = FakeCursor(failing_query="INSERT a"), FakeConnection()
+        runner = TransactionRunner(cur, conn, "statement")
+        with self.assertRaises(Exception):
+            runner.execute_atomic(["DELETE a", "INSERT a"])
+        self.assertEqual(conn.n_commits, 0)
+        self.assertEqual(conn.n_rollbacks, 1)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            TransactionRunner(FakeCursor(), FakeConnection(), "never")
+
+    def test_parallel_has_no_policy(self):
+        self.assertEqual(etl.parse_input([]).commit_policy, "statement")
+        self.assertEqual(etl.parse_input(["--parallel"]).commit_policy, "statement")
+        with self.assertRaises(SystemExit):
+            etl.parse_input(["--parallel", "--commit_policy", "run"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import datetime
+import unittest
+import pandas as pd
+
+from redshift_etl_template.src import utils
+
+
+class FakeCursor:
+    def __init__(self, rows, description):
+        self.rows = rows
+        self.description = description
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestCompactDataFrames(unittest.TestCase):
+    """Check the dtypes of the frames built from query results.
+    Note: no aws infrastructure is needed"""
+
+    def setUp(self):
+        self.description = [("user_id", 23), ("level", 1043), ("first_name", 1043), ("start_time", 1114),
+                            ("songplay_id", 20)]
+        self.rows = [(i, "free" if i % 3 else "paid", "name{}".format(i), datetime.datetime(2018, 11, 1), 2 ** 40 + i)
+                     for i in range(1000)]
+
+    def test_compact_dtypes(self):
+        df = utils.get_typed_dataframe(self.rows, self.description, compact=True)
+        self.assertEqual(list(df.columns), ["user_id", "level", "first_name", "start_time", "songplay_id"])
+        self.assertEqual(str(df["user_id"].dtype), "Int16")
+        self.assertEqual(str(df["songplay_id"].dtype), "Int64")
+        self.assertEqual(str(df["level"].dtype), "category")
+        self.assertEqual(df["first_name"].dtype, pd.StringDtype("pyarrow"))
+        self.assertEqual(str(df["start_time"].dtype), "datetime64[ns]")
+        self.assertEqual(df["level"].tolist()[:3], ["paid", "free", "free"])
+
+    def test_compact_frame_is_smaller(self):
+        cur = FakeCursor(self.rows, self.description)
+        df = utils.get_res_as_dataframe(cur)
+        df_plain = utils.get_res_as_dataframe(cur, compact=False)
+        self.assertEqual(df.astype(object).values.tolist(), df_plain.astype(object).values.tolist())
+        self.assertLess(utils.report_memory_usage(df, "compact"), utils.report_memory_usage(df_plain, "plain"))
+
+    def test_nulls_and_empty_results(self):
+        df = utils.get_typed_dataframe([(None, None), (3, "a")], [("user_id", 23), ("level", 1043)], compact=True)
+        self.assertEqual(str(df["user_id"].dtype), "Int8")
+        self.assertTrue(df["user_id"].isna().iloc[0])
+        self.assertTrue(df["level"].isna().iloc[0])
+        df = utils.get_typed_dataframe([], self.description, compact=True)
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), [desc[0] for desc in self.description])
+
+    def test_top_elements(self):
+        cur = FakeCursor(self.rows[:5], self.description)
+        df = utils.get_top_elements_from_table(cur, "songplays", 5)
+        self.assertEqual(cur.queries, ["SELECT * FROM songplays LIMIT 5;"])
+        self.assertEqual(len(df), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
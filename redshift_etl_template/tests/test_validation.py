@@ -0,0 +1,58 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from redshift_etl_template.src import validation
+from redshift_etl_template.src.sql_queries import staging_events_table_create, staging_songs_table_create
+
+
+class TestJsonValidation(unittest.TestCase):
+    """Check the local validation of the json sources against the staging tables.
+    Note: no aws infrastructure is needed"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.schema = validation.parse_table_schema(staging_events_table_create)
+        self.keys = validation.parse_jsonpaths(
+            {"jsonpaths": ["$['{}']".format(column) for column, _, _ in self.schema]})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_records(self, name, records):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as json_file:
+            json_file.write("\n".join(json.dumps(record) for record in records))
+        return path
+
+    def test_schema(self):
+        self.assertEqual(len(self.schema), 18)
+        self.assertEqual(self.schema[15], ("ts", "BIGINT", 256))
+        songs_schema = validation.parse_table_schema(staging_songs_table_create)
+        self.assertEqual(songs_schema[0], ("artist_id", "VARCHAR", 256))
+
+    def test_valid_file(self):
+        path = self.write_records("valid.json", [
+            {"artist": "Adelitas Way", "ts": 1541105830796, "userId": "39", "sessionId": 38},
+            {"artist": None, "ts": 1541105830797, "userId": "", "sessionId": 38}
+        ])
+        report = validation.validate_file(path, self.schema, self.keys)
+        self.assertEqual((report["n_rows"], report["n_bad_rows"]), (2, 0))
+        self.assertEqual(report["table"]["userId"].to_pylist(), [39, None])
+
+    def test_bad_rows(self):
+        path = self.write_records("bad.json", [
+            {"artist": "A" * 300, "ts": 1541105830796, "userId": 39},
+            {"artist": "Adelitas Way", "ts": 1541105830796, "userId": "guest"},
+            {"artist": "Adelitas Way", "ts": 1541105830796, "userId": 40}
+        ])
+        report = validation.validate_file(path, self.schema, self.keys)
+        self.assertEqual(report["n_bad_rows"], 2)
+        self.assertEqual([(error["line"], error["column"]) for error in report["errors"]],
+                         [(1, "artist"), (2, "userId")])
+
+
+if __name__ == "__main__":
+    unittest.main()
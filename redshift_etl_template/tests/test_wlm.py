@@ -0,0 +1,75 @@
+import threading
+import unittest
+
+from redshift_etl_template.src.wlm import FakeWlmCatalog, WlmScheduler, AUTO_WLM_SLOTS
+
+
+class FakeConnection:
+    """Connection recording the statements running at the same time"""
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        with self.tracker["lock"]:
+            self.tracker["running"] += 1
+            self.tracker["max_running"] = max(self.tracker["max_running"], self.tracker["running"])
+        threading.Event().wait(0.01)
+        with self.tracker["lock"]:
+            self.tracker["running"] -= 1
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestWlmScheduler(unittest.TestCase):
+    """Check the scheduling policy against a fake wlm catalog.
+    Note: no aws infrastructure is needed"""
+
+    def setUp(self):
+        self.tracker = {"lock": threading.Lock(), "running": 0, "max_running": 0}
+
+    def connect(self):
+        return FakeConnection(self.tracker)
+
+    def test_slots_are_not_exceeded(self):
+        scheduler = WlmScheduler(FakeWlmCatalog(slots=3))
+        durations = scheduler.run(self.connect, [("INSERT", False)] * 12)
+        self.assertEqual(len(durations), 12)
+        self.assertLessEqual(self.tracker["max_running"], 3)
+
+    def test_heavy_statements_take_more_slots(self):
+        scheduler = WlmScheduler(FakeWlmCatalog(slots=4), heavy_slots=2)
+        self.assertEqual(scheduler.get_slot_count(True), 2)
+        scheduler.run(self.connect, [("JOIN", True)] * 6)
+        self.assertLessEqual(self.tracker["max_running"], 2)
+
+    def test_capacity_adapts_to_queue_wait(self):
+        scheduler = WlmScheduler(FakeWlmCatalog(slots=5, queue_waits=[3.0, 3.0, 0.0]), max_queue_wait=1.0)
+        self.assertEqual(scheduler.adapt_capacity(), 4)
+        self.assertEqual(scheduler.adapt_capacity(), 3)
+        self.assertEqual(scheduler.adapt_capacity(), 4)
+
+    def test_max_workers(self):
+        scheduler = WlmScheduler(FakeWlmCatalog(slots=8), max_workers=2)
+        scheduler.run(self.connect, [("INSERT", False)] * 6)
+        self.assertLessEqual(self.tracker["max_running"], 2)
+
+    def test_auto_wlm(self):
+        # auto wlm reports -1 slots
+        scheduler = WlmScheduler(FakeWlmCatalog(slots=-1))
+        self.assertEqual(scheduler.capacity, AUTO_WLM_SLOTS)
+        scheduler = WlmScheduler(FakeWlmCatalog(slots=-1), max_workers=3)
+        self.assertEqual(scheduler.capacity, 3)
+        scheduler.run(self.connect, [("INSERT", False)] * 6 + [("JOIN", True)] * 2)
+        self.assertLessEqual(self.tracker["max_running"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,22 @@
+import os
+import uuid
 import configparser
 import numpy as np
 import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
 
 from redshift_etl_template.src import sql_queries, utils
+from redshift_etl_template.src.backends import get_backend
 from redshift_etl_template.constants import logger, CONFIG_PATH_DWH_CURRENT
 
 # CONFIG
 config = configparser.ConfigParser()
 config.read(CONFIG_PATH_DWH_CURRENT)
 
+# warehouse of the configured cluster, set to postgres to run the suites against a local database
+TEST_BACKEND = os.environ.get("ETL_TEST_BACKEND", "redshift")
+
 """Queries to fill Staging tables from S3"""
 staging_events_copy_sample = ("""COPY staging_events FROM '{}/2018/11/2018-11'
 CREDENTIALS 'aws_iam_role={}'
@@ -50,7 +58,7 @@ staging_events_table_insert_manual = """INSERT INTO staging_events (
     userAgent,
     userId
 ) 
-VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+VALUES %s
 """
 staging_songs_table_insert_manual = """
 INSERT INTO staging_songs (
@@ -65,9 +73,38 @@ INSERT INTO staging_songs (
     title,
     year
 )
-VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+VALUES %s
 """
 
+"""Functions to isolate every test in its own schema"""
+
+
+def connect_test_schema():
+    """Connect to the database and create a schema used only by the calling test,
+    so that tests running in parallel workers do not share any table.
+    The schema becomes the search path of the connection, the queries of the project are unchanged.
+
+    Returns:
+        psycopg2.connection, cursor, name of the schema
+    """
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    cur = get_backend(TEST_BACKEND, conn, config).cursor()
+    schema = "test_{}_{}".format(os.environ.get("PYTEST_XDIST_WORKER", "main"), uuid.uuid4().hex[:8])
+    cur.execute("CREATE SCHEMA {};".format(schema))
+    cur.execute("SET search_path TO {};".format(schema))
+    # commit, so that a rollback of the test does not reset the search path
+    conn.commit()
+    return conn, cur, schema
+
+
+def drop_test_schema(conn, cur, schema):
+    """Drop the schema of a test with all its tables and close the connection"""
+    conn.rollback()
+    cur.execute("DROP SCHEMA IF EXISTS {} CASCADE;".format(schema))
+    conn.commit()
+    conn.close()
+
+
 """Functions to fill staging tables with custom data"""
 
 
@@ -100,10 +137,10 @@ def create_and_fill_log_staging_from_dataframe(cur, df, viz=True):
     ]]
     # fix data to stage only admissible userid
     df = df.loc[df.userId != '', :]
-    for i, row in df.iterrows():
-        cur.execute(staging_events_table_insert_manual, row)
+    # insert all the rows with a single statement
+    execute_values(cur, staging_events_table_insert_manual, df.itertuples(index=False, name=None))
     # check table
-    df_table = utils.get_top_elements_from_table(cur, "staging_events", viz=viz)
+    df_table = utils.get_top_elements_from_table(cur, "staging_events", viz=viz, compact=False)
     return df_table
 
 
@@ -128,11 +165,11 @@ def create_and_fill_songs_staging_from_dataframe(cur, df, viz=True):
     ]]
     # prevent postgres to store nans
     df = df.where(pd.notnull(df), None)
-    for i, row in df.iterrows():
-        cur.execute(staging_songs_table_insert_manual, row)
+    # insert all the rows with a single statement
+    execute_values(cur, staging_songs_table_insert_manual, df.itertuples(index=False, name=None))
 
     # check table
-    df_table = utils.get_top_elements_from_table(cur, "staging_songs", viz=viz)
+    df_table = utils.get_top_elements_from_table(cur, "staging_songs", viz=viz, compact=False)
     return df_table
 
 
@@ -140,20 +177,29 @@ def create_and_fill_songs_staging_from_dataframe(cur, df, viz=True):
 
 
 def create_and_fill_users_from_staged_events(cur, viz=True):
-    """Copy data from staged events into a new table of users"""
+    """Copy data from staged events into a new table of users, recording their versions in users_history"""
     cur.execute(sql_queries.user_table_drop)
     cur.execute(sql_queries.user_table_create)
+    for query in sql_queries.users_scd_queries:
+        cur.execute(query)
     cur.execute(sql_queries.user_table_insert)
-    df_users = utils.get_top_elements_from_table(cur, "users", 10, viz=viz)
+    df_users = utils.get_top_elements_from_table(cur, "users", 10, viz=viz, compact=False)
     return df_users
 
 
+def get_users_history(cur):
+    """Get the versions of the users, ordered by user and validity"""
+    cur.execute("SELECT user_id, level, valid_from, valid_to, is_current FROM users_history "
+                "ORDER BY user_id, valid_from;")
+    return utils.get_typed_dataframe(cur.fetchall(), cur.description)
+
+
 def create_and_fill_time_from_staged_events(cur, viz=True):
     """Copy data from staged events into a new table of time"""
     cur.execute(sql_queries.time_table_drop)
     cur.execute(sql_queries.time_table_create)
     cur.execute(sql_queries.time_table_insert)
-    df_time = utils.get_top_elements_from_table(cur, "time", 10, viz=viz)
+    df_time = utils.get_top_elements_from_table(cur, "time", 10, viz=viz, compact=False)
     return df_time
 
 
@@ -162,7 +208,7 @@ def create_and_fill_songs_from_staged_songs(cur, viz=True):
     cur.execute(sql_queries.song_table_drop)
     cur.execute(sql_queries.song_table_create)
     cur.execute(sql_queries.song_table_insert)
-    df_songs = utils.get_top_elements_from_table(cur, "songs", 10, viz=viz)
+    df_songs = utils.get_top_elements_from_table(cur, "songs", 10, viz=viz, compact=False)
     return df_songs
 
 
@@ -171,7 +217,7 @@ def create_and_fill_artist_from_staged_songs(cur, viz=True):
     cur.execute(sql_queries.artist_table_drop)
     cur.execute(sql_queries.artist_table_create)
     cur.execute(sql_queries.artist_table_insert)
-    df_artists = utils.get_top_elements_from_table(cur, "artists", 10, viz=viz)
+    df_artists = utils.get_top_elements_from_table(cur, "artists", 10, viz=viz, compact=False)
     return df_artists
 
 
@@ -179,8 +225,10 @@ def create_and_fill_songplays_from_staged_data(cur, viz=True):
     """Copy data from staged songs and events into a new table of songplays"""
     cur.execute(sql_queries.songplay_table_drop)
     cur.execute(sql_queries.songplay_table_create)
+    for query in sql_queries.songplays_delta_queries:
+        cur.execute(query)
     cur.execute(sql_queries.songplay_table_insert)
-    df_songsplay = utils.get_top_elements_from_table(cur, "songplays", 10, viz=viz)
+    df_songsplay = utils.get_top_elements_from_table(cur, "songplays", 10, viz=viz, compact=False)
     return df_songsplay
 
 